@@ -0,0 +1,454 @@
+"""Benchmarks of the onredis hot paths.
+
+Run against a redis-server spawned on a free local port (no persistence),
+stopped at the end of the run:
+
+    python benchmarks/bench.py --output before.json
+    python benchmarks/bench.py --output after.json
+    python benchmarks/bench.py --compare before.json after.json
+
+Each benchmark reports the operations per second, the latency percentiles
+and the number of round trips to Redis per operation.
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import redis
+
+# run from a checkout: python benchmarks/bench.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import onredis  # noqa: E402
+from onredis import onredis as onredis_class, set_redis_client  # noqa: E402
+from onredis.__version__ import __version__  # noqa: E402
+
+PERCENTILES = (50, 90, 99)
+
+
+class CountingConnection(redis.Connection):
+    """Count the round trips: a command or a whole pipeline is sent with one call."""
+
+    round_trips = 0
+    lock = threading.Lock()
+
+    def send_packed_command(self, command, check_health=True):
+        with CountingConnection.lock:
+            CountingConnection.round_trips += 1
+        return super().send_packed_command(command, check_health)
+
+
+def round_trips() -> int:
+    return CountingConnection.round_trips
+
+
+class RedisServer:
+    """redis-server on a free port, without persistence."""
+
+    def __init__(self, executable="redis-server"):
+        path = shutil.which(executable)
+        if path is None:
+            raise SystemExit(f"{executable} not found, see --redis-server")
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        self.process = subprocess.Popen(
+            [path, "--port", str(self.port), "--bind", "127.0.0.1"]
+            + ["--save", "", "--appendonly", "no"],
+            stdout=subprocess.DEVNULL,
+        )
+
+    def client(self) -> redis.Redis:
+        pool = redis.ConnectionPool(
+            connection_class=CountingConnection, host="127.0.0.1", port=self.port
+        )
+        client = redis.Redis(connection_pool=pool)
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                client.ping()
+                return client
+            except redis.exceptions.ConnectionError:
+                if time.monotonic() > deadline or self.process.poll() is not None:
+                    raise
+                time.sleep(0.05)
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+class Result:
+    __slots__ = ("name", "latencies", "elapsed", "round_trips", "extra")
+
+    def __init__(self, name, latencies, elapsed, round_trips, extra=None):
+        self.name = name
+        self.latencies = latencies
+        self.elapsed = elapsed
+        self.round_trips = round_trips
+        self.extra = extra or {}
+
+    def to_json(self) -> Dict:
+        count = len(self.latencies)
+        latencies = sorted(self.latencies)
+        result = {
+            "name": self.name,
+            "operations": count,
+            "ops_per_sec": count / self.elapsed if self.elapsed else 0.0,
+            "mean_us": statistics.mean(latencies) * 1e6,
+            "round_trips_per_op": self.round_trips / count,
+        }
+        for p in PERCENTILES:
+            result[f"p{p}_us"] = latencies[min(count - 1, count * p // 100)] * 1e6
+        result.update(self.extra)
+        return result
+
+
+def measure(name: str, func: Callable, duration: float, min_ops=10) -> Result:
+    """Call func() during duration seconds (at least min_ops times)."""
+    func()  # warm up
+    latencies = []
+    start_round_trips = round_trips()
+    start = time.perf_counter()
+    end = start + duration
+    now = start
+    while now < end or len(latencies) < min_ops:
+        func()
+        last, now = now, time.perf_counter()
+        latencies.append(now - last)
+    return Result(name, latencies, now - start, round_trips() - start_round_trips)
+
+
+def measure_threads(
+    name: str, func: Callable, threads: int, duration: float, min_ops=10
+) -> Result:
+    """Call func() in threads threads during duration seconds."""
+    latencies: List[float] = []
+    barrier = threading.Barrier(threads + 1)
+
+    def run():
+        thread_latencies = []
+        barrier.wait()
+        end = time.perf_counter() + duration
+        now = time.perf_counter()
+        while now < end or len(thread_latencies) < min_ops:
+            func()
+            last, now = now, time.perf_counter()
+            thread_latencies.append(now - last)
+        latencies.extend(thread_latencies)
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    start_round_trips = round_trips()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    return Result(name, latencies, elapsed, round_trips() - start_round_trips)
+
+
+@onredis_class
+class Scalars:
+    i: int = 0
+    f: float = 0.0
+    s: str = ""
+    b: bytes = b""
+    flag: bool = False
+    obj: Any = {}
+    h: Dict[str, int] = {}
+
+
+@onredis_class(native_numbers=True)
+class NativeScalars:
+    i: int = 0
+
+
+@onredis_class(layout="hash")
+class HashScalars:
+    i: int = 0
+    s: str = ""
+
+
+@onredis_class
+class Hits:
+    value: int = 0
+
+
+@onredis_class
+class Record:
+    name: str = ""
+    score: float = 0.0
+    tags: Dict[str, int] = {}
+
+
+FIELD_VALUES = {
+    "i": 123456,
+    "f": 3.1415927,
+    "s": "x" * 64,
+    "b": b"y" * 64,
+    "flag": True,
+    "obj": {"a": [1, 2, 3], "b": "text"},
+}
+
+
+def bench_fields(duration) -> List[Result]:
+    results = []
+    for cls, field_values in (
+        (Scalars, FIELD_VALUES),
+        (NativeScalars, {"i": 123456}),
+        (HashScalars, {"i": 123456, "s": "x" * 64}),
+    ):
+        obj = cls()
+        for field_name, value in field_values.items():
+            prefix = f"field.{cls.__name__}.{field_name}"
+            results.append(
+                measure(
+                    prefix + ".set",
+                    lambda: setattr(obj, field_name, value),
+                    duration,
+                )
+            )
+            results.append(
+                measure(prefix + ".get", lambda: getattr(obj, field_name), duration)
+            )
+    native = NativeScalars()
+    results.append(
+        measure("field.NativeScalars.i.incr", lambda: native.incr("i"), duration)
+    )
+    return results
+
+
+def bench_dictionary(duration, sizes) -> List[Result]:
+    results = []
+    obj = Scalars()
+    for size in sizes:
+        obj.h = {}
+        proxy = obj.h
+        for start in range(0, size, 10000):
+            proxy.update({f"k{i}": i for i in range(start, min(size, start + 10000))})
+        keys = [f"k{i}" for i in range(size)]
+        cycle = itertools.cycle(keys)
+        some_keys = keys[:100]
+        prefix = f"dict.{size}"
+        results += [
+            measure(prefix + ".getitem", lambda: proxy[next(cycle)], duration),
+            measure(
+                prefix + ".setitem",
+                lambda: proxy.__setitem__(next(cycle), 1),
+                duration,
+            ),
+            measure(prefix + ".contains", lambda: next(cycle) in proxy, duration),
+            measure(prefix + ".len", lambda: len(proxy), duration),
+            measure(
+                prefix + ".get_many_100", lambda: proxy.get_many(some_keys), duration
+            ),
+            measure(
+                prefix + ".items",
+                lambda: sum(1 for _ in proxy.items()),
+                duration,
+                min_ops=1,
+            ),
+            measure(
+                prefix + ".transaction_read",
+                lambda: _read_in_transaction(obj),
+                duration,
+                min_ops=1,
+            ),
+        ]
+    obj.h = {}
+    return results
+
+
+def _read_in_transaction(obj):
+    with obj.transaction():
+        return obj.h
+
+
+def bench_transactions(duration, threads) -> List[Result]:
+    counter = Hits()
+
+    def increment():
+        counter.value += 1
+
+    results = []
+    for count in sorted({1, threads}):
+        counter.transaction_stats.reset()
+        if count == 1:
+            result = measure(
+                "transaction.1_thread",
+                lambda: counter.run_transaction(increment),
+                duration,
+            )
+        else:
+            result = measure_threads(
+                f"transaction.{count}_threads",
+                lambda: counter.run_transaction(increment),
+                count,
+                duration,
+            )
+        stats = counter.transaction_stats
+        result.extra = {
+            "conflict_rate": stats.conflict_rate,
+            "retries": stats.retries,
+            "exhausted": stats.exhausted,
+        }
+        results.append(result)
+    return results
+
+
+def bench_objects(duration) -> List[Result]:
+    classes = [Scalars, NativeScalars, HashScalars, Hits, Record]
+
+    def check():
+        for cls in classes:
+            cls._schema_checked = False
+        onredis.check_schemas(classes)
+
+    ids = itertools.count()
+    records = {i: {"name": f"n{i}", "score": i / 2} for i in range(1000)}
+    return [
+        measure("schema.check_schemas_5_classes", check, duration),
+        measure("instance.singleton", Scalars, duration),
+        measure("instance.keyed_new", lambda: Record(id=next(ids)), duration),
+        measure(
+            "instance.save_many_1000",
+            lambda: Record.save_many(records),
+            duration,
+            min_ops=1,
+        ),
+        measure(
+            "instance.load_many_1000",
+            lambda: Record.load_many(range(1000)),
+            duration,
+            min_ops=1,
+        ),
+    ]
+
+
+def run(args) -> Dict:
+    server = RedisServer(args.redis_server)
+    try:
+        client = server.client()
+        set_redis_client(client)
+        onredis.check_schemas()
+        groups = {
+            "fields": lambda: bench_fields(args.duration),
+            "dict": lambda: bench_dictionary(args.duration, args.sizes),
+            "transactions": lambda: bench_transactions(args.duration, args.threads),
+            "objects": lambda: bench_objects(args.duration),
+        }
+        results = []
+        for group in args.groups:
+            for result in groups[group]():
+                result = result.to_json()
+                print(_format_result(result), flush=True)
+                results.append(result)
+        info = client.info("server")
+    finally:
+        server.stop()
+    return {
+        "meta": {
+            "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "onredis": __version__,
+            "redis_py": redis.__version__,
+            "redis_server": info.get("redis_version"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "duration": args.duration,
+            "threads": args.threads,
+        },
+        "results": results,
+    }
+
+
+def _format_result(result: Dict) -> str:
+    percentiles = " ".join(f"p{p}={result[f'p{p}_us']:9.1f}us" for p in PERCENTILES)
+    return (
+        f"{result['name']:40} {result['ops_per_sec']:12.1f} ops/s  {percentiles}"
+        f"  rt/op={result['round_trips_per_op']:.2f}"
+        + (
+            f"  conflicts={result['conflict_rate']:.1%}"
+            if "conflict_rate" in result
+            else ""
+        )
+    )
+
+
+def compare(before_path: str, after_path: str):
+    with open(before_path) as f:
+        before = {r["name"]: r for r in json.load(f)["results"]}
+    with open(after_path) as f:
+        after = {r["name"]: r for r in json.load(f)["results"]}
+    print(
+        f"{'benchmark':40} {'before ops/s':>12} {'after ops/s':>12} {'change':>8}"
+        f" {'p99 before':>11} {'p99 after':>11} {'rt/op':>11}"
+    )
+    for name in list(before) + [name for name in after if name not in before]:
+        b, a = before.get(name), after.get(name)
+        if b is None or a is None:
+            print(f"{name:40} {'only in ' + ('after' if b is None else 'before'):>12}")
+            continue
+        change = a["ops_per_sec"] / b["ops_per_sec"] - 1 if b["ops_per_sec"] else 0.0
+        print(
+            f"{name:40} {b['ops_per_sec']:12.1f} {a['ops_per_sec']:12.1f} {change:+8.1%}"
+            f" {b['p99_us']:9.1f}us {a['p99_us']:9.1f}us"
+            f" {b['round_trips_per_op']:5.2f}->{a['round_trips_per_op']:<5.2f}"
+        )
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BEFORE", "AFTER"),
+        help="compare two JSON files written by --output",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=1.0, help="seconds per benchmark"
+    )
+    parser.add_argument(
+        "--threads", type=int, default=8, help="threads of the contended transactions"
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10, 1000, 100000],
+        help="sizes of the dictionaries",
+    )
+    parser.add_argument(
+        "--groups",
+        nargs="+",
+        choices=["fields", "dict", "transactions", "objects"],
+        default=["fields", "dict", "transactions", "objects"],
+    )
+    parser.add_argument("--redis-server", default="redis-server")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    report = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
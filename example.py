@@ -40,30 +40,29 @@ print(DataStruct) # <-- @onredis has defined the __repr__ method
 
 DataStruct.g = 13.37
 
+def update():
+    # do some random stuff
+    DataStruct.a += 1
+    if DataStruct.a % 2 == 0:
+        DataStruct.b += chr(65 + (DataStruct.a % 26)) + chr(96 + (DataStruct.a % 26))
+    else:
+        DataStruct.b = DataStruct.b[2:]
+    DataStruct.c = not DataStruct.c
+    DataStruct.f['a'] = len(DataStruct.b)
+    DataStruct.f[DataStruct.b] = DataStruct.f['a'] * 2
+    DataStruct.d = (DataStruct.d | DataStruct.a) & 255
+
+
 def test():
     with DataStruct.transaction():
-        # do some random stuff
-        DataStruct.a += 1
-        if DataStruct.a % 2 == 0:
-            DataStruct.b += chr(65 + (DataStruct.a % 26)) + chr(96 + (DataStruct.a % 26))
-        else:
-            DataStruct.b = DataStruct.b[2:]
-        DataStruct.c = not DataStruct.c
-        DataStruct.f['a'] = len(DataStruct.b)
-        DataStruct.f[DataStruct.b] = DataStruct.f['a'] * 2
-        DataStruct.d = (DataStruct.d | DataStruct.a) & 255
+        update()
 
 
 def loop():
-    ok = 0
-    conflict = 0
     for i in range(1, 10):
-        try:
-            test()
-            ok += 1
-        except redis.exceptions.WatchError:
-            conflict += 1
-    print('ok', ok, 'conflict', conflict)
+        # retry the transaction on redis.exceptions.WatchError
+        DataStruct.run_transaction(update)
+    print(DataStruct.transaction_stats)
 
 
 def multithread():
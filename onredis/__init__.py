@@ -1,14 +1,95 @@
 import redis
 import redis.lock
+import weakref
 from types import FunctionType
+from typing import Any, Dict, Iterable, List, Mapping
 
-from onredis.transaction import OnRedisTransaction
+from onredis.transaction import (
+    OnRedisMultiTransaction,
+    OnRedisTransaction,
+    ThreadLocalCopy,
+    RetryPolicy,
+    TransactionMode,
+    TransactionStats,
+    get_transaction_mode,
+    run_transaction,
+    transaction,
+    transactional,
+)
 
-from .client import get_redis_client, set_redis_client
-from .fields import get_field
+from .batch import OnRedisBatch, batch
+from .cache import (
+    FieldCache,
+    enable_client_cache,
+    disable_client_cache,
+    get_client_cache,
+)
+from .client import (
+    ReplicaRouter,
+    get_redis_client,
+    record_write,
+    set_read_replicas,
+    set_redis_client,
+)
+from .instrumentation import (
+    Instrumentation,
+    MetricsAggregator,
+    enable_instrumentation,
+    disable_instrumentation,
+    get_instrumentation,
+)
+from .schema import check_schemas, migrate, register, _batches
+from .snapshot import fetch_many, fetch_requests, queue_write
+from .fields import (
+    get_field,
+    ArrayField,
+    CollectionField,
+    DictionaryField,
+    CompressedField,
+    LazyLoadField,
+    NativeNumberField,
+    register_codec,
+    with_compression,
+)
+from .layout import KEYS_LAYOUT, LAYOUTS, object_prefix
+from .write_behind import WriteBuffer, configure_write_behind, flush_writes
 
 
-__all__ = ("onredis", "set_redis_client", "get_redis_client", "OnRedisLock")
+__all__ = (
+    "onredis",
+    "set_redis_client",
+    "get_redis_client",
+    "set_read_replicas",
+    "ReplicaRouter",
+    "OnRedisLock",
+    "fetch_many",
+    "check_schemas",
+    "migrate",
+    "RetryPolicy",
+    "TransactionMode",
+    "TransactionStats",
+    "transactional",
+    "transaction",
+    "OnRedisMultiTransaction",
+    "OnRedisBatch",
+    "batch",
+    "FieldCache",
+    "enable_client_cache",
+    "disable_client_cache",
+    "get_client_cache",
+    "Instrumentation",
+    "MetricsAggregator",
+    "enable_instrumentation",
+    "disable_instrumentation",
+    "get_instrumentation",
+    "WriteBuffer",
+    "configure_write_behind",
+    "flush_writes",
+    "LazyLoadField",
+    "ArrayField",
+    "CompressedField",
+    "register_codec",
+)
 
 
 def _set_qualname(cls, value):
@@ -29,74 +110,236 @@ def _set_new_attribute(cls, name, value):
     return False
 
 
-def _delete_invalid_data_format(cls, key):
-    redis_client = get_redis_client()
-    value = redis_client.get(key)
-    expected_value = bytes(repr(cls.__fields__), encoding="utf-8")
-    if value == expected_value:
-        return
-    # invalid field definition store on Redis
-    # delete the data
-    redis_client.set(key, expected_value)
-    keys = [v.key for v in cls.__fields__.values()]
-    redis_client.delete(b" ".join(keys))
+def _field_location(layout, object_prefix, field_name, field):
+    # a CollectionField is always stored in its own Redis key
+    if isinstance(field, CollectionField):
+        layout = KEYS_LAYOUT
+    return layout.location(object_prefix, field_name)
 
 
-def _process_class(cls):
+def _instance_redis_keys(cls, object_prefix):
+    # the location of each field for an object (see onredis.layout)
+    return {
+        field: _field_location(cls._layout, object_prefix, field_name, field)
+        for field_name, field in cls.__fields__.items()
+    }
+
+
+def _get_codec(compression):
+    # compression: False / None, True (zlib) or the name of a codec
+    if compression is True:
+        return "zlib"
+    return compression or None
+
+
+def _get_layout(layout):
+    if layout not in LAYOUTS:
+        raise ValueError(f"layout must be one of {', '.join(LAYOUTS)}, not {layout!r}")
+    return LAYOUTS[layout]
+
+
+def _write_behind_fields(cls, write_behind):
+    # write_behind: False, True (all the fields which support it) or field names
+    if write_behind is True:
+        return {
+            field_name
+            for field_name, field in cls.__fields__.items()
+            if field._write_behind_support
+        }
+    field_names = set(write_behind or ())
+    for field_name in field_names:
+        field = cls.__fields__.get(field_name)
+        if field is None:
+            raise ValueError(f"write_behind: {cls.__name__} has no field {field_name}")
+        if not field._write_behind_support:
+            raise TypeError(
+                f"write_behind: the writes of {field_name} ({field.__class__.__name__}) "
+                "can't be buffered"
+            )
+    return field_names
+
+
+def _process_class(
+    cls,
+    cache,
+    native_numbers,
+    layout,
+    compression,
+    cluster,
+    write_behind,
+    transaction_mode,
+):
     redis_prefix = f"{cls.__module__}.{cls.__name__}"
-    redis_lock_name = redis_prefix + "!lock"
-    redis_classid = redis_prefix + "!class"
+    # the prefix of the keys of the singleton
+    singleton_prefix = object_prefix(redis_prefix, cluster=cluster)
+    layout = _get_layout(layout)
 
     # initialize the fields
     _set_new_attribute(cls, "__fields__", {})
     cls__dict__ = cls.__dict__
     for field_name, field_type in cls__dict__.get("__annotations__", {}).items():
-        redis_key = bytes(redis_prefix + "." + field_name, encoding="utf-8")
         # read the default value and erase it
         default_value = None
         if field_name in cls__dict__:
             default_value = cls__dict__[field_name]
             delattr(cls, field_name)
         # create an instance of AbstractField or use the one provided as a default value
-        field = get_field(field_type, default_value)
+        field = get_field(field_type, default_value, native_numbers=native_numbers)
+        # opt-in compression of the pickled objects, strings and bytes
+        field = with_compression(field, _get_codec(compression))
         # set the Redis key
-        field._set_key(redis_key)
+        field._set_key(_field_location(layout, singleton_prefix, field_name, field))
+        # opt-in client side cache (see enable_client_cache)
+        field._set_cached(cache)
         # update the class attribute
         _set_new_attribute(cls, field_name, field)
         cls.__fields__[field_name] = field
 
+    # opt-in write-behind buffer (see onredis.write_behind)
+    for field_name in _write_behind_fields(cls, write_behind):
+        cls.__fields__[field_name]._set_write_behind(True)
+
     # add methods
     def cls__repr__(self) -> str:
         values = [
-            f"{field_name}={getattr(self, field_name)!r}"
-            for field_name in self.__fields__.keys()
+            f"{field_name}={value!r}" for field_name, value in self.fetch().items()
         ]
+        if self._id is not None:
+            values.insert(0, f"id={self._id!r}")
         values_str = ", ".join(values)
         return f"<{cls.__name__} {values_str}>"
 
+    def cls_fetch(self, *field_names) -> Dict[str, Any]:
+        # read the fields (all of them by default) in one round trip
+        return fetch_requests([(self, field_names)])[0]
+
+    def cls_lock_name(self) -> str:
+        # the lock of the object, taken by the locked transactions (see TransactionMode)
+        return object_prefix(redis_prefix, self._id, cluster) + "!lock"
+
     def cls_lock(self) -> redis.lock.Lock:
         if not hasattr(self, "_lock"):
             redis_client = get_redis_client()
-            self._lock = redis.lock.Lock(redis_client, redis_lock_name)
+            self._lock = redis.lock.Lock(redis_client, self._lock_name())
         return self._lock
 
-    def cls_transaction(self) -> OnRedisTransaction:
-        return OnRedisTransaction(self, cls)
+    def cls_transaction(self, lazy=False, locked=None) -> OnRedisTransaction:
+        return OnRedisTransaction(self, cls, lazy, locked)
+
+    def cls_batch(self) -> OnRedisBatch:
+        return OnRedisBatch(self)
+
+    def cls_run_transaction(
+        self, func, *args, policy=None, lazy=False, locked=None, **kwargs
+    ):
+        return run_transaction(
+            self, func, *args, policy=policy, lazy=lazy, locked=locked, **kwargs
+        )
+
+    def cls_incr(self, field_name, amount=1):
+        field = self.__fields__[field_name]
+        if not isinstance(field, NativeNumberField):
+            raise TypeError(
+                f"{field_name} is not a NativeNumberField: it can't be incremented by Redis"
+            )
+        return field.incr(self, amount)
+
+    def cls_dict_incr(self, field_name, key, amount=1):
+        field = self.__fields__[field_name]
+        if not isinstance(field, DictionaryField):
+            raise TypeError(f"{field_name} is not a DictionaryField")
+        return field.incr(self, key, amount)
 
-    def cls__new__(ncls):
+    def _array_field(field_name) -> ArrayField:
+        field = cls.__fields__[field_name]
+        if not isinstance(field, ArrayField):
+            raise TypeError(f"{field_name} is not an ArrayField")
+        return field
+
+    def cls_array_read(self, field_name, start, stop):
+        # read a range of elements without transferring the whole array
+        return _array_field(field_name).read_range(self, start, stop)
+
+    def cls_array_write(self, field_name, start, values):
+        # write a range of elements without transferring the whole array
+        return _array_field(field_name).write_range(self, start, values)
+
+    def cls_load_many(ncls, ids: Iterable, batch_size=1000) -> List[Dict[str, Any]]:
+        # read all the fields of the keyed instances, one round trip per batch
+        values = []
+        for chunk in _batches(ids, batch_size):
+            values.extend(fetch_requests([(cls(id=id), ()) for id in chunk]))
+        return values
+
+    def cls_save_many(ncls, records: Mapping[Any, Mapping[str, Any]], batch_size=1000):
+        # write the fields of the keyed instances (id -> {field name: value}),
+        # one round trip per batch, without transaction
+        # the buffered writes are older (see onredis.write_behind)
+        flush_writes()
+        cache = get_client_cache()
+        for chunk in _batches(records.items(), batch_size):
+            pipeline = get_redis_client().pipeline(transaction=False)
+            written_keys = []
+            for id, values in chunk:
+                written_keys.extend(queue_write(pipeline, cls(id=id), values))
+            pipeline.execute()
+            record_write()
+            if cache is not None:
+                for key in written_keys:
+                    cache.invalidate(key)
+
+    def cls__new__(ncls, id=None):
         # check if there are existing values in Redis with a previous definition of the class
-        _delete_invalid_data_format(cls, redis_classid)
-        # make there is only one instance since the Redis is on the class
-        if not hasattr(cls, "_singleton"):
-            cls._singleton = super(cls, ncls).__new__(cls)
-        return cls._singleton
+        # once per process (see check_schemas to check all the classes at startup)
+        if not cls._schema_checked:
+            check_schemas([cls])
+        if id is None:
+            # make there is only one instance since the Redis is on the class
+            if not hasattr(cls, "_singleton"):
+                cls._singleton = super(cls, ncls).__new__(cls)
+            return cls._singleton
+        # keyed instance: one object per id as long as it is referenced
+        instance = cls._instances.get(id)
+        if instance is None:
+            instance = super(cls, ncls).__new__(cls)
+            instance._id = id
+            instance._redis_keys = _instance_redis_keys(
+                cls, object_prefix(redis_prefix, id, cluster)
+            )
+            instance = cls._instances.setdefault(id, instance)
+        return instance
 
-    _set_new_attribute(cls, "_local_copy", False)
+    _set_new_attribute(cls, "_local_copy", ThreadLocalCopy())
+    _set_new_attribute(cls, "_redis_prefix", redis_prefix)
+    _set_new_attribute(cls, "_schema_checked", False)
+    _set_new_attribute(cls, "_layout", layout)
+    _set_new_attribute(cls, "_cluster", cluster)
+    _set_new_attribute(cls, "_id", None)
+    _set_new_attribute(
+        cls, "_redis_keys", _instance_redis_keys(cls, singleton_prefix)
+    )
+    _set_new_attribute(cls, "_instances", weakref.WeakValueDictionary())
     _set_new_attribute(cls, "__repr__", cls__repr__)
+    _set_new_attribute(cls, "fetch", cls_fetch)
+    _set_new_attribute(cls, "_lock_name", cls_lock_name)
     _set_new_attribute(cls, "lock", cls_lock)
     _set_new_attribute(cls, "transaction", cls_transaction)
+    _set_new_attribute(cls, "run_transaction", cls_run_transaction)
+    _set_new_attribute(cls, "batch", cls_batch)
+    _set_new_attribute(cls, "incr", cls_incr)
+    _set_new_attribute(cls, "dict_incr", cls_dict_incr)
+    _set_new_attribute(cls, "array_read", cls_array_read)
+    _set_new_attribute(cls, "array_write", cls_array_write)
+    _set_new_attribute(cls, "transaction_stats", TransactionStats())
+    _set_new_attribute(
+        cls, "_transaction_mode", get_transaction_mode(transaction_mode)
+    )
+    _set_new_attribute(cls, "load_many", classmethod(_set_qualname(cls, cls_load_many)))
+    _set_new_attribute(cls, "save_many", classmethod(_set_qualname(cls, cls_save_many)))
     _set_new_attribute(cls, "__new__", cls__new__)
 
+    register(cls)
+
     # define __slots__
     # cls_dict = dict(cls.__dict__)
     # cls_dict['__slots__'] = tuple('_lock', '_lock_value')
@@ -110,8 +353,68 @@ def _process_class(cls):
     return cls
 
 
-def onredis(cls):
+def onredis(
+    cls=None,
+    *,
+    cache=False,
+    native_numbers=False,
+    layout="keys",
+    compression=None,
+    cluster=False,
+    write_behind=False,
+    transaction_mode="optimistic",
+):
+    """Store the annotated fields of the class on Redis.
+
+    If cache is True, the field values are cached in the process memory once
+    the client side cache is enabled (see enable_client_cache).
+
+    If native_numbers is True, int and float are stored as decimal strings
+    (NativeIntField, NativeFloatField) instead of big-endian binary values,
+    so incr() and dict_incr() can update them atomically without WATCH.
+
+    If layout is "hash", the scalar fields of an object are stored in one Redis hash
+    (module.Class!fields) instead of one key per field (layout="keys"):
+    less memory per object, a transaction WATCHes one key and reads the fields with one HMGET.
+    A DictionaryField, ListField, SetField or SortedSetField is always stored
+    in its own Redis key.
+
+    If compression is True (zlib) or the name of a codec (see register_codec),
+    the pickled objects, strings and bytes (including the values of the dictionaries
+    and lists) bigger than 1 KB are compressed (see CompressedField).
+
+    If cluster is True, the keys of an object start with a hash tag
+    ({module.Class}.field, {module.Class:id}.field): they are in the same
+    Redis Cluster slot, so a transaction and the multi-key commands of an object
+    work with redis.cluster.RedisCluster. The objects are spread over the slots.
+
+    If write_behind is True (all the scalar fields) or a list of field names,
+    the writes of these fields outside a transaction are buffered in the process
+    and sent in one pipeline by a background thread (see configure_write_behind):
+    for counters and metrics written often, which can lose their last writes
+    if the process is killed. incr() returns None for these fields.
+
+    transaction_mode is "optimistic" (WATCH), "locked" (the transactions of an object
+    hold its lock), "adaptive" (locked while the conflict rate is high)
+    or a TransactionMode: see TransactionMode.
+    """
+
     def wrap(cls):
-        return _process_class(cls)
+        return _process_class(
+            cls,
+            cache,
+            native_numbers,
+            layout,
+            compression,
+            cluster,
+            write_behind,
+            transaction_mode,
+        )
+
+    # See if we're being called as @onredis or @onredis().
+    if cls is None:
+        # We're called with parens.
+        return wrap
 
+    # We're called as @onredis without parens.
     return wrap(cls)
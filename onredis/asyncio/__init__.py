@@ -0,0 +1,217 @@
+import weakref
+from typing import Any, Dict, Iterable, List, Mapping
+
+from .. import (
+    _set_new_attribute,
+    _set_qualname,
+    _field_location,
+    _get_codec,
+    _get_layout,
+    _instance_redis_keys,
+    _batches,
+)
+from ..fields import get_field, with_compression
+from ..layout import object_prefix
+from ..schema import register
+from ..snapshot import Snapshot, queue_write
+from ..transaction import TransactionStats
+from .client import get_redis_client, set_redis_client
+from .fields import (
+    AsyncField,
+    AsyncDictionaryField,
+    AsyncDictionnaryProxy,
+    get_async_field,
+)
+from .transaction import (
+    AsyncOnRedisTransaction,
+    ContextLocalCopy,
+    run_transaction,
+    transactional,
+)
+
+
+__all__ = (
+    "onredis",
+    "set_redis_client",
+    "get_redis_client",
+    "AsyncOnRedisTransaction",
+    "AsyncDictionnaryProxy",
+    "run_transaction",
+    "transactional",
+    "fetch_many",
+)
+
+
+async def fetch_requests(requests, redis_client=None) -> List[Dict[str, Any]]:
+    snapshot = Snapshot(requests)
+    pipeline = (redis_client or get_redis_client()).pipeline(
+        transaction=snapshot.atomic()
+    )
+    results = await pipeline.execute() if snapshot.queue(pipeline) else []
+    return snapshot.parse(results)
+
+
+async def fetch_many(*objs, redis_client=None) -> List[Dict[str, Any]]:
+    """Read all the fields of the objects in one round trip.
+
+    Return one dict per object: field name -> value.
+    """
+    return await fetch_requests([(obj, ()) for obj in objs], redis_client)
+
+
+def _process_class(cls, native_numbers, layout, compression, cluster):
+    redis_prefix = f"{cls.__module__}.{cls.__name__}"
+    # the prefix of the keys of the singleton
+    singleton_prefix = object_prefix(redis_prefix, cluster=cluster)
+    layout = _get_layout(layout)
+
+    # initialize the fields
+    _set_new_attribute(cls, "__fields__", {})
+    async_fields: Dict[str, AsyncField] = {}
+    cls__dict__ = cls.__dict__
+    for field_name, field_type in cls__dict__.get("__annotations__", {}).items():
+        # read the default value and erase it
+        default_value = None
+        if field_name in cls__dict__:
+            default_value = cls__dict__[field_name]
+            delattr(cls, field_name)
+        # create an instance of AbstractField or use the one provided as a default value
+        field = get_field(field_type, default_value, native_numbers=native_numbers)
+        # opt-in compression of the pickled objects, strings and bytes
+        field = with_compression(field, _get_codec(compression))
+        # set the Redis key
+        field._set_key(_field_location(layout, singleton_prefix, field_name, field))
+        # the class attribute is a descriptor returning awaitables
+        async_field = get_async_field(field_name, field)
+        _set_new_attribute(cls, field_name, async_field)
+        cls.__fields__[field_name] = field
+        async_fields[field_name] = async_field
+
+    # add methods
+    def cls__repr__(self) -> str:
+        fields_str = ", ".join(self.__fields__.keys())
+        if self._id is not None:
+            fields_str = f"id={self._id!r}, {fields_str}"
+        return f"<{cls.__name__} {fields_str}>"
+
+    async def cls_get(self, field_name):
+        async_field = async_fields[field_name]
+        if self._local_copy:
+            return async_field.__get__(self)
+        if isinstance(async_field, AsyncDictionaryField):
+            return await async_field.redis_get(self).to_dict()
+        return await async_field.redis_get(self)
+
+    async def cls_set(self, field_name, value):
+        async_field = async_fields[field_name]
+        if self._local_copy:
+            async_field.__set__(self, value)
+        else:
+            await async_field.redis_set(self, value)
+
+    async def cls_fetch(self, *field_names) -> Dict[str, Any]:
+        # read the fields (all of them by default) in one round trip
+        return (await fetch_requests([(self, field_names)]))[0]
+
+    async def cls_incr(self, field_name, amount=1):
+        return await async_fields[field_name].incr(self, amount)
+
+    async def cls_dict_incr(self, field_name, key, amount=1):
+        async_field = async_fields[field_name]
+        if not isinstance(async_field, AsyncDictionaryField):
+            raise TypeError(f"{field_name} is not a DictionaryField")
+        return await async_field.incr(self, key, amount)
+
+    def cls_transaction(self) -> AsyncOnRedisTransaction:
+        return AsyncOnRedisTransaction(self, cls)
+
+    async def cls_run_transaction(self, func, *args, policy=None, **kwargs):
+        return await run_transaction(self, func, *args, policy=policy, **kwargs)
+
+    async def cls_load_many(ncls, ids: Iterable, batch_size=1000) -> List[Dict[str, Any]]:
+        # read all the fields of the keyed instances, one round trip per batch
+        values = []
+        for batch in _batches(ids, batch_size):
+            values.extend(await fetch_requests([(cls(id=id), ()) for id in batch]))
+        return values
+
+    async def cls_save_many(
+        ncls, records: Mapping[Any, Mapping[str, Any]], batch_size=1000
+    ):
+        # write the fields of the keyed instances (id -> {field name: value}),
+        # one round trip per batch, without transaction
+        for batch in _batches(records.items(), batch_size):
+            pipeline = get_redis_client().pipeline(transaction=False)
+            for id, values in batch:
+                queue_write(pipeline, cls(id=id), values)
+            await pipeline.execute()
+
+    def cls__new__(ncls, id=None):
+        if id is None:
+            # make there is only one instance since the Redis is on the class
+            if not hasattr(cls, "_singleton"):
+                cls._singleton = super(cls, ncls).__new__(cls)
+            return cls._singleton
+        # keyed instance: one object per id as long as it is referenced
+        instance = cls._instances.get(id)
+        if instance is None:
+            instance = super(cls, ncls).__new__(cls)
+            instance._id = id
+            instance._redis_keys = _instance_redis_keys(
+                cls, object_prefix(redis_prefix, id, cluster)
+            )
+            instance = cls._instances.setdefault(id, instance)
+        return instance
+
+    _set_new_attribute(cls, "_local_copy", ContextLocalCopy(redis_prefix))
+    _set_new_attribute(cls, "_redis_prefix", redis_prefix)
+    _set_new_attribute(cls, "_schema_checked", False)
+    _set_new_attribute(cls, "_layout", layout)
+    _set_new_attribute(cls, "_cluster", cluster)
+    _set_new_attribute(cls, "_id", None)
+    _set_new_attribute(
+        cls, "_redis_keys", _instance_redis_keys(cls, singleton_prefix)
+    )
+    _set_new_attribute(cls, "_instances", weakref.WeakValueDictionary())
+    _set_new_attribute(cls, "__repr__", cls__repr__)
+    _set_new_attribute(cls, "get", cls_get)
+    _set_new_attribute(cls, "set", cls_set)
+    _set_new_attribute(cls, "fetch", cls_fetch)
+    _set_new_attribute(cls, "incr", cls_incr)
+    _set_new_attribute(cls, "dict_incr", cls_dict_incr)
+    _set_new_attribute(cls, "transaction", cls_transaction)
+    _set_new_attribute(cls, "run_transaction", cls_run_transaction)
+    _set_new_attribute(cls, "transaction_stats", TransactionStats())
+    _set_new_attribute(cls, "load_many", classmethod(_set_qualname(cls, cls_load_many)))
+    _set_new_attribute(cls, "save_many", classmethod(_set_qualname(cls, cls_save_many)))
+    _set_new_attribute(cls, "__new__", cls__new__)
+
+    # the schema is checked by onredis.check_schemas (with a synchronous client)
+    register(cls)
+
+    return cls
+
+
+def onredis(
+    cls=None,
+    *,
+    native_numbers=False,
+    layout="keys",
+    compression=None,
+    cluster=False,
+):
+    """Store the annotated fields of the class on Redis, using redis.asyncio.
+
+    See onredis.onredis
+    """
+
+    def wrap(cls):
+        return _process_class(cls, native_numbers, layout, compression, cluster)
+
+    # See if we're being called as @onredis or @onredis().
+    if cls is None:
+        # We're called with parens.
+        return wrap
+
+    # We're called as @onredis without parens.
+    return wrap(cls)
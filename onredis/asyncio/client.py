@@ -0,0 +1,35 @@
+import redis.asyncio
+from typing import Optional
+
+from ..client import with_pool
+
+
+REDIS_CLIENT: Optional[redis.asyncio.Redis] = None
+
+
+def set_redis_client(
+    redis_client: Optional[redis.asyncio.Redis] = None,
+    *,
+    max_connections: Optional[int] = None,
+    blocking: bool = False,
+    pool_timeout: float = 20,
+    health_check_interval: Optional[int] = None,
+) -> Optional[redis.asyncio.Redis]:
+    """Set the client of the @onredis classes, return it
+    (see onredis.set_redis_client for the pool options)."""
+    global REDIS_CLIENT
+    if max_connections is not None or blocking or health_check_interval is not None:
+        redis_client = with_pool(
+            redis_client or redis.asyncio.Redis(),
+            (redis.asyncio.ConnectionPool, redis.asyncio.BlockingConnectionPool),
+            max_connections,
+            blocking,
+            pool_timeout,
+            health_check_interval,
+        )
+    REDIS_CLIENT = redis_client
+    return redis_client
+
+
+def get_redis_client() -> redis.asyncio.Redis:
+    return REDIS_CLIENT
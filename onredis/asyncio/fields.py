@@ -0,0 +1,290 @@
+from ..fields import (
+    AbstractField,
+    CollectionField,
+    DictionaryField,
+    LazyLoadField,
+    NativeNumberField,
+)
+from ..fields.dictionary_field import SCAN_BATCH_SIZE, _MISSING
+from .client import get_redis_client
+
+
+class AsyncField:
+    """Descriptor wrapping an AbstractField for the asyncio classes.
+
+    Outside a transaction, reading the attribute returns an awaitable
+    and the attribute can't be set (use ``await obj.set(name, value)``).
+    Inside a transaction, the attribute is the value of the local copy.
+    """
+
+    __slots__ = ("name", "field")
+
+    def __init__(self, name: str, field: AbstractField):
+        self.name = name
+        self.field = field
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        if obj._local_copy:
+            # there is a transaction: read the local copy
+            return obj._local_copy.get(
+                self.field.redis_key(obj), self.field.default_value
+            )
+        # no transaction: read Redis
+        return self.redis_get(obj)
+
+    def __set__(self, obj, value):
+        if not obj._local_copy:
+            raise TypeError(
+                f"use 'await obj.set({self.name!r}, value)' to write {self.name!r} outside a transaction"
+            )
+        obj._local_copy[self.field.redis_key(obj)] = value
+
+    async def redis_get(self, obj):
+        field = self.field
+        raw = await obj._layout.get(get_redis_client(), field.redis_key(obj))
+        if raw is None:
+            return field.default_value
+        return field.deserialize(raw)
+
+    async def redis_set(self, obj, value):
+        field = self.field
+        location = field.redis_key(obj)
+        if value is None:
+            await obj._layout.delete(get_redis_client(), location)
+        else:
+            await obj._layout.set(get_redis_client(), location, field.serialize(value))
+
+    async def incr(self, obj, amount=1):
+        field = self.field
+        if not isinstance(field, NativeNumberField):
+            raise TypeError(
+                f"{self.name} is not a NativeNumberField: it can't be incremented by Redis"
+            )
+        if obj._local_copy:
+            value = (self.__get__(obj) or 0) + amount
+            self.__set__(obj, value)
+            return value
+        location = field.redis_key(obj)
+        layout = obj._layout
+        redis_client = get_redis_client()
+        if field.default_value:
+            # Redis starts from 0: initialize the field with the default value first
+            pipeline = redis_client.pipeline(transaction=True)
+            layout.set_default(pipeline, location, field.serialize(field.default_value))
+            layout.incr(pipeline, location, field, amount)
+            value = (await pipeline.execute())[-1]
+        else:
+            value = await layout.incr(redis_client, location, field, amount)
+        return field.deserialize(value) if isinstance(value, bytes) else value
+
+
+class AsyncDictionaryField(AsyncField):
+    """Outside a transaction, reading the attribute returns an AsyncDictionnaryProxy."""
+
+    __slots__ = ()
+
+    def redis_get(self, obj):
+        field = self.field
+        return AsyncDictionnaryProxy(
+            obj,
+            get_redis_client(),
+            field.redis_key(obj),
+            field.key_field,
+            field.value_field,
+        )
+
+    async def redis_set(self, obj, value):
+        pipeline = get_redis_client().pipeline(transaction=True)
+        self.field.write_all(pipeline, self.field.redis_key(obj), value)
+        await pipeline.execute()
+
+    async def incr(self, obj, key, amount=1):
+        if obj._local_copy:
+            # there is a transaction: update the local copy
+            local_dict = self.__get__(obj)
+            value = local_dict.get(key, 0) + amount
+            local_dict[key] = value
+            return value
+        return await self.redis_get(obj).incr(key, amount)
+
+
+class AsyncDictionnaryProxy:
+    """Access to a DictionaryField outside a transaction, all the methods are coroutines.
+
+    ``await proxy[key]`` reads an entry, ``await proxy.set(key, value)`` writes it,
+    ``async for key in proxy`` iterates over the keys with HSCAN.
+    """
+
+    __slots__ = ("obj", "redis_client", "redis_key", "key_field", "value_field")
+
+    def __init__(self, obj, redis_client, redis_key, key_field, value_field):
+        self.obj = obj
+        self.redis_client = redis_client
+        self.redis_key = redis_key
+        self.key_field = key_field
+        self.value_field = value_field
+
+    def _no_local_copy(self):
+        if self.obj._local_copy:
+            raise ValueError(
+                f"The AsyncDictionnaryProxy for {self.redis_key!r} was acquired before a transaction starts on {self.obj!r}"
+            )
+
+    async def __getitem__(self, key):
+        self._no_local_copy()
+        skey = self.key_field.serialize(key)
+        raw = await self.redis_client.hget(self.redis_key, skey)
+        if raw is None:
+            raise KeyError(key)
+        return self.value_field.deserialize(raw)
+
+    async def get(self, key, default=None):
+        try:
+            return await self[key]
+        except KeyError:
+            return default
+
+    async def set(self, key, item):
+        self._no_local_copy()
+        skey = self.key_field.serialize(key)
+        sitem = self.value_field.serialize(item)
+        await self.redis_client.hset(self.redis_key, skey, sitem)
+
+    async def get_many(self, keys, default=None) -> list:
+        """Read the values of keys with one HMGET, default for the missing keys."""
+        self._no_local_copy()
+        skeys = [self.key_field.serialize(key) for key in keys]
+        if not skeys:
+            return []
+        return [
+            default if raw is None else self.value_field.deserialize(raw)
+            for raw in await self.redis_client.hmget(self.redis_key, skeys)
+        ]
+
+    async def update(self, *args, **kwargs):
+        """Write the entries with one HSET."""
+        self._no_local_copy()
+        mapping = {
+            self.key_field.serialize(key): self.value_field.serialize(item)
+            for key, item in dict(*args, **kwargs).items()
+        }
+        if mapping:
+            await self.redis_client.hset(self.redis_key, mapping=mapping)
+
+    async def delete_many(self, keys) -> int:
+        """Delete the entries with one HDEL, return the number of deleted entries."""
+        self._no_local_copy()
+        skeys = [self.key_field.serialize(key) for key in keys]
+        if not skeys:
+            return 0
+        return await self.redis_client.hdel(self.redis_key, *skeys)
+
+    async def setdefault(self, key, default=None):
+        """Atomically set key to default if key is missing (HSETNX), return the value of key."""
+        self._no_local_copy()
+        skey = self.key_field.serialize(key)
+        pipeline = self.redis_client.pipeline(transaction=True)
+        pipeline.hsetnx(self.redis_key, skey, self.value_field.serialize(default))
+        pipeline.hget(self.redis_key, skey)
+        _, raw = await pipeline.execute()
+        return self.value_field.deserialize(raw)
+
+    async def pop(self, key, default=_MISSING):
+        """Atomically read and delete key (HGET and HDEL in one MULTI / EXEC block)."""
+        self._no_local_copy()
+        skey = self.key_field.serialize(key)
+        pipeline = self.redis_client.pipeline(transaction=True)
+        pipeline.hget(self.redis_key, skey)
+        pipeline.hdel(self.redis_key, skey)
+        raw, _ = await pipeline.execute()
+        if raw is None:
+            if default is _MISSING:
+                raise KeyError(key)
+            return default
+        return self.value_field.deserialize(raw)
+
+    async def delete(self, key):
+        self._no_local_copy()
+        skey = self.key_field.serialize(key)
+        await self.redis_client.hdel(self.redis_key, skey)
+
+    async def contains(self, key):
+        self._no_local_copy()
+        skey = self.key_field.serialize(key)
+        return True if await self.redis_client.hexists(self.redis_key, skey) else False
+
+    async def incr(self, key, amount=1):
+        """Increment the value of key with a single command (HINCRBY or HINCRBYFLOAT)."""
+        self._no_local_copy()
+        if not isinstance(self.value_field, NativeNumberField):
+            raise TypeError(
+                f"{self.value_field!r} is not a NativeNumberField: the values can't be incremented by Redis"
+            )
+        skey = self.key_field.serialize(key)
+        value = await self.value_field.redis_hincr(
+            self.redis_client, self.redis_key, skey, amount
+        )
+        return self.value_field.deserialize(value) if isinstance(value, bytes) else value
+
+    async def len(self):
+        self._no_local_copy()
+        return await self.redis_client.hlen(self.redis_key)
+
+    async def to_dict(self):
+        self._no_local_copy()
+        return {
+            self.key_field.deserialize(k): self.value_field.deserialize(v)
+            for k, v in (await self.redis_client.hgetall(self.redis_key)).items()
+        }
+
+    async def scan_items(self, batch_size=SCAN_BATCH_SIZE):
+        """Iterate over the entries with HSCAN, batch_size entries per round trip
+        (see DictionnaryProxy.items)."""
+        self._no_local_copy()
+        cursor = 0
+        while True:
+            cursor, raw_items = await self.redis_client.hscan(
+                self.redis_key, cursor, count=batch_size
+            )
+            for item in [
+                (self.key_field.deserialize(k), self.value_field.deserialize(v))
+                for k, v in raw_items.items()
+            ]:
+                yield item
+            if cursor == 0:
+                return
+
+    async def __aiter__(self):
+        async for key, _ in self.scan_items():
+            yield key
+
+    async def items(self):
+        return (await self.to_dict()).items()
+
+    async def values(self):
+        self._no_local_copy()
+        return [
+            self.value_field.deserialize(v)
+            for v in await self.redis_client.hvals(self.redis_key)
+        ]
+
+    async def keys(self):
+        self._no_local_copy()
+        return [
+            self.key_field.deserialize(k)
+            for k in await self.redis_client.hkeys(self.redis_key)
+        ]
+
+
+def get_async_field(name: str, field: AbstractField) -> AsyncField:
+    if isinstance(field, LazyLoadField):
+        raise TypeError(f"{name}: LazyLoadField is not supported by onredis.asyncio")
+    if isinstance(field, DictionaryField):
+        return AsyncDictionaryField(name, field)
+    if isinstance(field, CollectionField):
+        raise TypeError(
+            f"{name}: {field.__class__.__name__} is not supported by onredis.asyncio"
+        )
+    return AsyncField(name, field)
@@ -0,0 +1,174 @@
+import asyncio
+import contextvars
+import functools
+import time
+
+import redis.exceptions
+
+from ..fields.collection_field import CollectionField
+from ..instrumentation import get_instrumentation
+from ..transaction import DEFAULT_RETRY_POLICY, write_changes
+from .client import get_redis_client
+
+
+class ContextLocalCopy:
+    """Descriptor of the _local_copy attribute: the local copy of the transaction
+    running in the current asyncio task, False if there is none.
+    """
+
+    __slots__ = ("var",)
+
+    def __init__(self, name):
+        self.var = contextvars.ContextVar(name, default=None)
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        copies = self.var.get()
+        return copies.get(id(obj), False) if copies else False
+
+    def __set__(self, obj, value):
+        # copy on write: the tasks created inside the transaction share the context
+        copies = dict(self.var.get() or {})
+        if value is False:
+            copies.pop(id(obj), None)
+        else:
+            copies[id(obj)] = value
+        self.var.set(copies)
+
+
+class AsyncOnRedisTransaction:
+    """``async with obj.transaction():``
+
+    All the fields are WATCHed and read when the transaction starts,
+    then the attributes are local values (in the current task) until the transaction exits.
+    The changed fields are written in one MULTI / EXEC block.
+    """
+
+    __slots__ = ("instance", "cls", "pipeline", "execute", "raw_values")
+
+    def __init__(self, instance, cls):
+        self.instance = instance
+        self.cls = cls
+        self.execute = True
+        self.raw_values = {}
+
+    async def create_local_copy(self):
+        local_copy = {}
+        pipeline = self.pipeline
+        fields = [
+            (field, field.redis_key(self.instance))
+            for field in self.cls.__fields__.values()
+        ]
+
+        # abort the incoming transaction if any of the keys are changed
+        # (with the hash layout, the scalar fields share one key)
+        await pipeline.watch(
+            *{field.storage_key(self.instance): None for field, _ in fields}
+        )
+
+        # CollectionField: use a Python dict, list, ... (do not use the proxy)
+        scalar_fields = []
+        for field, key in fields:
+            if isinstance(field, CollectionField):
+                raw = await field.read_raw(pipeline, key)
+                local_copy[key] = field.local_copy_from_raw(raw)
+            else:
+                scalar_fields.append((field, key))
+
+        # other field types
+        if scalar_fields:
+            values = await self.instance._layout.read(
+                pipeline, [key for _, key in scalar_fields]
+            )
+            for raw, (field, key) in zip(values, scalar_fields):
+                self.raw_values[key] = raw
+                local_copy[key] = field.local_value(raw)
+
+        # after the following line, the fields returns the value of local_copy
+        self.instance._local_copy = local_copy
+
+        # start a Redis transaction
+        pipeline.multi()
+
+    def write_local_copy(self):
+        local_copy = self.instance._local_copy
+        self.instance._local_copy = False
+        write_changes(self.pipeline, self.instance, local_copy, self.raw_values)
+
+    async def __aenter__(self):
+        self.pipeline = get_redis_client().pipeline(transaction=True)
+        try:
+            await self.create_local_copy()
+        except BaseException:
+            # __aexit__ is not called: release the connection of the WATCH
+            self.instance._local_copy = False
+            await self.pipeline.reset()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if self.execute and exc_type is None:
+                self.write_local_copy()
+                try:
+                    await self.pipeline.execute()
+                except redis.exceptions.WatchError:
+                    self.instance.transaction_stats.add(attempts=1, conflicts=1)
+                    instrumentation = get_instrumentation()
+                    if instrumentation is not None:
+                        instrumentation.conflict(self.instance._redis_prefix)
+                    raise
+                self.instance.transaction_stats.add(attempts=1)
+            else:
+                # the transaction was aborted OR there is an exception
+                self.instance._local_copy = False
+        finally:
+            await self.pipeline.reset()
+
+    def discard(self):
+        self.execute = False
+
+
+async def run_transaction(instance, func, *args, policy=None, **kwargs):
+    """Await func(*args, **kwargs) inside instance.transaction(), retry on WatchError.
+
+    See onredis.transaction.run_transaction.
+    """
+    policy = policy or DEFAULT_RETRY_POLICY
+    stats = instance.transaction_stats
+    start_time = time.monotonic()
+    attempt = 0
+    while True:
+        try:
+            async with instance.transaction():
+                result = await func(*args, **kwargs)
+            return result
+        except redis.exceptions.WatchError:
+            attempt += 1
+            delay = policy.delay(attempt)
+            elapsed = time.monotonic() - start_time
+            if attempt >= policy.max_attempts or (
+                policy.budget is not None and elapsed + delay > policy.budget
+            ):
+                stats.add(exhausted=1)
+                raise
+            await asyncio.sleep(delay)
+            stats.add(retries=1, retry_time=delay)
+
+
+def transactional(func=None, *, policy=None):
+    """Decorator for the coroutine methods of an asyncio @onredis class:
+    the method runs inside a transaction, retried on conflict (see run_transaction).
+    """
+
+    def wrap(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            return await run_transaction(self, func, self, *args, policy=policy, **kwargs)
+
+        return wrapper
+
+    if func is None:
+        return wrap
+    return wrap(func)
@@ -0,0 +1,75 @@
+from . import client
+from .cache import get_client_cache
+from .client import record_write, reset_batch_client, set_batch_client
+from .instrumentation import start_measure
+
+
+class OnRedisBatch:
+    """Send the writes of the with block in one round trip, without transaction.
+
+    Outside a transaction, the field sets and the writes of the proxies which do not
+    return a value (dictionary __setitem__, update, list append, ...) are queued
+    in one pipeline, sent without MULTI / EXEC when the block exits: nothing is read
+    nor WATCHed, the writes are not isolated from the other clients.
+    incr() and dict_incr() return None. pop(), remove() and setdefault() raise ValueError.
+
+    The reads inside the block do not see the queued writes. The writes are discarded
+    if the block raises an exception. A nested batch is part of the outer batch.
+    """
+
+    __slots__ = ("objects", "pipeline", "client_token")
+
+    def __init__(self, *objects):
+        # the objects whose cached fields are invalidated after the writes
+        self.objects = objects
+        self.pipeline = None
+        self.client_token = None
+
+    def __enter__(self):
+        if client.BATCH_CLIENT.get() is not None:
+            # nested batch
+            return self
+        # not the pipeline of a transaction running in this thread (see get_redis_client)
+        self.pipeline = client.REDIS_CLIENT.pipeline(transaction=False)
+        self.client_token = set_batch_client(self.pipeline)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.pipeline is None:
+            return
+        pipeline = self.pipeline
+        self.pipeline = None
+        reset_batch_client(self.client_token)
+        self.client_token = None
+        try:
+            if exc_type is None and len(pipeline):
+                self.execute(pipeline)
+        finally:
+            pipeline.reset()
+
+    def execute(self, pipeline):
+        # see enable_instrumentation
+        measure = (
+            start_measure(self.objects[0], None, "batch") if self.objects else None
+        )
+        error = True
+        try:
+            pipeline.execute()
+            error = False
+        finally:
+            if measure is not None:
+                measure.stop(error)
+        record_write()
+        # a value cached between the write and the invalidation message from Redis
+        cache = get_client_cache()
+        if cache is not None:
+            for obj in self.objects:
+                for field in obj.__fields__.values():
+                    if field.cached:
+                        cache.invalidate(field.storage_key(obj))
+
+
+def batch(*objects) -> OnRedisBatch:
+    """Send the writes of the with block in one round trip, without transaction
+    (see OnRedisBatch): with onredis.batch(a, b): ..."""
+    return OnRedisBatch(*objects)
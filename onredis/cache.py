@@ -0,0 +1,240 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence
+
+import redis
+import redis.exceptions
+
+from .client import get_redis_client
+
+
+INVALIDATE_CHANNEL = b"__redis__:invalidate"
+MISSING = object()
+
+
+class FieldCache:
+    """Client side cache of the raw values read from Redis.
+
+    The cache is kept coherent with Redis server-assisted client side caching:
+    a dedicated connection enables ``CLIENT TRACKING`` in broadcasting mode,
+    redirects the invalidation messages to itself and subscribes to
+    ``__redis__:invalidate``. A background thread evicts the keys changed by
+    any Redis client. While this connection is lost, the cache is empty and the values
+    read are not stored.
+
+    The entries are the raw bytes (not the deserialized values, which can be
+    mutable) indexed by ``(redis_key, hash_field)``, ``hash_field`` is None
+    for the scalar fields. At most ``max_size`` entries are kept, the least
+    recently used entry is evicted first.
+
+    See https://redis.io/docs/manual/client-side-caching/
+    """
+
+    def __init__(
+        self,
+        redis_client: redis.Redis,
+        max_size: int = 10000,
+        prefixes: Optional[Sequence[str]] = None,
+    ):
+        self.redis_client = redis_client
+        self.max_size = max_size
+        self.prefixes = list(prefixes or [])
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[tuple, Optional[bytes]]" = OrderedDict()
+        self._by_key: Dict[bytes, set] = {}
+        # the loads in progress by Redis key: a value read before an invalidation
+        # of its key must not be stored
+        self._loads: Dict[bytes, set] = {}
+        # False while the invalidation messages can be lost (see _listen)
+        self._connected = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._connection = None
+        self._connect()
+        self._connected = True
+        self._thread = threading.Thread(
+            target=self._listen, name="onredis-cache-invalidation", daemon=True
+        )
+        self._thread.start()
+
+    def _connect(self):
+        # a dedicated connection: it is never returned to the pool
+        connection = self.redis_client.connection_pool.make_connection()
+        connection.connect()
+        connection.send_command("CLIENT", "ID")
+        client_id = connection.read_response()
+        args = ["CLIENT", "TRACKING", "ON", "REDIRECT", client_id, "BCAST"]
+        for prefix in self.prefixes:
+            args += ["PREFIX", prefix]
+        connection.send_command(*args)
+        connection.read_response()
+        connection.send_command("SUBSCRIBE", INVALIDATE_CHANNEL)
+        connection.read_response()
+        self._connection = connection
+
+    def _listen(self):
+        while not self._stop.is_set():
+            try:
+                if not self._connection.can_read(timeout=1.0):
+                    continue
+                response = self._connection.read_response()
+            except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError):
+                if self._stop.is_set():
+                    return
+                # the invalidation messages may be lost: forget everything,
+                # do not store the values read until the tracking is enabled again
+                with self._lock:
+                    self._connected = False
+                self.clear()
+                self._reconnect()
+                continue
+            if (
+                isinstance(response, list)
+                and len(response) == 3
+                and response[0] == b"message"
+                and response[1] == INVALIDATE_CHANNEL
+            ):
+                keys = response[2]
+                if keys is None:
+                    # FLUSHALL / FLUSHDB
+                    self.clear()
+                else:
+                    for key in keys:
+                        self.invalidate(key)
+
+    def _reconnect(self):
+        self._connection.disconnect()
+        while not self._stop.is_set():
+            try:
+                self._connect()
+            except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError):
+                self._stop.wait(1.0)
+                continue
+            # the values cached during the reconnection may be stale
+            with self._lock:
+                self._connected = True
+                self._clear()
+            return
+
+    def fetch(self, redis_key: bytes, hash_field: Optional[bytes], loader):
+        """Return the raw value of ``(redis_key, hash_field)``.
+
+        ``loader`` is called to read the value from Redis when the entry is not cached.
+        """
+        entry_key = (redis_key, hash_field)
+        with self._lock:
+            raw = self._entries.get(entry_key, MISSING)
+            if raw is not MISSING:
+                self._entries.move_to_end(entry_key)
+                self.hits += 1
+                return raw
+            self.misses += 1
+            if not self._connected:
+                # the invalidation messages may be lost: not cached
+                load = None
+            else:
+                load = object()
+                self._loads.setdefault(redis_key, set()).add(load)
+        try:
+            raw = loader()
+        except BaseException:
+            if load is not None:
+                with self._lock:
+                    self._end_load(redis_key, load)
+            raise
+        if load is not None:
+            with self._lock:
+                if self._end_load(redis_key, load):
+                    self._store(entry_key, raw)
+        return raw
+
+    def _end_load(self, redis_key, load) -> bool:
+        # called with self._lock: True if the key has not been invalidated during the load
+        loads = self._loads.get(redis_key)
+        if loads is None or load not in loads:
+            return False
+        loads.discard(load)
+        if not loads:
+            del self._loads[redis_key]
+        return True
+
+    def _store(self, entry_key, raw):
+        self._entries[entry_key] = raw
+        self._by_key.setdefault(entry_key[0], set()).add(entry_key)
+        while len(self._entries) > self.max_size:
+            old_entry_key, _ = self._entries.popitem(last=False)
+            self._forget(old_entry_key)
+            self.evictions += 1
+
+    def _forget(self, entry_key):
+        entry_keys = self._by_key.get(entry_key[0])
+        if entry_keys is not None:
+            entry_keys.discard(entry_key)
+            if not entry_keys:
+                del self._by_key[entry_key[0]]
+
+    def invalidate(self, redis_key: bytes):
+        with self._lock:
+            self.invalidations += 1
+            self._loads.pop(redis_key, None)
+            for entry_key in self._by_key.pop(redis_key, ()):
+                del self._entries[entry_key]
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        # called with self._lock
+        self._loads.clear()
+        self._entries.clear()
+        self._by_key.clear()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self._connection.disconnect()
+        self.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__} size={len(self)}/{self.max_size}, "
+            f"hits={self.hits}, misses={self.misses}, evictions={self.evictions}, "
+            f"invalidations={self.invalidations}>"
+        )
+
+
+FIELD_CACHE: Optional[FieldCache] = None
+
+
+def enable_client_cache(
+    redis_client: Optional[redis.Redis] = None,
+    max_size: int = 10000,
+    prefixes: Optional[Sequence[str]] = None,
+) -> FieldCache:
+    """Enable the client side cache for the classes declared with ``@onredis(cache=True)``.
+
+    By default, Redis sends the invalidation messages for all keys; ``prefixes``
+    restricts them to some key prefixes (for example ``["mymodule.Scores"]``).
+    """
+    global FIELD_CACHE
+    disable_client_cache()
+    FIELD_CACHE = FieldCache(redis_client or get_redis_client(), max_size, prefixes)
+    return FIELD_CACHE
+
+
+def disable_client_cache():
+    global FIELD_CACHE
+    if FIELD_CACHE is not None:
+        FIELD_CACHE.close()
+        FIELD_CACHE = None
+
+
+def get_client_cache() -> Optional[FieldCache]:
+    return FIELD_CACHE
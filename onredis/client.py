@@ -1,23 +1,292 @@
+import asyncio
+import contextvars
+import inspect
+import itertools
+import math
 import threading
+import time
 import redis
-from typing import Dict, Optional
+import redis.exceptions
+from typing import Optional, Sequence
 
 
 REDIS_CLIENT: Optional[redis.Redis] = None
-LOCAL: Dict[int, redis.Redis] = {}
+# the pipeline of the transaction running in the current thread or asyncio task
+LOCAL_CLIENT: contextvars.ContextVar = contextvars.ContextVar(
+    "onredis_client", default=None
+)
 
 
-def set_redis_client(redis_client):
+def with_pool(
+    redis_client,
+    pool_classes,
+    max_connections=None,
+    blocking=False,
+    pool_timeout=20,
+    health_check_interval=None,
+):
+    """Return a client using a new pool with the connection settings of redis_client.
+
+    pool_classes is (ConnectionPool, BlockingConnectionPool) of redis or redis.asyncio.
+    The idle connections of the pool of redis_client are closed.
+    A cluster client has one pool per node, not supported: raise ValueError.
+    """
+    pool = getattr(redis_client, "connection_pool", None)
+    if pool is None:
+        raise ValueError(
+            f"{redis_client.__class__.__name__} has no connection pool: "
+            "set the pool options when the client is created"
+        )
+    connection_kwargs = dict(pool.connection_kwargs)
+    if health_check_interval is not None:
+        connection_kwargs["health_check_interval"] = health_check_interval
+    if max_connections is None:
+        max_connections = pool.max_connections
+    if blocking:
+        new_pool = pool_classes[1](
+            connection_class=pool.connection_class,
+            max_connections=max_connections,
+            timeout=pool_timeout,
+            **connection_kwargs,
+        )
+    else:
+        new_pool = pool_classes[0](
+            connection_class=pool.connection_class,
+            max_connections=max_connections,
+            **connection_kwargs,
+        )
+    # the idle connections of the replaced pool are closed,
+    # not the ones in use (a command of another thread may be running)
+    _disconnect(pool)
+    return redis_client.__class__(connection_pool=new_pool)
+
+
+# the pools of redis.asyncio being disconnected (see _disconnect)
+_DISCONNECTING = set()
+
+
+def _disconnect(pool):
+    disconnected = pool.disconnect(inuse_connections=False)
+    if not inspect.isawaitable(disconnected):
+        return
+    # redis.asyncio: a coroutine run by the event loop of the current thread
+    try:
+        task = asyncio.get_running_loop().create_task(disconnected)
+    except RuntimeError:
+        # no running event loop: the connections were opened by a loop
+        # which does not run anymore, they are closed by the garbage collector
+        disconnected.close()
+        return
+    _DISCONNECTING.add(task)
+    task.add_done_callback(_DISCONNECTING.discard)
+
+
+def set_redis_client(
+    redis_client: Optional[redis.Redis] = None,
+    *,
+    max_connections: Optional[int] = None,
+    blocking: bool = False,
+    pool_timeout: float = 20,
+    health_check_interval: Optional[int] = None,
+) -> Optional[redis.Redis]:
+    """Set the client of the @onredis classes, return it.
+
+    With the pool options, the client (by default redis.Redis()) is replaced by a client
+    with the same connection settings and a new pool:
+
+    * max_connections: the size of the pool, at least the number of threads
+      using onredis concurrently
+    * blocking: a thread waits up to pool_timeout seconds for a free connection
+      (BlockingConnectionPool) instead of raising ConnectionError when the pool is full
+    * health_check_interval: a connection idle for more than this number of seconds
+      is checked with a PING before it is used
+
+    The idle connections of the replaced pool are closed. The pool options are not
+    supported with redis.cluster.RedisCluster (ValueError).
+    """
     global REDIS_CLIENT
+    if max_connections is not None or blocking or health_check_interval is not None:
+        redis_client = with_pool(
+            redis_client or redis.Redis(),
+            (redis.ConnectionPool, redis.BlockingConnectionPool),
+            max_connections,
+            blocking,
+            pool_timeout,
+            health_check_interval,
+        )
     REDIS_CLIENT = redis_client
+    return redis_client
 
 
 def get_redis_client() -> redis.Redis:
-    return LOCAL.get(threading.get_ident(), REDIS_CLIENT)
+    # a pipeline is falsy when it has no queued command: compare with None
+    client = LOCAL_CLIENT.get()
+    return REDIS_CLIENT if client is None else client
 
 
-def set_redis_client_for_thread(client: redis.Redis):
-    if client:
-        LOCAL[threading.get_ident()] = client
-    else:
-        del LOCAL[threading.get_ident()]
+def set_local_redis_client(client) -> contextvars.Token:
+    """Use client in the current thread or asyncio task (the pipeline of a transaction),
+    return the token to give to reset_local_redis_client."""
+    return LOCAL_CLIENT.set(client)
+
+
+def reset_local_redis_client(token: contextvars.Token):
+    # restore the client used before set_local_redis_client (nested transactions)
+    LOCAL_CLIENT.reset(token)
+
+
+# the pipeline of the batch running in the current thread or asyncio task
+BATCH_CLIENT: contextvars.ContextVar = contextvars.ContextVar(
+    "onredis_batch", default=None
+)
+
+
+def set_batch_client(pipeline) -> contextvars.Token:
+    """Queue the writes of the current thread or asyncio task in pipeline (see OnRedisBatch),
+    return the token to give to reset_batch_client."""
+    return BATCH_CLIENT.set(pipeline)
+
+
+def reset_batch_client(token: contextvars.Token):
+    BATCH_CLIENT.reset(token)
+
+
+def get_write_client(redis_client=None) -> redis.Redis:
+    """The client writing a value: the pipeline of the batch outside a transaction
+    (see OnRedisBatch), the client of get_redis_client otherwise."""
+    if redis_client is None:
+        redis_client = get_redis_client()
+    batch = BATCH_CLIENT.get()
+    if batch is None or redis_client is not REDIS_CLIENT:
+        # no batch, or a pipeline (transaction, explicit client)
+        return redis_client
+    return batch
+
+
+class ReplicaRouter:
+    """Choose the replica serving a read outside a transaction (see set_read_replicas).
+
+    * strategy="round_robin": the replicas in turn
+    * strategy="least_latency": the replica with the lowest PING latency
+      (exponential moving average), the replicas are pinged every probe_interval
+      seconds by the thread reading at that time; a replica which does not answer
+      is skipped until the next probe, the primary is used if none answers
+    """
+
+    __slots__ = (
+        "replicas",
+        "strategy",
+        "read_your_writes",
+        "probe_interval",
+        "latencies",
+        "counter",
+        "next_probe",
+        "lock",
+    )
+
+    STRATEGIES = ("round_robin", "least_latency")
+
+    def __init__(
+        self, replicas, strategy="round_robin", read_your_writes=0.0, probe_interval=1.0
+    ):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(
+                f"strategy must be one of {', '.join(self.STRATEGIES)}, not {strategy!r}"
+            )
+        self.replicas = list(replicas)
+        self.strategy = strategy
+        self.read_your_writes = read_your_writes
+        self.probe_interval = probe_interval
+        # replica index -> latency in seconds, None if the replica does not answer
+        self.latencies = [0.0] * len(self.replicas)
+        self.counter = itertools.count()
+        self.next_probe = 0.0
+        self.lock = threading.Lock()
+
+    def select(self, primary):
+        if self.strategy == "round_robin":
+            return self.replicas[next(self.counter) % len(self.replicas)]
+        now = time.monotonic()
+        if now >= self.next_probe and self.lock.acquire(blocking=False):
+            try:
+                self.next_probe = now + self.probe_interval
+                self.probe()
+            finally:
+                self.lock.release()
+        best = None
+        for replica, latency in zip(self.replicas, self.latencies):
+            if latency is not None and (best is None or latency < best[1]):
+                best = replica, latency
+        return primary if best is None else best[0]
+
+    def probe(self):
+        for i, replica in enumerate(self.replicas):
+            start = time.perf_counter()
+            try:
+                replica.ping()
+            except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError):
+                self.latencies[i] = None
+                continue
+            latency = time.perf_counter() - start
+            previous = self.latencies[i]
+            self.latencies[i] = (
+                latency if not previous else 0.8 * previous + 0.2 * latency
+            )
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__} replicas={len(self.replicas)}, "
+            f"strategy={self.strategy!r}, read_your_writes={self.read_your_writes}>"
+        )
+
+
+REPLICA_ROUTER: Optional[ReplicaRouter] = None
+# time.monotonic() of the last write of the current thread or asyncio task
+LAST_WRITE: contextvars.ContextVar = contextvars.ContextVar(
+    "onredis_last_write", default=-math.inf
+)
+
+
+def set_read_replicas(
+    replicas: Sequence[redis.Redis] = (),
+    strategy: str = "round_robin",
+    read_your_writes: float = 0.0,
+    probe_interval: float = 1.0,
+) -> Optional[ReplicaRouter]:
+    """Send the reads outside a transaction to the replica clients (no replicas: disable).
+
+    The writes and the transactions use the client given to set_redis_client.
+    With read_your_writes, a thread (or an asyncio task) reads from the primary during
+    read_your_writes seconds after its last write: it reads its own writes even if
+    the replicas lag behind. See ReplicaRouter for the strategies.
+    """
+    global REPLICA_ROUTER
+    REPLICA_ROUTER = (
+        ReplicaRouter(replicas, strategy, read_your_writes, probe_interval)
+        if replicas
+        else None
+    )
+    return REPLICA_ROUTER
+
+
+def get_read_client(redis_client=None) -> redis.Redis:
+    """The client reading a value: a replica outside a transaction
+    (see set_read_replicas), the client of get_redis_client otherwise."""
+    if redis_client is None:
+        redis_client = get_redis_client()
+    router = REPLICA_ROUTER
+    if router is None or redis_client is not REDIS_CLIENT:
+        # no replica, or a pipeline (transaction, explicit client)
+        return redis_client
+    if (
+        router.read_your_writes
+        and time.monotonic() - LAST_WRITE.get() < router.read_your_writes
+    ):
+        return redis_client
+    return router.select(redis_client)
+
+
+def record_write():
+    # the next reads of this thread or task use the primary (see set_read_replicas)
+    if REPLICA_ROUTER is not None and REPLICA_ROUTER.read_your_writes:
+        LAST_WRITE.set(time.monotonic())
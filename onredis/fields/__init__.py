@@ -1,3 +1,4 @@
+import collections
 import typing
 
 from .basic import (
@@ -8,11 +9,18 @@ from .basic import (
     IntField,
     FloatField,
     BooleanField,
+    NativeNumberField,
+    NativeIntField,
+    NativeFloatField,
+    LazyLoadField,
 )
+from .array_field import ArrayField, array_field_from_annotation
+from .collection_field import CollectionField, ListField, SetField, SortedSetField
 from .dictionary_field import DictionaryField
+from .compressed_field import CompressedField, register_codec, with_compression
 
 
-def get_field(field_type, default_value, allow_generic=True):
+def get_field(field_type, default_value, allow_generic=True, native_numbers=False):
     field_class_args = tuple()
 
     # create an instance of AbstractField or use the one provided as a default value
@@ -20,6 +28,11 @@ def get_field(field_type, default_value, allow_generic=True):
         # use the default
         return default_value
 
+    # numpy.ndarray, numpy.typing.NDArray[...]
+    array_field = array_field_from_annotation(field_type, default_value)
+    if array_field is not None:
+        return array_field
+
     # create a new instance of AbstractField
     if isinstance(field_type, typing._GenericAlias):
         if field_type.__origin__ == typing.Union:
@@ -38,12 +51,22 @@ def get_field(field_type, default_value, allow_generic=True):
             # this is a generic alias like Dict[int, str] or List[str]
             # create Field for each arguments
             field_class_args = [
-                get_field(t, None, allow_generic=False) for t in field_type.__args__
+                get_field(t, None, allow_generic=False, native_numbers=native_numbers)
+                for t in field_type.__args__
             ]
-            # look into FIELD_CLASSES using the origin type (typing.Dict -> dict)
+            # look into GENERIC_FIELD_CLASSES using the origin type (typing.Dict -> dict)
             field_type = field_type.__origin__
+            field_class = GENERIC_FIELD_CLASSES.get(field_type)
+            if field_class is None:
+                # no native Redis type: pickle the value
+                return GenericField(default_value=default_value)
+            return field_class(*field_class_args, default_value=default_value)
 
-    field_class = FIELD_CLASSES.get(field_type, GenericField)
+    field_class = None
+    if native_numbers:
+        field_class = NATIVE_NUMBER_FIELD_CLASSES.get(field_type)
+    if field_class is None:
+        field_class = FIELD_CLASSES.get(field_type, GenericField)
     return field_class(*field_class_args, default_value=default_value)
 
 
@@ -57,3 +80,17 @@ FIELD_CLASSES = {
     typing.Dict: DictionaryField,
     typing.Mapping: DictionaryField,
 }
+
+# the parameterized generics: List[str], Set[int], ...
+GENERIC_FIELD_CLASSES = {
+    dict: DictionaryField,
+    collections.abc.Mapping: DictionaryField,
+    list: ListField,
+    set: SetField,
+    collections.Counter: SortedSetField,
+}
+
+NATIVE_NUMBER_FIELD_CLASSES = {
+    int: NativeIntField,
+    float: NativeFloatField,
+}
@@ -0,0 +1,120 @@
+import typing
+
+from ..client import get_read_client, get_write_client
+from ..instrumentation import instrumented
+from ..layout import KEYS_LAYOUT
+from .basic import AbstractField
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class ArrayField(AbstractField):
+    """numpy.ndarray stored as its raw contiguous buffer (pip install onredis[numpy]).
+
+    The value read from Redis is a read-only array sharing the memory of the reply
+    (numpy.frombuffer): use .copy() to modify it.
+
+    read_range() and write_range() transfer only a range of elements (GETRANGE / SETRANGE),
+    the indexes are the ones of the flattened array. They require layout="keys".
+    """
+
+    __slots__ = ("dtype", "shape")
+
+    # write_range() writes the stored value
+    _write_behind_support = False
+
+    def __init__(self, dtype="float64", shape=None, default_value=None):
+        if numpy is None:
+            raise ImportError("ArrayField requires numpy: pip install onredis[numpy]")
+        super().__init__(default_value)
+        # the byte order is part of the stored format
+        self.dtype = numpy.dtype(dtype).str
+        self.shape = None if shape is None else tuple(shape)
+
+    def deserialize(self, raw):
+        array = numpy.frombuffer(raw, dtype=self.dtype)
+        if self.shape is not None:
+            array = array.reshape(self.shape)
+        return array
+
+    def serialize(self, value):
+        array = numpy.ascontiguousarray(value, dtype=self.dtype)
+        if self.shape is not None and array.shape != self.shape:
+            raise ValueError(
+                f"expected an array of shape {self.shape}, not {array.shape}"
+            )
+        # no copy: redis-py writes the memoryview as it is
+        return memoryview(array).cast("B")
+
+    def _range_key(self, obj):
+        if obj._layout is not KEYS_LAYOUT:
+            raise TypeError("read_range() and write_range() require layout='keys'")
+        return self.redis_key(obj)
+
+    @instrumented("read_range")
+    def read_range(self, obj, start, stop):
+        """Return the elements from start to stop excluded (GETRANGE)."""
+        if obj._local_copy:
+            # there is a transaction: read the local copy
+            value = self.__get__(obj)
+            if value is None:
+                return numpy.empty(0, dtype=self.dtype)
+            return numpy.asarray(value, dtype=self.dtype).reshape(-1)[start:stop]
+        if start >= stop:
+            return numpy.empty(0, dtype=self.dtype)
+        itemsize = numpy.dtype(self.dtype).itemsize
+        raw = get_read_client().getrange(
+            self._range_key(obj), start * itemsize, stop * itemsize - 1
+        )
+        return numpy.frombuffer(raw, dtype=self.dtype)
+
+    @instrumented("write_range")
+    def write_range(self, obj, start, values):
+        """Overwrite the elements from start with values (SETRANGE)."""
+        values = numpy.ascontiguousarray(values, dtype=self.dtype).reshape(-1)
+        if obj._local_copy:
+            # there is a transaction: update the local copy
+            value = self.__get__(obj)
+            if value is None:
+                value = numpy.empty(0, dtype=self.dtype)
+            flat = numpy.array(value, dtype=self.dtype).reshape(-1)
+            end = start + len(values)
+            if end > len(flat):
+                # as SETRANGE, pad with zeros
+                flat = numpy.concatenate(
+                    [flat, numpy.zeros(end - len(flat), self.dtype)]
+                )
+            flat[start:end] = values
+            self.__set__(
+                obj, flat.reshape(value.shape) if flat.size == value.size else flat
+            )
+            return
+        key = self._range_key(obj)
+        itemsize = numpy.dtype(self.dtype).itemsize
+        get_write_client().setrange(key, start * itemsize, memoryview(values).cast("B"))
+        self.invalidate_cache(key)
+
+
+def array_field_from_annotation(
+    field_type, default_value
+) -> typing.Optional[ArrayField]:
+    """Return an ArrayField for numpy.ndarray, numpy.typing.NDArray[dtype],
+    typing.Annotated[NDArray[dtype], shape], None for the other types."""
+    if numpy is None:
+        return None
+    shape = None
+    if hasattr(field_type, "__metadata__"):
+        # typing.Annotated
+        shape = next((m for m in field_type.__metadata__ if isinstance(m, tuple)), None)
+        field_type = field_type.__origin__
+    if field_type is numpy.ndarray:
+        return ArrayField(shape=shape, default_value=default_value)
+    if getattr(field_type, "__origin__", None) is numpy.ndarray:
+        # NDArray[numpy.float32] is numpy.ndarray[Any, numpy.dtype[numpy.float32]]
+        dtype_args = getattr(field_type.__args__[1], "__args__", ())
+        dtype = dtype_args[0] if dtype_args else "float64"
+        return ArrayField(dtype, shape, default_value=default_value)
+    return None
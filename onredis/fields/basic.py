@@ -1,8 +1,23 @@
 from abc import ABC, abstractmethod
+import copy
+import math
 import pickle
+import random
 import struct
+import time
 
-from ..client import get_redis_client
+import redis.exceptions
+import redis.lock
+
+from ..cache import get_client_cache
+from ..client import (
+    get_read_client,
+    get_redis_client,
+    get_write_client,
+    record_write,
+)
+from ..instrumentation import instrumented
+from ..write_behind import get_write_buffer
 
 
 class AbstractField(ABC):
@@ -10,56 +25,161 @@ class AbstractField(ABC):
     See https://docs.python.org/fr/3.10/howto/descriptor.html
     """
 
-    __slots__ = ("default_value", "key")
+    __slots__ = ("default_value", "key", "cached", "write_behind")
+
+    # the attributes which are not related to the data format (see _attributes)
+    _not_format = ("key", "cached", "write_behind")
+    # the writes can be buffered (see onredis.write_behind)
+    _write_behind_support = True
+    # the values can be changed in place: a local copy keeps the raw values
+    # to find the changes (see LocalDictionary.original)
+    _mutable = False
 
     def __init__(self, default_value):
         self.default_value = default_value
+        self.cached = False
+        self.write_behind = False
 
     def _set_key(self, key):
+        # the Redis key of the singleton instance
         self.key = key
 
+    def redis_key(self, obj):
+        # the location of the field for obj (the instance can be keyed, see cls.__new__):
+        # the Redis key, or (Redis key, hash field) with the hash layout
+        # (see onredis.layout)
+        return obj._redis_keys[self]
+
+    def storage_key(self, obj):
+        # the Redis key storing the field for obj: the key to WATCH or to invalidate
+        return obj._layout.redis_key(self.redis_key(obj))
+
+    def _set_cached(self, cached):
+        self.cached = cached
+
+    def _set_write_behind(self, write_behind):
+        self.write_behind = write_behind
+
     def __get__(self, obj, objtype=None):
         if obj._local_copy:
             # there is a transaction: store the data in a buffer
-            return obj._local_copy.get(self.key, self.default_value)
+            return obj._local_copy.get(self.redis_key(obj), self.default_value)
         # no transaction: store in Redis
         return self.redis_get(obj, objtype)
 
     def __set__(self, obj, value):
         if obj._local_copy:
             # there is a transaction: store the data in a buffer
-            obj._local_copy[self.key] = value
+            obj._local_copy[self.redis_key(obj)] = value
             return
         # no transaction: store in Redis
         return self.redis_set(obj, value)
 
+    def redis_get_raw(self, obj, location):
+        layout = obj._layout
+        cache = get_client_cache() if self.cached else None
+        if cache is None:
+            return layout.get(get_read_client(), location)
+        # the cached value is read from the primary: it sends the invalidation
+        # messages, a lagging replica could return a value already invalidated
+        return cache.fetch(
+            *layout.cache_entry(location),
+            lambda: layout.get(get_redis_client(), location),
+        )
+
+    @instrumented("get")
     def redis_get(self, obj, objtype=None):
-        raw = get_redis_client().get(self.key)
+        location = self.redis_key(obj)
+        if self.write_behind:
+            # with the value not flushed yet
+            raw = get_write_buffer().read(
+                self, location, lambda: self.redis_get_raw(obj, location)
+            )
+        else:
+            raw = self.redis_get_raw(obj, location)
         if raw is None:
             return self.default_value
         return self.deserialize(raw)
 
+    def local_value(self, raw):
+        """The value of the field in the local copy of a transaction.
+
+        The default value is copied: the local copy can be changed in place.
+        """
+        if raw is None:
+            return copy.deepcopy(self.default_value)
+        return self.deserialize(raw)
+
+    @instrumented("set")
     def redis_set(self, obj, value):
-        if value is None:
-            get_redis_client().delete(self.key)
+        if self.write_behind:
+            get_write_buffer().set(obj, self, value)
             return
-        raw = self.serialize(value)
-        get_redis_client().set(self.key, raw)
+        location = self.redis_key(obj)
+        layout = obj._layout
+        # the pipeline of a batch (see OnRedisBatch)
+        redis_client = get_write_client()
+        if value is None:
+            layout.delete(redis_client, location)
+        else:
+            raw = self.serialize(value)
+            layout.set(redis_client, location, raw)
+        self.invalidate_cache(layout.redis_key(location))
+
+    def invalidate_cache(self, key):
+        # called after each write outside a transaction:
+        # the next reads of this thread use the primary (see set_read_replicas)
+        record_write()
+        # the invalidation message from Redis is asynchronous:
+        # make sure the next read in this process returns the written value
+        cache = get_client_cache() if self.cached else None
+        if cache is not None:
+            cache.invalidate(key)
 
     # implement __del__
 
-    def __repr__(self):
-        kv = []
+    def _attributes(self):
+        # the repr is the data format stored in Redis (see onredis.schema):
+        # skip the attributes which are not related to the format
+        attributes = {}
         for k in dir(self):
-            if k.startswith("_") or k == "key":
+            if k.startswith("_") or k in self._not_format:
                 continue
             v = getattr(self, k)
             if callable(v):
                 continue
-            kv.append(f"{k}={v!r}")
-        kv_str = ", ".join(kv)
+            attributes[k] = v
+        return attributes
+
+    def __repr__(self):
+        kv_str = ", ".join(f"{k}={v!r}" for k, v in self._attributes().items())
         return f"<{self.__class__.__name__} {kv_str}>"
 
+    def same_format(self, other) -> bool:
+        """True if the values stored by other can be read by this field
+        (only the default values may differ)."""
+        if type(self) is not type(other):
+            return False
+        attributes = self._attributes()
+        other_attributes = other._attributes()
+        attributes.pop("default_value", None)
+        other_attributes.pop("default_value", None)
+        if attributes.keys() != other_attributes.keys():
+            return False
+        for name, value in attributes.items():
+            other_value = other_attributes[name]
+            if isinstance(value, AbstractField) and isinstance(other_value, AbstractField):
+                # key_field, value_field, ...
+                if not value.same_format(other_value):
+                    return False
+            elif repr(value) != repr(other_value):
+                return False
+        return True
+
+    def unchanged(self, serialized_value: bytes, raw) -> bool:
+        """True if raw, read from Redis, already stores the serialized value."""
+        return serialized_value == raw
+
     @abstractmethod
     def deserialize(self, raw: bytes):
         pass
@@ -101,6 +221,82 @@ class IntField(AbstractField):
         return value.to_bytes(self.size, "big", signed=self.signed)
 
 
+class NativeNumberField(AbstractField):
+    """Number stored as a decimal string: Redis can do arithmetic on it.
+
+    incr() runs a single command (INCRBY, INCRBYFLOAT, ...) without WATCH
+    outside a transaction. With write_behind or inside a batch, incr() returns None.
+    """
+
+    @instrumented("incr")
+    def incr(self, obj, amount=1):
+        if obj._local_copy:
+            # there is a transaction: update the local copy
+            value = (self.__get__(obj) or 0) + amount
+            self.__set__(obj, value)
+            return value
+        if self.write_behind:
+            get_write_buffer().incr(obj, self, amount)
+            return None
+        location = self.redis_key(obj)
+        layout = obj._layout
+        redis_client = get_redis_client()
+        batch = get_write_client(redis_client)
+        if batch is not redis_client:
+            # the commands are sent at the end of the batch (see OnRedisBatch)
+            if self.default_value:
+                layout.set_default(batch, location, self.serialize(self.default_value))
+            layout.incr(batch, location, self, amount)
+            self.invalidate_cache(layout.redis_key(location))
+            return None
+        if self.default_value:
+            # Redis starts from 0: initialize the field with the default value first
+            pipeline = redis_client.pipeline(transaction=True)
+            layout.set_default(pipeline, location, self.serialize(self.default_value))
+            layout.incr(pipeline, location, self, amount)
+            value = pipeline.execute()[-1]
+        else:
+            value = layout.incr(redis_client, location, self, amount)
+        self.invalidate_cache(layout.redis_key(location))
+        return self.deserialize(value) if isinstance(value, bytes) else value
+
+    @abstractmethod
+    def redis_incr(self, redis_client, key, amount):
+        pass
+
+    @abstractmethod
+    def redis_hincr(self, redis_client, key, hash_key, amount):
+        pass
+
+
+class NativeIntField(NativeNumberField):
+    def deserialize(self, raw):
+        return int(raw)
+
+    def serialize(self, value):
+        return b"%d" % value
+
+    def redis_incr(self, redis_client, key, amount):
+        return redis_client.incrby(key, amount)
+
+    def redis_hincr(self, redis_client, key, hash_key, amount):
+        return redis_client.hincrby(key, hash_key, amount)
+
+
+class NativeFloatField(NativeNumberField):
+    def deserialize(self, raw):
+        return float(raw)
+
+    def serialize(self, value):
+        return repr(float(value)).encode()
+
+    def redis_incr(self, redis_client, key, amount):
+        return redis_client.incrbyfloat(key, amount)
+
+    def redis_hincr(self, redis_client, key, hash_key, amount):
+        return redis_client.hincrbyfloat(key, hash_key, amount)
+
+
 class StrField(AbstractField):
     def deserialize(self, raw):
         return bytes.decode(raw)
@@ -118,6 +314,8 @@ class FloatField(AbstractField):
 
 
 class GenericField(AbstractField):
+    _mutable = True
+
     def deserialize(self, raw):
         return pickle.loads(raw)
 
@@ -129,7 +327,164 @@ class LazyLoadField(AbstractField):
     """Initialize once the data using a provided function.
     Cache the value for a time, reload after timeout (call again the function).
 
-    TODO
+    loader(obj) returns the value, stored with value_field (pickle by default)
+    and the time it expires: the value is reloaded ttl seconds after it has been loaded.
+
+    * Only one process runs the loader at a time: it holds a Redis lock (lock_timeout
+      seconds at most), meanwhile the other processes return the expired value,
+      or wait for the new one if there is none.
+    * The value may be reloaded before it expires (probabilistic early refresh):
+      the longer the loader takes and the greater beta, the sooner.
+      beta=0 disables the early refresh.
+    * If memo_ttl is not 0, the value is kept in the process memory for memo_ttl seconds
+      at most.
+
+    Inside a transaction and with fetch(), the stored value is returned as it is.
     """
 
-    pass
+    __slots__ = (
+        "loader",
+        "ttl",
+        "value_field",
+        "beta",
+        "lock_timeout",
+        "memo_ttl",
+        "_memo",
+    )
+
+    _not_format = AbstractField._not_format + (
+        # not set on a field read from a schema (see onredis.schema)
+        "loader",
+        "ttl",
+        "beta",
+        "lock_timeout",
+        "memo_ttl",
+    )
+    # the value is written by the loader
+    _write_behind_support = False
+
+    # expiration time, duration of the loader
+    _header = struct.Struct("!dd")
+    # seconds between two reads while waiting for the value loaded by another process
+    _poll_interval = 0.01
+    _memo_size = 10000
+
+    def __init__(
+        self,
+        loader,
+        ttl,
+        value_field=None,
+        default_value=None,
+        beta=1.0,
+        lock_timeout=10,
+        memo_ttl=0,
+    ):
+        super().__init__(default_value)
+        self.loader = loader
+        self.ttl = ttl
+        self.value_field = value_field or GenericField(None)
+        self.beta = beta
+        self.lock_timeout = lock_timeout
+        self.memo_ttl = memo_ttl
+        # location -> (memo expiration time, value)
+        self._memo = {}
+
+    @instrumented("get")
+    def redis_get(self, obj, objtype=None):
+        location = self.redis_key(obj)
+        memo = self._memo.get(location)
+        if memo is not None and time.time() < memo[0]:
+            return memo[1]
+
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            raw = self.redis_get_raw(obj, location)
+            if raw is not None:
+                expires_at, duration = self._header.unpack_from(raw)
+                value = self.deserialize(raw)
+                if not self._should_reload(expires_at, duration):
+                    self._memoize(location, value, expires_at)
+                    return value
+
+            lock = redis.lock.Lock(
+                get_redis_client(),
+                obj._layout.location_name(location) + b"!lock",
+                timeout=self.lock_timeout,
+            )
+            if lock.acquire(blocking=False):
+                try:
+                    # another process may have reloaded the value in the meantime
+                    new_raw = obj._layout.get(get_redis_client(), location)
+                    if new_raw is not None and new_raw != raw:
+                        expires_at, _ = self._header.unpack_from(new_raw)
+                        if time.time() < expires_at:
+                            value = self.deserialize(new_raw)
+                            self._memoize(location, value, expires_at)
+                            return value
+                    return self.reload(obj)
+                finally:
+                    try:
+                        lock.release()
+                    except redis.exceptions.LockError:
+                        # the loader took more than lock_timeout seconds
+                        pass
+
+            if raw is not None:
+                # another process is reloading the value
+                return value
+            if time.monotonic() >= deadline:
+                # the process holding the lock is too slow
+                return self.reload(obj)
+            time.sleep(self._poll_interval)
+
+    def _should_reload(self, expires_at, duration):
+        # "Optimal Probabilistic Cache Stampede Prevention" (XFetch)
+        return time.time() - duration * self.beta * math.log(
+            1.0 - random.random()
+        ) >= expires_at
+
+    def _memoize(self, location, value, expires_at):
+        if not self.memo_ttl:
+            return
+        if len(self._memo) >= self._memo_size:
+            self._memo.pop(next(iter(self._memo)), None)
+        self._memo[location] = (min(time.time() + self.memo_ttl, expires_at), value)
+
+    @instrumented("reload")
+    def reload(self, obj):
+        """Call the loader and store the value, return the value."""
+        location = self.redis_key(obj)
+        start = time.monotonic()
+        value = self.loader(obj)
+        duration = time.monotonic() - start
+        expires_at = time.time() + self.ttl
+        obj._layout.set(
+            get_redis_client(), location, self._serialize(value, expires_at, duration)
+        )
+        self.invalidate_cache(self.storage_key(obj))
+        self._memo.pop(location, None)
+        self._memoize(location, value, expires_at)
+        return value
+
+    @instrumented("set")
+    def redis_set(self, obj, value):
+        super().redis_set(obj, value)
+        self._memo.pop(self.redis_key(obj), None)
+
+    def _serialize(self, value, expires_at, duration):
+        header = self._header.pack(expires_at, duration)
+        return header + self.value_field.serialize(value)
+
+    def deserialize(self, raw):
+        return self.value_field.deserialize(raw[self._header.size :])
+
+    def serialize(self, value):
+        # the value set by the application expires in ttl seconds
+        return self._serialize(value, time.time() + self.ttl, 0.0)
+
+    def unchanged(self, serialized_value, raw):
+        # do not write again a value read inside a transaction: keep its expiration time
+        return (
+            isinstance(raw, bytes)
+            and serialized_value[self._header.size :] == raw[self._header.size :]
+        )
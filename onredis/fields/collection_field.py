@@ -0,0 +1,584 @@
+import collections
+import collections.abc
+
+from ..client import (
+    get_read_client,
+    get_redis_client,
+    get_write_client,
+    record_write,
+)
+from ..instrumentation import instrumented, instrumented_proxy
+from .basic import AbstractField, GenericField
+
+# number of items per LRANGE / SSCAN / ZSCAN when iterating over a proxy
+SCAN_BATCH_SIZE = 1000
+
+
+class CollectionField(AbstractField):
+    """A field stored in its own Redis key (hash, list, set, sorted set), whatever the layout.
+
+    Outside a transaction, the attribute is a proxy running the Redis commands.
+    Inside a transaction, the attribute is a local Python collection:
+    the changes are written when the transaction commits.
+    """
+
+    # the proxy runs the Redis commands
+    _write_behind_support = False
+
+    def storage_key(self, obj):
+        return self.redis_key(obj)
+
+    @instrumented("set")
+    def redis_set(self, obj, value):
+        key = self.redis_key(obj)
+        # the pipeline of a batch (see OnRedisBatch)
+        self.write_all(get_write_client(), key, value)
+        self.invalidate_cache(key)
+
+    def read_raw(self, redis_client, key):
+        """Read the whole collection (or queue the command in a pipeline)."""
+        raise NotImplementedError()
+
+    def value_from_raw(self, raw):
+        """Return the Python value from the reply of read_raw."""
+        raise NotImplementedError()
+
+    def write_all(self, redis_client, key, value):
+        """Replace the whole collection by value."""
+        raise NotImplementedError()
+
+    def local_copy_from_raw(self, raw):
+        """Return the local copy for a transaction from the reply of read_raw."""
+        raise NotImplementedError()
+
+    def create_local_copy(self, redis_client, key):
+        """Read the whole collection, return the local copy for a transaction."""
+        return self.local_copy_from_raw(self.read_raw(redis_client, key))
+
+    def create_lazy_local_copy(self, redis_client, key, watch):
+        """Return the local copy for a lazy transaction (the field is accessed)."""
+        watch(key)
+        return self.create_local_copy(redis_client, key)
+
+    def write_local_copy(self, redis_client, key, value):
+        """Write the changes made on the local copy of a transaction."""
+        raise NotImplementedError()
+
+    def serialize(self, value) -> bytes:
+        raise NotImplementedError()
+
+    def deserialize(self, raw: bytes):
+        raise NotImplementedError()
+
+
+class ListField(CollectionField):
+    """typing.List: a Redis list."""
+
+    def __init__(self, value_field=None, default_value=None):
+        super().__init__(default_value)
+        self.value_field = value_field or GenericField(None)
+
+    def redis_get(self, obj, objtype=None):
+        return ListProxy(obj, get_redis_client(), self.redis_key(obj), self.value_field)
+
+    def read_raw(self, redis_client, key):
+        return redis_client.lrange(key, 0, -1)
+
+    def value_from_raw(self, raw):
+        return [self.value_field.deserialize(v) for v in raw]
+
+    def write_all(self, redis_client, key, value):
+        redis_client.delete(key)
+        if value:
+            redis_client.rpush(key, *[self.value_field.serialize(v) for v in value])
+
+    def local_copy_from_raw(self, raw):
+        local_list = LocalList(self.value_from_raw(raw))
+        local_list.original = raw
+        return local_list
+
+    def write_local_copy(self, redis_client, key, value):
+        """Only the appended items are written (RPUSH),
+        the whole list is rewritten when the other items have changed."""
+        if not isinstance(value, LocalList):
+            self.write_all(redis_client, key, value)
+            return
+        serialized = [self.value_field.serialize(v) for v in value]
+        original = value.original
+        if serialized[: len(original)] != original:
+            self.write_all(redis_client, key, value)
+        elif len(serialized) > len(original):
+            redis_client.rpush(key, *serialized[len(original) :])
+
+
+class SetField(CollectionField):
+    """typing.Set: a Redis set."""
+
+    def __init__(self, value_field=None, default_value=None):
+        super().__init__(default_value)
+        self.value_field = value_field or GenericField(None)
+
+    def redis_get(self, obj, objtype=None):
+        return SetProxy(obj, get_redis_client(), self.redis_key(obj), self.value_field)
+
+    def read_raw(self, redis_client, key):
+        return redis_client.smembers(key)
+
+    def value_from_raw(self, raw):
+        return {self.value_field.deserialize(v) for v in raw}
+
+    def write_all(self, redis_client, key, value):
+        redis_client.delete(key)
+        if value:
+            redis_client.sadd(key, *[self.value_field.serialize(v) for v in value])
+
+    def local_copy_from_raw(self, raw):
+        local_set = LocalSet(self.value_from_raw(raw))
+        local_set.original = set(raw)
+        return local_set
+
+    def write_local_copy(self, redis_client, key, value):
+        """Only the added (SADD) and removed (SREM) members are written."""
+        if not isinstance(value, LocalSet):
+            self.write_all(redis_client, key, value)
+            return
+        serialized = {self.value_field.serialize(v) for v in value}
+        removed = value.original - serialized
+        added = serialized - value.original
+        if removed:
+            redis_client.srem(key, *removed)
+        if added:
+            redis_client.sadd(key, *added)
+
+
+class SortedSetField(CollectionField):
+    """typing.Counter: a Redis sorted set, member -> score.
+
+    The scores are floats.
+    """
+
+    def __init__(self, member_field=None, default_value=None):
+        super().__init__(default_value)
+        self.member_field = member_field or GenericField(None)
+
+    def redis_get(self, obj, objtype=None):
+        return SortedSetProxy(
+            obj, get_redis_client(), self.redis_key(obj), self.member_field
+        )
+
+    def read_raw(self, redis_client, key):
+        return redis_client.zrange(key, 0, -1, withscores=True)
+
+    def value_from_raw(self, raw):
+        return {self.member_field.deserialize(m): score for m, score in raw}
+
+    def write_all(self, redis_client, key, value):
+        redis_client.delete(key)
+        if value:
+            if not isinstance(value, collections.abc.Mapping):
+                # an iterable of members: count them
+                value = collections.Counter(value)
+            redis_client.zadd(
+                key,
+                {self.member_field.serialize(m): score for m, score in value.items()},
+            )
+
+    def local_copy_from_raw(self, raw):
+        local_counter = LocalCounter(self.value_from_raw(raw))
+        local_counter.original = dict(raw)
+        return local_counter
+
+    def write_local_copy(self, redis_client, key, value):
+        """Only the changed scores (ZADD) and the removed members (ZREM) are written."""
+        if not isinstance(value, LocalCounter):
+            self.write_all(redis_client, key, value)
+            return
+        serialized = {
+            self.member_field.serialize(m): score for m, score in value.items()
+        }
+        changed = {
+            m: score
+            for m, score in serialized.items()
+            if value.original.get(m) != score
+        }
+        removed = [m for m in value.original if m not in serialized]
+        if removed:
+            redis_client.zrem(key, *removed)
+        if changed:
+            redis_client.zadd(key, changed)
+
+
+class LocalList(list):
+    """The list of a ListField inside a transaction."""
+
+    __slots__ = ("original",)
+
+
+class LocalSet(set):
+    """The set of a SetField inside a transaction."""
+
+    __slots__ = ("original",)
+
+
+class LocalCounter(collections.Counter):
+    """The Counter of a SortedSetField inside a transaction."""
+
+    __slots__ = ("original",)
+
+
+class _Proxy:
+
+    __slots__ = ("obj", "redis_client", "redis_key", "value_field")
+
+    def __init__(self, obj, redis_client, redis_key, value_field):
+        self.obj = obj
+        self.redis_client = redis_client
+        self.redis_key = redis_key
+        self.value_field = value_field
+
+    def _no_local_copy(self):
+        if self.obj._local_copy:
+            raise ValueError(
+                f"The {self.__class__.__name__} for {self.redis_key!r} was acquired before a transaction starts on {self.obj!r}"
+            )
+
+    def _reader(self):
+        # a replica, see set_read_replicas
+        return get_read_client(self.redis_client)
+
+    def _writer(self, batched=True):
+        # the pipeline of a batch (see OnRedisBatch) if the reply is not used
+        record_write()
+        writer = get_write_client(self.redis_client)
+        if not batched and writer is not self.redis_client:
+            raise ValueError(
+                f"The {self.__class__.__name__} for {self.redis_key!r} can't read a reply inside a batch"
+            )
+        return writer
+
+    @instrumented_proxy("clear")
+    def clear(self):
+        self._no_local_copy()
+        self._writer().delete(self.redis_key)
+
+
+class ListProxy(_Proxy):
+    """Access to a ListField outside a transaction: each method runs one Redis command."""
+
+    __slots__ = ()
+
+    @instrumented_proxy("len")
+    def __len__(self):
+        self._no_local_copy()
+        return self._reader().llen(self.redis_key)
+
+    @instrumented_proxy("getitem")
+    def __getitem__(self, index):
+        self._no_local_copy()
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                raise ValueError("slice step is not supported")
+            if index.stop == 0:
+                return []
+            start = 0 if index.start is None else index.start
+            # the stop index of LRANGE is included
+            stop = -1 if index.stop is None else index.stop - 1
+            return [
+                self.value_field.deserialize(v)
+                for v in self._reader().lrange(self.redis_key, start, stop)
+            ]
+        raw = self._reader().lindex(self.redis_key, index)
+        if raw is None:
+            raise IndexError("list index out of range")
+        return self.value_field.deserialize(raw)
+
+    @instrumented_proxy("setitem")
+    def __setitem__(self, index, item):
+        self._no_local_copy()
+        self._writer().lset(self.redis_key, index, self.value_field.serialize(item))
+
+    @instrumented_proxy("append")
+    def append(self, item):
+        """RPUSH"""
+        self._no_local_copy()
+        self._writer().rpush(self.redis_key, self.value_field.serialize(item))
+
+    @instrumented_proxy("appendleft")
+    def appendleft(self, item):
+        """LPUSH"""
+        self._no_local_copy()
+        self._writer().lpush(self.redis_key, self.value_field.serialize(item))
+
+    @instrumented_proxy("extend")
+    def extend(self, items):
+        """One RPUSH for all the items."""
+        self._no_local_copy()
+        serialized = [self.value_field.serialize(item) for item in items]
+        if serialized:
+            self._writer().rpush(self.redis_key, *serialized)
+
+    @instrumented_proxy("pop")
+    def pop(self, index=-1):
+        """RPOP (index=-1) or LPOP (index=0)"""
+        self._no_local_copy()
+        if index == -1:
+            raw = self._writer(batched=False).rpop(self.redis_key)
+        elif index == 0:
+            raw = self._writer(batched=False).lpop(self.redis_key)
+        else:
+            raise ValueError("only the first or the last item can be popped")
+        if raw is None:
+            raise IndexError("pop from empty list")
+        return self.value_field.deserialize(raw)
+
+    @instrumented_proxy("remove")
+    def remove(self, item):
+        """Remove the first occurrence of item (LREM)."""
+        self._no_local_copy()
+        serialized = self.value_field.serialize(item)
+        if not self._writer(batched=False).lrem(self.redis_key, 1, serialized):
+            raise ValueError(f"{item!r} is not in list")
+
+    @instrumented_proxy("trim")
+    def trim(self, start, stop):
+        """Keep the items from start to stop included (LTRIM)."""
+        self._no_local_copy()
+        self._writer().ltrim(self.redis_key, start, stop)
+
+    @instrumented_proxy("contains")
+    def __contains__(self, item):
+        self._no_local_copy()
+        serialized = self.value_field.serialize(item)
+        return self._reader().lpos(self.redis_key, serialized) is not None
+
+    @instrumented_proxy("iter")
+    def __iter__(self, batch_size=SCAN_BATCH_SIZE):
+        self._no_local_copy()
+        # the same server for the whole iteration (see set_read_replicas)
+        reader = self._reader()
+        start = 0
+        while True:
+            raw_items = reader.lrange(self.redis_key, start, start + batch_size - 1)
+            yield from [self.value_field.deserialize(v) for v in raw_items]
+            if len(raw_items) < batch_size:
+                return
+            start += batch_size
+
+    @instrumented_proxy("read_all")
+    def __deepcopy__(self, memo=None):
+        self._no_local_copy()
+        return self[:]
+
+    def __repr__(self):
+        return repr(self.__deepcopy__())
+
+
+class SetProxy(_Proxy):
+    """Access to a SetField outside a transaction: each method runs one Redis command."""
+
+    __slots__ = ()
+
+    @instrumented_proxy("len")
+    def __len__(self):
+        self._no_local_copy()
+        return self._reader().scard(self.redis_key)
+
+    @instrumented_proxy("contains")
+    def __contains__(self, item):
+        self._no_local_copy()
+        serialized = self.value_field.serialize(item)
+        return (
+            True if self._reader().sismember(self.redis_key, serialized) else False
+        )
+
+    @instrumented_proxy("add")
+    def add(self, item):
+        """SADD"""
+        self._no_local_copy()
+        self._writer().sadd(self.redis_key, self.value_field.serialize(item))
+
+    @instrumented_proxy("update")
+    def update(self, *iterables):
+        """One SADD for all the items."""
+        self._no_local_copy()
+        serialized = [
+            self.value_field.serialize(item) for items in iterables for item in items
+        ]
+        if serialized:
+            self._writer().sadd(self.redis_key, *serialized)
+
+    @instrumented_proxy("discard")
+    def discard(self, item):
+        """SREM"""
+        self._no_local_copy()
+        self._writer().srem(self.redis_key, self.value_field.serialize(item))
+
+    @instrumented_proxy("remove")
+    def remove(self, item):
+        """SREM, raise KeyError if item is not a member."""
+        self._no_local_copy()
+        if not self._writer(batched=False).srem(
+            self.redis_key, self.value_field.serialize(item)
+        ):
+            raise KeyError(item)
+
+    @instrumented_proxy("pop")
+    def pop(self):
+        """Remove and return a random member (SPOP)."""
+        self._no_local_copy()
+        raw = self._writer(batched=False).spop(self.redis_key)
+        if raw is None:
+            raise KeyError("pop from an empty set")
+        return self.value_field.deserialize(raw)
+
+    @instrumented_proxy("iter")
+    def __iter__(self, batch_size=SCAN_BATCH_SIZE):
+        # SSCAN: a member added or removed during the iteration may be returned or not
+        self._no_local_copy()
+        # the same server for the whole iteration (see set_read_replicas)
+        reader = self._reader()
+        cursor = 0
+        while True:
+            cursor, raw_items = reader.sscan(self.redis_key, cursor, count=batch_size)
+            yield from [self.value_field.deserialize(v) for v in raw_items]
+            if cursor == 0:
+                return
+
+    @instrumented_proxy("read_all")
+    def __deepcopy__(self, memo=None):
+        self._no_local_copy()
+        return {
+            self.value_field.deserialize(v)
+            for v in self._reader().smembers(self.redis_key)
+        }
+
+    def __repr__(self):
+        return repr(self.__deepcopy__())
+
+
+class SortedSetProxy(_Proxy):
+    """Access to a SortedSetField outside a transaction: each method runs one Redis command.
+
+    As with collections.Counter, the score of a missing member is 0.
+    """
+
+    __slots__ = ()
+
+    @instrumented_proxy("len")
+    def __len__(self):
+        self._no_local_copy()
+        return self._reader().zcard(self.redis_key)
+
+    @instrumented_proxy("getitem")
+    def __getitem__(self, member):
+        self._no_local_copy()
+        score = self._reader().zscore(
+            self.redis_key, self.value_field.serialize(member)
+        )
+        return 0 if score is None else score
+
+    @instrumented_proxy("setitem")
+    def __setitem__(self, member, score):
+        self._no_local_copy()
+        self._writer().zadd(
+            self.redis_key, {self.value_field.serialize(member): score}
+        )
+
+    @instrumented_proxy("delitem")
+    def __delitem__(self, member):
+        self._no_local_copy()
+        self._writer().zrem(self.redis_key, self.value_field.serialize(member))
+
+    @instrumented_proxy("contains")
+    def __contains__(self, member):
+        self._no_local_copy()
+        score = self._reader().zscore(
+            self.redis_key, self.value_field.serialize(member)
+        )
+        return score is not None
+
+    @instrumented_proxy("incr")
+    def incr(self, member, amount=1):
+        """Increment the score of member with a single command (ZINCRBY),
+        return None inside a batch."""
+        self._no_local_copy()
+        writer = self._writer()
+        score = writer.zincrby(
+            self.redis_key, amount, self.value_field.serialize(member)
+        )
+        return None if writer is not self.redis_client else score
+
+    @instrumented_proxy("update")
+    def update(self, *args, **kwargs):
+        """Set the scores with one ZADD."""
+        self._no_local_copy()
+        mapping = {
+            self.value_field.serialize(member): score
+            for member, score in dict(*args, **kwargs).items()
+        }
+        if mapping:
+            self._writer().zadd(self.redis_key, mapping)
+
+    @instrumented_proxy("rank")
+    def rank(self, member, reverse=False):
+        """The rank of member, by ascending score (descending if reverse), None if missing."""
+        self._no_local_copy()
+        serialized = self.value_field.serialize(member)
+        if reverse:
+            return self._reader().zrevrank(self.redis_key, serialized)
+        return self._reader().zrank(self.redis_key, serialized)
+
+    @instrumented_proxy("range")
+    def range(self, start=0, stop=-1, reverse=False):
+        """The (member, score) from rank start to stop included (ZRANGE)."""
+        self._no_local_copy()
+        return [
+            (self.value_field.deserialize(m), score)
+            for m, score in self._reader().zrange(
+                self.redis_key, start, stop, desc=reverse, withscores=True
+            )
+        ]
+
+    @instrumented_proxy("range_by_score")
+    def range_by_score(self, min_score="-inf", max_score="+inf", start=None, num=None):
+        """The (member, score) with min_score <= score <= max_score (ZRANGEBYSCORE)."""
+        self._no_local_copy()
+        return [
+            (self.value_field.deserialize(m), score)
+            for m, score in self._reader().zrangebyscore(
+                self.redis_key, min_score, max_score, start, num, withscores=True
+            )
+        ]
+
+    @instrumented_proxy("most_common")
+    def most_common(self, n=None):
+        """The n members with the highest scores, as collections.Counter.most_common."""
+        if n == 0:
+            return []
+        return self.range(0, -1 if n is None else n - 1, reverse=True)
+
+    @instrumented_proxy("items")
+    def items(self, batch_size=SCAN_BATCH_SIZE):
+        """Iterate over the (member, score) with ZSCAN, unordered."""
+        self._no_local_copy()
+        # the same server for the whole iteration (see set_read_replicas)
+        reader = self._reader()
+        cursor = 0
+        while True:
+            cursor, raw_items = reader.zscan(self.redis_key, cursor, count=batch_size)
+            yield from [
+                (self.value_field.deserialize(m), score) for m, score in raw_items
+            ]
+            if cursor == 0:
+                return
+
+    def __iter__(self):
+        return (member for member, _ in self.items())
+
+    @instrumented_proxy("read_all")
+    def __deepcopy__(self, memo=None):
+        self._no_local_copy()
+        return dict(self.range())
+
+    def __repr__(self):
+        return repr(self.__deepcopy__())
@@ -0,0 +1,120 @@
+import bz2
+import lzma
+import zlib
+from typing import Callable, Dict
+
+from .basic import AbstractField, BytesField, GenericField, StrField
+from .collection_field import ListField
+from .dictionary_field import DictionaryField
+
+
+# the compressed values start with MAGIC and the marker of the codec
+MAGIC = b"\xffonz"
+# marker of an uncompressed value starting with MAGIC
+IDENTITY_MARKER = 0
+# the values smaller than this are not compressed
+COMPRESSION_THRESHOLD = 1024
+
+
+class Codec:
+
+    __slots__ = ("name", "marker", "compress", "decompress")
+
+    def __init__(self, name, marker, compress, decompress):
+        self.name = name
+        self.marker = marker
+        self.compress = compress
+        self.decompress = decompress
+
+
+CODECS: Dict[str, Codec] = {}
+CODECS_BY_MARKER: Dict[int, Codec] = {}
+
+
+def register_codec(
+    name: str,
+    marker: int,
+    compress: Callable[[bytes], bytes],
+    decompress: Callable[[bytes], bytes],
+):
+    """Register a compression codec, marker (1 to 255) is stored before the compressed data."""
+    if not 0 < marker < 256:
+        raise ValueError("marker must be between 1 and 255")
+    if marker in CODECS_BY_MARKER and CODECS_BY_MARKER[marker].name != name:
+        raise ValueError(f"marker {marker} is used by {CODECS_BY_MARKER[marker].name}")
+    codec = Codec(name, marker, compress, decompress)
+    CODECS[name] = codec
+    CODECS_BY_MARKER[marker] = codec
+
+
+register_codec("zlib", 1, zlib.compress, zlib.decompress)
+register_codec("lzma", 2, lzma.compress, lzma.decompress)
+register_codec("bz2", 3, bz2.compress, bz2.decompress)
+
+
+class CompressedField(AbstractField):
+    """Compress the values of field bigger than threshold bytes with codec.
+
+    The compressed values start with a marker: the values written without compression
+    (before the field was compressed, or smaller than the threshold) are still read,
+    the codec and the threshold can be changed without migration.
+    """
+
+    __slots__ = ("field", "codec", "threshold")
+
+    _not_format = AbstractField._not_format + ("codec", "threshold")
+
+    def __init__(self, field, codec="zlib", threshold=COMPRESSION_THRESHOLD):
+        if codec not in CODECS:
+            raise ValueError(f"unknown codec {codec!r}, see register_codec")
+        super().__init__(field.default_value)
+        self.field = field
+        self.codec = codec
+        self.threshold = threshold
+
+    def serialize(self, value):
+        raw = self.field.serialize(value)
+        if not isinstance(raw, bytes):
+            raw = bytes(raw)
+        if len(raw) >= self.threshold:
+            codec = CODECS[self.codec]
+            compressed = codec.compress(raw)
+            if len(compressed) + len(MAGIC) + 1 < len(raw):
+                return MAGIC + bytes((codec.marker,)) + compressed
+        if raw.startswith(MAGIC):
+            return MAGIC + bytes((IDENTITY_MARKER,)) + raw
+        return raw
+
+    def deserialize(self, raw):
+        if raw.startswith(MAGIC):
+            marker = raw[len(MAGIC)]
+            raw = raw[len(MAGIC) + 1 :]
+            if marker != IDENTITY_MARKER:
+                codec = CODECS_BY_MARKER.get(marker)
+                if codec is None:
+                    raise ValueError(f"unknown compression marker {marker}")
+                raw = codec.decompress(raw)
+        return self.field.deserialize(raw)
+
+    @property
+    def _mutable(self):
+        return self.field._mutable
+
+    def same_format(self, other) -> bool:
+        # the uncompressed values of the field can be read
+        if isinstance(other, CompressedField):
+            other = other.field
+        return self.field.same_format(other)
+
+
+def with_compression(field: AbstractField, codec) -> AbstractField:
+    """Compress field (or the values of a DictionaryField, a ListField)
+    if it stores pickled objects, strings or bytes."""
+    if codec is None:
+        return field
+    if isinstance(field, (DictionaryField, ListField)):
+        field.value_field = with_compression(field.value_field, codec)
+        return field
+    if type(field) in (GenericField, StrField, BytesField):
+        return CompressedField(field, codec)
+    return field
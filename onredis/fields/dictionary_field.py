@@ -1,34 +1,104 @@
-from ..client import get_redis_client
-from .basic import AbstractField, GenericField
+import copy
 
+import redis.exceptions
+
+from ..cache import get_client_cache
+from ..client import (
+    get_read_client,
+    get_redis_client,
+    get_write_client,
+    record_write,
+)
+from ..instrumentation import instrumented, instrumented_proxy
+from .basic import GenericField, NativeNumberField
+from .collection_field import CollectionField, SCAN_BATCH_SIZE
+
+# default value of DictionnaryProxy.pop
+_MISSING = object()
+
+
+class DictionaryField(CollectionField):
+    """typing.Dict: a Redis hash."""
 
-class DictionaryField(AbstractField):
     def __init__(self, key_field=None, value_field=None, default_value=None):
+        super().__init__(default_value)
         self.key_field = key_field or GenericField(None)
         self.value_field = value_field or GenericField(None)
-        self.default_value = default_value
 
     def redis_get(self, obj, objtype=None):
         # FIXME: default_value is ignored
         return DictionnaryProxy(
-            obj, get_redis_client(), self.key, self.key_field, self.value_field
+            obj,
+            get_redis_client(),
+            self.redis_key(obj),
+            self.key_field,
+            self.value_field,
+            get_client_cache() if self.cached else None,
         )
 
-    def redis_set(self, obj, value):
-        redis_client = get_redis_client()
-        redis_client.delete(self.key)
+    def read_raw(self, redis_client, key):
+        return redis_client.hgetall(key)
+
+    def value_from_raw(self, raw):
+        return {
+            self.key_field.deserialize(k): self.value_field.deserialize(v)
+            for k, v in raw.items()
+        }
+
+    def write_all(self, redis_client, key, value):
+        """Replace the whole hash by value."""
+        redis_client.delete(key)
         if value:
             value = {
                 self.key_field.serialize(k): self.value_field.serialize(v)
                 for k, v in value.items()
             }
-            redis_client.hmset(self.key, value)
+            redis_client.hset(key, mapping=value)
+
+    @instrumented("incr")
+    def incr(self, obj, key, amount=1):
+        if obj._local_copy:
+            # there is a transaction: update the local copy
+            local_dict = self.__get__(obj)
+            value = local_dict.get(key, 0) + amount
+            local_dict[key] = value
+            return value
+        return self.redis_get(obj).incr(key, amount)
 
-    def serialize(self, value) -> bytes:
-        raise NotImplemented()
+    def create_lazy_local_copy(self, redis_client, key, watch):
+        """Return a LazyLocalDictionary for a lazy transaction: nothing is read yet."""
+        local_dict = LazyLocalDictionary(
+            redis_client, watch, key, self.key_field, self.value_field
+        )
+        if self.value_field._mutable:
+            local_dict.original = {}
+        return local_dict
 
-    def deserialize(self, raw: bytes):
-        raise NotImplemented()
+    def local_copy_from_raw(self, raw_items):
+        """Return a LocalDictionary from the HGETALL reply."""
+        local_dict = LocalDictionary(
+            (self.key_field.deserialize(k), self.value_field.deserialize(v))
+            for k, v in raw_items.items()
+        )
+        if self.value_field._mutable:
+            # the values may be mutated in place: keep the raw values to compare them on commit
+            local_dict.original = raw_items
+        return local_dict
+
+    def write_local_copy(self, redis_client, key, value):
+        """Write the changes made on the local copy of a transaction.
+
+        Only the changed entries are written (HSET / HDEL),
+        the whole hash is rewritten when it has been replaced or cleared.
+        """
+        if not isinstance(value, LocalDictionary) or value.cleared:
+            self.write_all(redis_client, key, value)
+            return
+        set_items, deleted_keys = value.changes(self.key_field, self.value_field)
+        if deleted_keys:
+            redis_client.hdel(key, *deleted_keys)
+        if set_items:
+            redis_client.hset(key, mapping=set_items)
 
 
 class GenericDictionaryField(DictionaryField):
@@ -38,82 +108,474 @@ class GenericDictionaryField(DictionaryField):
         )
 
 
+class LocalDictionary(dict):
+    """The dict of a DictionaryField inside a transaction.
+
+    Record the keys which are set or deleted,
+    so only these entries are written when the transaction commits.
+    """
+
+    __slots__ = ("set_keys", "deleted_keys", "cleared", "original")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.set_keys = set()
+        self.deleted_keys = set()
+        self.cleared = False
+        # raw hash content when the values have to be compared on commit
+        self.original = None
+
+    def _set(self, key):
+        self.set_keys.add(key)
+        self.deleted_keys.discard(key)
+
+    def _delete(self, key):
+        self.deleted_keys.add(key)
+        self.set_keys.discard(key)
+
+    def __setitem__(self, key, item):
+        super().__setitem__(key, item)
+        self._set(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._delete(key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self._set(key)
+        return super().setdefault(key, default)
+
+    def pop(self, key, *args):
+        if key in self:
+            self._delete(key)
+        return super().pop(key, *args)
+
+    def popitem(self):
+        key, item = super().popitem()
+        self._delete(key)
+        return key, item
+
+    def update(self, *args, **kwargs):
+        for key, item in dict(*args, **kwargs).items():
+            self[key] = item
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        super().clear()
+        self.set_keys.clear()
+        self.deleted_keys.clear()
+        self.cleared = True
+
+    def changes(self, key_field, value_field):
+        """Return the serialized entries to set and the serialized keys to delete."""
+        if self.original is None:
+            set_items = {
+                key_field.serialize(k): value_field.serialize(self[k])
+                for k in self.set_keys
+            }
+            deleted_keys = [key_field.serialize(k) for k in self.deleted_keys]
+            return set_items, deleted_keys
+        # compare with the original raw hash
+        set_items = {}
+        serialized_keys = set()
+        for key, item in self.items():
+            skey = key_field.serialize(key)
+            sitem = value_field.serialize(item)
+            serialized_keys.add(skey)
+            if self.original.get(skey) != sitem:
+                set_items[skey] = sitem
+        deleted_keys = [skey for skey in self.original if skey not in serialized_keys]
+        return set_items, deleted_keys
+
+    def __deepcopy__(self, memo=None):
+        return copy.deepcopy(dict(self), memo)
+
+
+class LazyLocalDictionary(LocalDictionary):
+    """The dict of a DictionaryField inside a lazy transaction.
+
+    An entry is read (HGET) the first time it is accessed,
+    the whole hash (HGETALL) only when the dict is iterated or its length is required.
+    The hash is WATCHed before the first read.
+    """
+
+    __slots__ = (
+        "redis_client",
+        "watch",
+        "redis_key",
+        "key_field",
+        "value_field",
+        "loaded",
+        "absent_keys",
+    )
+
+    def __init__(self, redis_client, watch, redis_key, key_field, value_field):
+        super().__init__()
+        self.redis_client = redis_client
+        self.watch = watch
+        self.redis_key = redis_key
+        self.key_field = key_field
+        self.value_field = value_field
+        self.loaded = False
+        self.absent_keys = set()
+
+    def __missing__(self, key):
+        if self.loaded or key in self.deleted_keys or key in self.absent_keys:
+            raise KeyError(key)
+        self.watch(self.redis_key)
+        skey = self.key_field.serialize(key)
+        raw = self.redis_client.hget(self.redis_key, skey)
+        if raw is None:
+            self.absent_keys.add(key)
+            raise KeyError(key)
+        if self.original is not None:
+            self.original[skey] = raw
+        item = self.value_field.deserialize(raw)
+        dict.__setitem__(self, key, item)
+        return item
+
+    def _load(self):
+        if self.loaded:
+            return
+        self.watch(self.redis_key)
+        for skey, raw in self.redis_client.hgetall(self.redis_key).items():
+            key = self.key_field.deserialize(skey)
+            if dict.__contains__(self, key) or key in self.deleted_keys:
+                continue
+            if self.original is not None:
+                self.original[skey] = raw
+            dict.__setitem__(self, key, self.value_field.deserialize(raw))
+        self.loaded = True
+
+    def __contains__(self, key):
+        if dict.__contains__(self, key):
+            return True
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, item):
+        super().__setitem__(key, item)
+        self.absent_keys.discard(key)
+
+    def __delitem__(self, key):
+        if key in self:
+            super().__delitem__(key)
+        else:
+            raise KeyError(key)
+
+    def clear(self):
+        super().clear()
+        self.loaded = True
+
+    def __len__(self):
+        self._load()
+        return super().__len__()
+
+    def __iter__(self):
+        self._load()
+        return super().__iter__()
+
+    def keys(self):
+        self._load()
+        return super().keys()
+
+    def values(self):
+        self._load()
+        return super().values()
+
+    def items(self):
+        self._load()
+        return super().items()
+
+    def popitem(self):
+        self._load()
+        return super().popitem()
+
+    def __eq__(self, other):
+        self._load()
+        return super().__eq__(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        self._load()
+        return super().__repr__()
+
+    def changes(self, key_field, value_field):
+        set_items = {
+            key_field.serialize(k): value_field.serialize(dict.__getitem__(self, k))
+            for k in self.set_keys
+        }
+        if self.original is not None:
+            # the loaded values may be mutated in place
+            for key, item in dict.items(self):
+                if key in self.set_keys:
+                    continue
+                skey = key_field.serialize(key)
+                sitem = value_field.serialize(item)
+                if self.original.get(skey) != sitem:
+                    set_items[skey] = sitem
+        deleted_keys = [key_field.serialize(k) for k in self.deleted_keys]
+        return set_items, deleted_keys
+
+    def __deepcopy__(self, memo=None):
+        self._load()
+        return super().__deepcopy__(memo)
+
+
 class DictionnaryProxy:
 
-    __slots__ = ("obj", "redis_client", "redis_key", "key_field", "value_field")
+    __slots__ = (
+        "obj",
+        "redis_client",
+        "redis_key",
+        "key_field",
+        "value_field",
+        "cache",
+    )
 
-    def __init__(self, obj, redis_client, redis_key, key_field, value_field):
+    def __init__(
+        self, obj, redis_client, redis_key, key_field, value_field, cache=None
+    ):
         self.obj = obj
         self.redis_client = redis_client
         self.redis_key = redis_key
         self.key_field = key_field
         self.value_field = value_field
+        self.cache = cache
 
     def _no_local_copy(self):
         if self.obj._local_copy:
             raise ValueError(
-                f"The DictionnaryProxy for {self.key!r} was acquired before a transaction starts on {self.obj!r}"
+                f"The DictionnaryProxy for {self.redis_key!r} was acquired before a transaction starts on {self.obj!r}"
+            )
+
+    def _reader(self):
+        # a replica, see set_read_replicas
+        return get_read_client(self.redis_client)
+
+    def _writer(self, batched=True):
+        # the pipeline of a batch (see OnRedisBatch) if the reply is not used
+        record_write()
+        writer = get_write_client(self.redis_client)
+        if not batched and writer is not self.redis_client:
+            raise ValueError(
+                f"The DictionnaryProxy for {self.redis_key!r} can't read a reply inside a batch"
             )
+        return writer
 
+    def _hget(self, skey):
+        if self.cache is None:
+            return self._reader().hget(self.redis_key, skey)
+        # the cached value is read from the primary (see AbstractField.redis_get_raw)
+        return self.cache.fetch(
+            self.redis_key,
+            skey,
+            lambda: self.redis_client.hget(self.redis_key, skey),
+        )
+
+    def _invalidate_cache(self):
+        if self.cache is not None:
+            self.cache.invalidate(self.redis_key)
+
+    @instrumented_proxy("getitem")
     def __getitem__(self, key):
         self._no_local_copy()
         skey = self.key_field.serialize(key)
-        return self.value_field.deserialize(
-            self.redis_client.hget(self.redis_key, skey)
-        )
+        return self.value_field.deserialize(self._hget(skey))
 
+    @instrumented_proxy("setitem")
     def __setitem__(self, key, item):
         self._no_local_copy()
         skey = self.key_field.serialize(key)
         sitem = self.value_field.serialize(item)
-        self.redis_client.hset(self.redis_key, skey, sitem)
+        self._writer().hset(self.redis_key, skey, sitem)
+        self._invalidate_cache()
 
+    @instrumented_proxy("delitem")
     def __delitem__(self, key):
         self._no_local_copy()
         skey = self.key_field.serialize(key)
-        self.redis_client.hdel(self.redis_key, skey)
+        self._writer().hdel(self.redis_key, skey)
+        self._invalidate_cache()
 
+    @instrumented_proxy("contains")
     def __contains__(self, key):
         self._no_local_copy()
         skey = self.key_field.serialize(key)
-        return True if self.redis_client.hexists(self.redis_key, skey) else False
+        if self.cache is not None:
+            return self._hget(skey) is not None
+        return True if self._reader().hexists(self.redis_key, skey) else False
 
-    def __len__(self):
+    @instrumented_proxy("get")
+    def get(self, key, default=None):
         self._no_local_copy()
-        return self.redis_client.hlen(self.redis_key)
+        raw = self._hget(self.key_field.serialize(key))
+        return default if raw is None else self.value_field.deserialize(raw)
 
-    def __iter__(self):
+    @instrumented_proxy("get_many")
+    def get_many(self, keys, default=None) -> list:
+        """Read the values of keys with one HMGET, default for the missing keys."""
+        self._no_local_copy()
+        skeys = [self.key_field.serialize(key) for key in keys]
+        if not skeys:
+            return []
+        return [
+            default if raw is None else self.value_field.deserialize(raw)
+            for raw in self._reader().hmget(self.redis_key, skeys)
+        ]
+
+    @instrumented_proxy("update")
+    def update(self, *args, **kwargs):
+        """Write the entries with one HSET."""
+        self._no_local_copy()
+        mapping = {
+            self.key_field.serialize(key): self.value_field.serialize(item)
+            for key, item in dict(*args, **kwargs).items()
+        }
+        if mapping:
+            self._writer().hset(self.redis_key, mapping=mapping)
+            self._invalidate_cache()
+
+    @instrumented_proxy("delete_many")
+    def delete_many(self, keys) -> int:
+        """Delete the entries with one HDEL, return the number of deleted entries."""
+        self._no_local_copy()
+        skeys = [self.key_field.serialize(key) for key in keys]
+        if not skeys:
+            return 0
+        count = self._writer(batched=False).hdel(self.redis_key, *skeys)
+        self._invalidate_cache()
+        return count
+
+    @instrumented_proxy("setdefault")
+    def setdefault(self, key, default=None):
+        """Atomically set key to default if key is missing (HSETNX), return the value of key."""
+        self._no_local_copy()
+        skey = self.key_field.serialize(key)
+        pipeline = self._writer(batched=False).pipeline(transaction=True)
+        pipeline.hsetnx(self.redis_key, skey, self.value_field.serialize(default))
+        pipeline.hget(self.redis_key, skey)
+        created, raw = pipeline.execute()
+        if created:
+            self._invalidate_cache()
+        return self.value_field.deserialize(raw)
+
+    @instrumented_proxy("pop")
+    def pop(self, key, default=_MISSING):
+        """Atomically read and delete key (HGET and HDEL in one MULTI / EXEC block)."""
+        self._no_local_copy()
+        skey = self.key_field.serialize(key)
+        pipeline = self._writer(batched=False).pipeline(transaction=True)
+        pipeline.hget(self.redis_key, skey)
+        pipeline.hdel(self.redis_key, skey)
+        raw, _ = pipeline.execute()
+        if raw is None:
+            if default is _MISSING:
+                raise KeyError(key)
+            return default
+        self._invalidate_cache()
+        return self.value_field.deserialize(raw)
+
+    @instrumented_proxy("incr")
+    def incr(self, key, amount=1):
+        """Increment the value of key with a single command (HINCRBY or HINCRBYFLOAT),
+        return None inside a batch."""
         self._no_local_copy()
-        raise NotImplemented()
+        if not isinstance(self.value_field, NativeNumberField):
+            raise TypeError(
+                f"{self.value_field!r} is not a NativeNumberField: the values can't be incremented by Redis"
+            )
+        skey = self.key_field.serialize(key)
+        writer = self._writer()
+        value = self.value_field.redis_hincr(writer, self.redis_key, skey, amount)
+        self._invalidate_cache()
+        if writer is not self.redis_client:
+            return None
+        return self.value_field.deserialize(value) if isinstance(value, bytes) else value
 
-    def __next__(self):
+    @instrumented_proxy("len")
+    def __len__(self):
         self._no_local_copy()
-        raise NotImplemented()
+        return self._reader().hlen(self.redis_key)
 
+    def __iter__(self):
+        return self.keys()
+
+    @instrumented_proxy("read_all")
     def __deepcopy__(self, memo=None):
         self._no_local_copy()
         return {
             self.key_field.deserialize(k): self.value_field.deserialize(v)
-            for k, v in self.redis_client.hgetall(self.redis_key).items()
+            for k, v in self._reader().hgetall(self.redis_key).items()
         }
 
-    def items(self):
-        self._no_local_copy()
-        return self.__deepcopy__().items()
+    @instrumented_proxy("items")
+    def items(self, batch_size=SCAN_BATCH_SIZE):
+        """Iterate over the entries with HSCAN, batch_size entries per round trip.
 
-    def values(self):
+        The memory usage does not depend on the size of the hash.
+        As with HSCAN, an entry modified during the iteration may be returned twice.
+        """
         self._no_local_copy()
-        return [
-            self.value_field.deserialize(v)
-            for v in self.redis_client.hvals(self.redis_key)
-        ]
+        # the same server for the whole iteration (see set_read_replicas)
+        reader = self._reader()
+        cursor = 0
+        while True:
+            cursor, raw_items = reader.hscan(self.redis_key, cursor, count=batch_size)
+            # deserialize one batch at a time
+            yield from [
+                (self.key_field.deserialize(k), self.value_field.deserialize(v))
+                for k, v in raw_items.items()
+            ]
+            if cursor == 0:
+                return
 
-    def keys(self):
+    def values(self, batch_size=SCAN_BATCH_SIZE):
+        return (v for _, v in self.items(batch_size))
+
+    @instrumented_proxy("keys")
+    def keys(self, batch_size=SCAN_BATCH_SIZE):
+        """Iterate over the keys with HSCAN NOVALUES (Redis 7.4 or later):
+        the values are not transferred. With an older server, the values
+        are transferred but not deserialized."""
         self._no_local_copy()
-        return [
-            self.key_field.deserialize(k)
-            for k in self.redis_client.hkeys(self.redis_key)
-        ]
+        # the same server for the whole iteration (see set_read_replicas)
+        reader = self._reader()
+        no_values = True
+        cursor = 0
+        while True:
+            if no_values:
+                try:
+                    cursor, raw_keys = reader.hscan(
+                        self.redis_key, cursor, count=batch_size, no_values=True
+                    )
+                except redis.exceptions.ResponseError:
+                    # NOVALUES is not supported
+                    no_values = False
+                    continue
+            else:
+                cursor, raw_items = reader.hscan(
+                    self.redis_key, cursor, count=batch_size
+                )
+                raw_keys = list(raw_items)
+            yield from [self.key_field.deserialize(k) for k in raw_keys]
+            if cursor == 0:
+                return
 
     def __repr__(self):
         self._no_local_copy()
@@ -0,0 +1,457 @@
+import contextvars
+import functools
+import inspect
+import math
+import threading
+import time
+from typing import Dict, Optional, Sequence
+
+import redis
+
+from .client import get_redis_client
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    math.inf,
+)
+
+
+class Instrumentation:
+    """Receive the measures of the onredis operations (see enable_instrumentation).
+
+    An operation is a field read or write (get, set, incr, ...), a method of a proxy
+    (DictionnaryProxy, ListProxy, ...) or a whole transaction (field_name is None).
+    round_trips, bytes_sent and bytes_received are counted by the connections of
+    the client given to enable_instrumentation, they are 0 for the other clients.
+
+    Subclass it to forward the measures to a metrics library.
+    """
+
+    def record(
+        self,
+        class_name: str,
+        field_name: Optional[str],
+        operation: str,
+        duration: float,
+        round_trips: int,
+        bytes_sent: int,
+        bytes_received: int,
+        error: bool,
+    ):
+        pass
+
+    def conflict(self, class_name: str):
+        """A transaction on an instance of class_name was aborted by a WatchError."""
+
+
+class OperationMetrics:
+    """The measures of one operation of one field."""
+
+    __slots__ = (
+        "count",
+        "errors",
+        "round_trips",
+        "bytes_sent",
+        "bytes_received",
+        "total_time",
+        "buckets",
+    )
+
+    def __init__(self, bucket_count):
+        self.count = 0
+        self.errors = 0
+        self.round_trips = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.total_time = 0.0
+        self.buckets = [0] * bucket_count
+
+    def to_dict(self, bucket_bounds) -> Dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "round_trips": self.round_trips,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "total_time": self.total_time,
+            "latency_buckets": dict(zip(bucket_bounds, self.buckets)),
+        }
+
+
+class MetricsAggregator(Instrumentation):
+    """In-process aggregation of the measures by (class, field, operation).
+
+    snapshot() returns the counters, prometheus() returns them in the
+    Prometheus text format (to be served by an HTTP endpoint).
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.bucket_bounds = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.operations: Dict[tuple, OperationMetrics] = {}
+            self.conflicts: Dict[str, int] = {}
+
+    def record(
+        self,
+        class_name,
+        field_name,
+        operation,
+        duration,
+        round_trips,
+        bytes_sent,
+        bytes_received,
+        error,
+    ):
+        # the index of the first bucket containing duration
+        bucket = next(
+            (i for i, bound in enumerate(self.bucket_bounds) if duration <= bound),
+            len(self.bucket_bounds) - 1,
+        )
+        key = (class_name, field_name, operation)
+        with self._lock:
+            metrics = self.operations.get(key)
+            if metrics is None:
+                metrics = self.operations[key] = OperationMetrics(
+                    len(self.bucket_bounds)
+                )
+            metrics.count += 1
+            metrics.errors += error
+            metrics.round_trips += round_trips
+            metrics.bytes_sent += bytes_sent
+            metrics.bytes_received += bytes_received
+            metrics.total_time += duration
+            metrics.buckets[bucket] += 1
+
+    def conflict(self, class_name):
+        with self._lock:
+            self.conflicts[class_name] = self.conflicts.get(class_name, 0) + 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "operations": [
+                    {
+                        "class": class_name,
+                        "field": field_name,
+                        "operation": operation,
+                        **metrics.to_dict(self.bucket_bounds),
+                    }
+                    for (class_name, field_name, operation), metrics in sorted(
+                        self.operations.items(), key=lambda item: repr(item[0])
+                    )
+                ],
+                "conflicts": dict(self.conflicts),
+            }
+
+    def prometheus(self) -> str:
+        snapshot = self.snapshot()
+        lines = []
+        counters = (
+            ("count", "onredis_operations_total"),
+            ("errors", "onredis_operation_errors_total"),
+            ("round_trips", "onredis_round_trips_total"),
+            ("bytes_sent", "onredis_bytes_sent_total"),
+            ("bytes_received", "onredis_bytes_received_total"),
+        )
+        for attribute, metric in counters:
+            lines.append(f"# TYPE {metric} counter")
+            for operation in snapshot["operations"]:
+                lines.append(f"{metric}{{{_labels(operation)}}} {operation[attribute]}")
+        metric = "onredis_operation_duration_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        for operation in snapshot["operations"]:
+            labels = _labels(operation)
+            cumulative = 0
+            for bound, count in operation["latency_buckets"].items():
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f'{metric}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"{metric}_sum{{{labels}}} {operation['total_time']}")
+            lines.append(f"{metric}_count{{{labels}}} {operation['count']}")
+        metric = "onredis_transaction_conflicts_total"
+        lines.append(f"# TYPE {metric} counter")
+        for class_name, count in sorted(snapshot["conflicts"].items()):
+            lines.append(f'{metric}{{class="{class_name}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__} operations={len(self.operations)}, "
+            f"conflicts={sum(self.conflicts.values())}>"
+        )
+
+
+def _labels(operation) -> str:
+    return (
+        f'class="{operation["class"]}",field="{operation["field"] or ""}",'
+        f'operation="{operation["operation"]}"'
+    )
+
+
+INSTRUMENTATION: Optional[Instrumentation] = None
+
+# the counters of the operation running in the current thread or task
+_SCOPE: contextvars.ContextVar = contextvars.ContextVar("onredis_scope", default=None)
+
+
+class Measure:
+    """Measure of one operation: the commands sent while it is active are counted."""
+
+    __slots__ = (
+        "instrumentation",
+        "class_name",
+        "field_name",
+        "operation",
+        "round_trips",
+        "bytes_sent",
+        "bytes_received",
+        "start_time",
+        "token",
+    )
+
+    def __init__(self, instrumentation, class_name, field_name, operation):
+        self.instrumentation = instrumentation
+        self.class_name = class_name
+        self.field_name = field_name
+        self.operation = operation
+        self.round_trips = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.start_time = 0.0
+        self.token = None
+
+    def start(self):
+        self.token = _SCOPE.set(self)
+        self.start_time = time.perf_counter()
+
+    def stop(self, error=False):
+        duration = time.perf_counter() - self.start_time
+        _SCOPE.reset(self.token)
+        self.record(duration, error)
+
+    def record(self, duration, error):
+        self.instrumentation.record(
+            self.class_name,
+            self.field_name,
+            self.operation,
+            duration,
+            self.round_trips,
+            self.bytes_sent,
+            self.bytes_received,
+            error,
+        )
+
+
+def start_measure(obj, field_name, operation) -> Optional[Measure]:
+    """Start the measure of an operation on obj,
+    None if the instrumentation is disabled or an operation is already measured."""
+    instrumentation = INSTRUMENTATION
+    if instrumentation is None or _SCOPE.get() is not None:
+        return None
+    measure = Measure(instrumentation, type(obj)._redis_prefix, field_name, operation)
+    measure.start()
+    return measure
+
+
+# field -> field name
+_FIELD_NAMES: Dict = {}
+
+
+def _field_name(obj, field) -> Optional[str]:
+    name = _FIELD_NAMES.get(field)
+    if name is None:
+        for field_name, class_field in type(obj).__fields__.items():
+            _FIELD_NAMES[class_field] = field_name
+        name = _FIELD_NAMES.get(field)
+    return name
+
+
+def _proxy_field_name(proxy) -> Optional[str]:
+    # the field stored in the Redis key of the proxy
+    for field, location in proxy.obj._redis_keys.items():
+        if location == proxy.redis_key:
+            return _field_name(proxy.obj, field)
+    return None
+
+
+def _instrument(method, operation, get_obj, get_field_name):
+    if inspect.isgeneratorfunction(method):
+        # measure the whole iteration, without the time spent by the caller
+        # between two items
+        @functools.wraps(method)
+        def generator_wrapper(self, *args, **kwargs):
+            generator = method(self, *args, **kwargs)
+            if INSTRUMENTATION is None or _SCOPE.get() is not None:
+                yield from generator
+                return
+            obj = get_obj(self, args)
+            measure = Measure(
+                INSTRUMENTATION,
+                type(obj)._redis_prefix,
+                get_field_name(self, obj),
+                operation,
+            )
+            duration = 0.0
+            error = False
+            try:
+                while True:
+                    token = _SCOPE.set(measure)
+                    start_time = time.perf_counter()
+                    try:
+                        item = next(generator)
+                    except StopIteration:
+                        return
+                    except BaseException:
+                        error = True
+                        raise
+                    finally:
+                        duration += time.perf_counter() - start_time
+                        _SCOPE.reset(token)
+                    yield item
+            finally:
+                measure.record(duration, error)
+
+        return generator_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if INSTRUMENTATION is None or _SCOPE.get() is not None:
+            # disabled, or called by another measured operation
+            return method(self, *args, **kwargs)
+        obj = get_obj(self, args)
+        measure = Measure(
+            INSTRUMENTATION,
+            type(obj)._redis_prefix,
+            get_field_name(self, obj),
+            operation,
+        )
+        measure.start()
+        try:
+            result = method(self, *args, **kwargs)
+        except BaseException:
+            measure.stop(error=True)
+            raise
+        measure.stop()
+        return result
+
+    return wrapper
+
+
+def instrumented(operation: str):
+    """Decorator of the field methods called with the object as first argument."""
+    return lambda method: _instrument(
+        method,
+        operation,
+        lambda field, args: args[0],
+        lambda field, obj: _field_name(obj, field),
+    )
+
+
+def instrumented_proxy(operation: str):
+    """Decorator of the proxy methods (DictionnaryProxy, ListProxy, ...)."""
+    return lambda method: _instrument(
+        method,
+        operation,
+        lambda proxy, args: proxy.obj,
+        lambda proxy, obj: _proxy_field_name(proxy),
+    )
+
+
+def _response_size(response) -> int:
+    # the size of the values of a reply (without the protocol overhead)
+    if isinstance(response, (bytes, str)):
+        return len(response)
+    if isinstance(response, (list, tuple)):
+        return sum(_response_size(item) for item in response)
+    if isinstance(response, dict):
+        return sum(_response_size(k) + _response_size(v) for k, v in response.items())
+    return 0
+
+
+class InstrumentedConnection:
+    """Mixin of redis.Connection counting the round trips and the bytes
+    of the measured operation (see instrument_client)."""
+
+    def send_packed_command(self, command, check_health=True):
+        measure = _SCOPE.get()
+        if measure is not None:
+            measure.round_trips += 1
+            if isinstance(command, (bytes, str)):
+                measure.bytes_sent += len(command)
+            else:
+                measure.bytes_sent += sum(len(chunk) for chunk in command)
+        return super().send_packed_command(command, check_health)
+
+    def read_response(self, *args, **kwargs):
+        response = super().read_response(*args, **kwargs)
+        measure = _SCOPE.get()
+        if measure is not None:
+            measure.bytes_received += _response_size(response)
+        return response
+
+
+def instrument_client(redis_client: redis.Redis):
+    """Count the round trips and the bytes sent by the connections of redis_client.
+
+    The idle connections of the pool are closed: the next connections
+    are created with InstrumentedConnection.
+    A cluster client has one pool per node: its round trips and bytes are not counted.
+    """
+    pool = getattr(redis_client, "connection_pool", None)
+    if pool is None:
+        return
+    connection_class = pool.connection_class
+    if issubclass(connection_class, InstrumentedConnection):
+        return
+    pool.connection_class = type(
+        "Instrumented" + connection_class.__name__,
+        (InstrumentedConnection, connection_class),
+        {},
+    )
+    pool.disconnect(inuse_connections=False)
+    pool.reset()
+
+
+def enable_instrumentation(
+    instrumentation: Optional[Instrumentation] = None,
+    redis_client: Optional[redis.Redis] = None,
+) -> Instrumentation:
+    """Measure the onredis operations, by default with a MetricsAggregator.
+
+    The connections of redis_client (by default the client given to set_redis_client)
+    count the round trips and the bytes (see instrument_client).
+    When the instrumentation is disabled, the cost is one test per operation.
+    """
+    global INSTRUMENTATION
+    instrumentation = instrumentation or MetricsAggregator()
+    redis_client = redis_client or get_redis_client()
+    if redis_client is not None:
+        instrument_client(redis_client)
+    INSTRUMENTATION = instrumentation
+    return instrumentation
+
+
+def disable_instrumentation():
+    global INSTRUMENTATION
+    INSTRUMENTATION = None
+
+
+def get_instrumentation() -> Optional[Instrumentation]:
+    return INSTRUMENTATION
@@ -0,0 +1,158 @@
+from typing import Dict, List
+
+
+def object_prefix(redis_prefix: str, id=None, cluster=False) -> str:
+    """The prefix of the keys of an object: module.Class for the singleton,
+    module.Class:id for a keyed instance.
+
+    With cluster, the prefix is a hash tag ({module.Class:id}):
+    all the keys of an object are in the same Redis Cluster slot.
+    """
+    prefix = redis_prefix if id is None else f"{redis_prefix}:{id}"
+    return "{" + prefix + "}" if cluster else prefix
+
+
+class KeysLayout:
+    """One Redis key per scalar field: module.Class.field (module.Class:id.field)
+
+    The location of a field is its Redis key.
+    """
+
+    name = "keys"
+
+    def location(self, object_prefix: str, field_name: str):
+        return bytes(object_prefix + "." + field_name, encoding="utf-8")
+
+    def redis_key(self, location) -> bytes:
+        # the key to WATCH or to invalidate in the client side cache
+        return location
+
+    def location_name(self, location) -> bytes:
+        # a unique name of the location, to name the related keys (lock, ...)
+        return location
+
+    def key_suffixes(self, field_names):
+        # the suffixes of the keys after the object prefix (see onredis.schema)
+        return ["." + field_name for field_name in field_names]
+
+    def cache_entry(self, location):
+        return location, None
+
+    def get(self, redis_client, location):
+        return redis_client.get(location)
+
+    def set(self, redis_client, location, raw):
+        return redis_client.set(location, raw)
+
+    def set_default(self, redis_client, location, raw):
+        return redis_client.set(location, raw, nx=True)
+
+    def delete(self, redis_client, location):
+        return redis_client.delete(location)
+
+    def incr(self, redis_client, location, field, amount):
+        return field.redis_incr(redis_client, location, amount)
+
+    def read(self, redis_client, locations: List):
+        """Read the fields of one object with a single command."""
+        return redis_client.mget(locations)
+
+    def queue_read(self, pipeline, locations: List):
+        """Queue the commands reading the fields of one or more objects,
+        return a function returning the raw values from the iterator of the replies."""
+        pipeline.mget(locations)
+        return next
+
+    def write(self, redis_client, serialized_values: Dict, deleted_locations: List):
+        if deleted_locations:
+            redis_client.delete(*deleted_locations)
+        if serialized_values:
+            redis_client.mset(serialized_values)
+
+
+class HashLayout:
+    """The scalar fields of an object in one Redis hash: module.Class!fields (module.Class:id!fields)
+
+    The location of a field is (key of the hash, field name).
+    A transaction WATCHes one key instead of one key per field.
+    """
+
+    name = "hash"
+
+    def location(self, object_prefix: str, field_name: str):
+        return (
+            bytes(object_prefix + "!fields", encoding="utf-8"),
+            field_name.encode(),
+        )
+
+    def redis_key(self, location) -> bytes:
+        return location[0]
+
+    def location_name(self, location) -> bytes:
+        return location[0] + b"." + location[1]
+
+    def key_suffixes(self, field_names):
+        return ["!fields"]
+
+    def cache_entry(self, location):
+        return location
+
+    def get(self, redis_client, location):
+        return redis_client.hget(*location)
+
+    def set(self, redis_client, location, raw):
+        return redis_client.hset(location[0], location[1], raw)
+
+    def set_default(self, redis_client, location, raw):
+        return redis_client.hsetnx(location[0], location[1], raw)
+
+    def delete(self, redis_client, location):
+        return redis_client.hdel(*location)
+
+    def incr(self, redis_client, location, field, amount):
+        return field.redis_hincr(redis_client, location[0], location[1], amount)
+
+    def read(self, redis_client, locations: List):
+        """Read the fields of one object with a single command."""
+        return redis_client.hmget(locations[0][0], [field for _, field in locations])
+
+    def queue_read(self, pipeline, locations: List):
+        """Queue one HMGET per object,
+        return a function returning the raw values from the iterator of the replies."""
+        indexes = _group_by_key(locations)
+        for key, key_indexes in indexes.items():
+            pipeline.hmget(key, [locations[i][1] for i in key_indexes])
+
+        def parse(results):
+            raw_values = [None] * len(locations)
+            for key_indexes in indexes.values():
+                for i, raw in zip(key_indexes, next(results)):
+                    raw_values[i] = raw
+            return raw_values
+
+        return parse
+
+    def write(self, redis_client, serialized_values: Dict, deleted_locations: List):
+        for key, key_indexes in _group_by_key(deleted_locations).items():
+            redis_client.hdel(key, *[deleted_locations[i][1] for i in key_indexes])
+        locations = list(serialized_values.keys())
+        for key, key_indexes in _group_by_key(locations).items():
+            redis_client.hset(
+                key,
+                mapping={
+                    locations[i][1]: serialized_values[locations[i]]
+                    for i in key_indexes
+                },
+            )
+
+
+def _group_by_key(locations) -> Dict[bytes, List[int]]:
+    indexes = {}
+    for i, (key, _) in enumerate(locations):
+        indexes.setdefault(key, []).append(i)
+    return indexes
+
+
+KEYS_LAYOUT = KeysLayout()
+HASH_LAYOUT = HashLayout()
+LAYOUTS = {layout.name: layout for layout in (KEYS_LAYOUT, HASH_LAYOUT)}
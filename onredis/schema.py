@@ -0,0 +1,415 @@
+import ast
+import functools
+from typing import Dict, List
+
+import redis
+import redis.lock
+
+from .cache import get_client_cache
+from .client import get_redis_client
+from .fields import AbstractField, CollectionField
+from .layout import KEYS_LAYOUT, LAYOUTS, object_prefix
+
+
+CLASSES: List[type] = []
+BATCH_SIZE = 500
+
+
+def register(cls):
+    CLASSES.append(cls)
+
+
+def singleton_prefix(cls) -> str:
+    # the prefix of the keys of the singleton and of the class (hash tag in a cluster)
+    return object_prefix(cls._redis_prefix, cluster=cls._cluster)
+
+
+def keyed_pattern(cls) -> str:
+    # the glob pattern matching the prefixes of the keyed instances
+    pattern = _glob_escape(cls._redis_prefix) + ":*"
+    return "{" + pattern + "}" if cls._cluster else pattern
+
+
+def schema_key(cls) -> str:
+    # hash: field name -> repr of the field
+    return singleton_prefix(cls) + "!schema"
+
+
+def legacy_schema_key(cls) -> str:
+    # string: repr of cls.__fields__ (written by the previous versions)
+    return singleton_prefix(cls) + "!class"
+
+
+LAYOUT_ENTRY = "!layout"
+
+
+def expected_schema(cls) -> Dict[bytes, bytes]:
+    schema = {
+        field_name.encode(): repr(field).encode()
+        for field_name, field in cls.__fields__.items()
+    }
+    if cls._layout is not KEYS_LAYOUT:
+        # not written for the default layout: the schemas stored before the layouts stay valid
+        schema[LAYOUT_ENTRY.encode()] = cls._layout.name.encode()
+    return schema
+
+
+def check_schemas(classes=None, redis_client=None):
+    """Check the field definitions of the classes stored on Redis, once per process.
+
+    The classes default to all the @onredis classes not checked yet.
+    All the definitions are read in one round trip.
+    When a definition has changed, the data is migrated (see migrate).
+    """
+    classes = [cls for cls in (classes or CLASSES) if not cls._schema_checked]
+    if not classes:
+        return
+    redis_client = redis_client or get_redis_client()
+
+    pipeline = redis_client.pipeline(transaction=False)
+    for cls in classes:
+        pipeline.hgetall(schema_key(cls))
+        pipeline.get(legacy_schema_key(cls))
+    results = pipeline.execute()
+
+    pipeline = redis_client.pipeline(transaction=False)
+    for i, cls in enumerate(classes):
+        stored, legacy = results[2 * i], results[2 * i + 1]
+        expected = expected_schema(cls)
+        if stored == expected:
+            pass
+        elif not stored and legacy is None:
+            # nothing stored yet
+            pipeline.hset(schema_key(cls), mapping=expected)
+        elif not stored and legacy == repr(cls.__fields__).encode():
+            # same definition stored by a previous version
+            pipeline.hset(schema_key(cls), mapping=expected)
+            pipeline.delete(legacy_schema_key(cls))
+        else:
+            migrate(cls, redis_client)
+        cls._schema_checked = True
+    pipeline.execute()
+
+
+def migrate(cls, redis_client=None):
+    """Migrate the data of cls stored with a previous definition of the fields.
+
+    * the unchanged fields are kept
+    * the fields with another encoding are converted (read with the previous definition,
+      written with the current one), the values which can't be converted are deleted
+    * the removed fields are deleted
+    * the data of a field whose previous definition can't be parsed is kept as it is
+    """
+    redis_client = redis_client or get_redis_client()
+    # only one process migrates the data
+    with redis.lock.Lock(redis_client, singleton_prefix(cls) + "!migration", timeout=600):
+        stored = redis_client.hgetall(schema_key(cls))
+        expected = expected_schema(cls)
+        if stored == expected:
+            # another process has done the migration
+            return
+        if stored:
+            previous = {k.decode(): v.decode() for k, v in stored.items()}
+        else:
+            legacy = redis_client.get(legacy_schema_key(cls))
+            previous = parse_legacy_schema(legacy.decode()) if legacy else {}
+
+        previous_layout = LAYOUTS.get(previous.pop(LAYOUT_ENTRY, None), KEYS_LAYOUT)
+        previous_fields = {}
+        for field_name, previous_repr in previous.items():
+            field = cls.__fields__.get(field_name)
+            if field is not None and previous_repr == repr(field):
+                # unchanged field, even if its repr can't be parsed
+                previous_fields[field_name] = field
+                continue
+            try:
+                previous_fields[field_name] = parse_field_repr(previous_repr)
+            except ValueError:
+                # unknown format (for example a default value which is not a literal):
+                # the data of a removed field is deleted, the other data is kept as it is
+                previous_fields[field_name] = field
+
+        # CollectionField: one Redis key per object, whatever the layout
+        for field_name, previous_field in previous_fields.items():
+            field = cls.__fields__.get(field_name)
+            is_collection = isinstance(field, CollectionField)
+            was_collection = isinstance(previous_field, CollectionField)
+            if not (is_collection or was_collection or previous_field is None):
+                continue
+            if field is not None and previous_field is not None and field.same_format(
+                previous_field
+            ):
+                continue
+            keys = field_keys(cls, field_name, redis_client)
+            if is_collection and type(field) is type(previous_field):
+                _convert_keys(redis_client, keys, previous_field, field)
+            else:
+                _delete_keys(redis_client, keys)
+
+        # the other fields: stored according to the layout
+        _migrate_scalar_fields(
+            cls,
+            previous_layout,
+            {
+                field_name: previous_field
+                for field_name, previous_field in previous_fields.items()
+                if not isinstance(previous_field, CollectionField)
+            },
+            redis_client,
+        )
+
+        pipeline = redis_client.pipeline(transaction=True)
+        pipeline.delete(schema_key(cls), legacy_schema_key(cls))
+        pipeline.hset(schema_key(cls), mapping=expected)
+        pipeline.execute()
+
+    # the cached values may have been converted
+    cache = get_client_cache()
+    if cache is not None:
+        cache.clear()
+
+
+def field_keys(cls, field_name, redis_client) -> List[bytes]:
+    """The Redis keys of a field: the singleton one and the keyed instances ones."""
+    keys = [(singleton_prefix(cls) + "." + field_name).encode()]
+    pattern = keyed_pattern(cls) + "." + _glob_escape(field_name)
+    keys.extend(redis_client.scan_iter(match=pattern, count=BATCH_SIZE))
+    return keys
+
+
+def object_prefixes(cls, layout, field_names, redis_client) -> List[str]:
+    """The prefixes of the objects storing at least one of the fields with layout:
+    the singleton one and the keyed instances ones."""
+    prefixes = {singleton_prefix(cls): None}
+    for suffix in layout.key_suffixes(field_names):
+        pattern = keyed_pattern(cls) + _glob_escape(suffix)
+        for key in redis_client.scan_iter(match=pattern, count=BATCH_SIZE):
+            prefixes[key.decode()[: -len(suffix)]] = None
+    return list(prefixes)
+
+
+def _migrate_scalar_fields(cls, previous_layout, previous_fields, redis_client):
+    # previous_fields: field name -> previous field, None for a removed field
+    # whose format is unknown
+    layout = cls._layout
+    # field name -> function converting a raw value, None to delete the values
+    converters = {}
+    for field_name, previous_field in previous_fields.items():
+        field = cls.__fields__.get(field_name)
+        if (
+            field is None
+            or previous_field is None
+            or isinstance(field, CollectionField)
+        ):
+            converters[field_name] = None
+        elif not field.same_format(previous_field):
+            converters[field_name] = functools.partial(
+                _convert_raw, previous_field, field
+            )
+        elif layout is not previous_layout:
+            converters[field_name] = bytes
+    if not converters:
+        return
+
+    field_names = list(converters)
+    for batch in _batches(
+        object_prefixes(cls, previous_layout, field_names, redis_client)
+    ):
+        pipeline = redis_client.pipeline(transaction=False)
+        parse_functions = [
+            previous_layout.queue_read(
+                pipeline,
+                [
+                    previous_layout.location(prefix, field_name)
+                    for field_name in field_names
+                ],
+            )
+            for prefix in batch
+        ]
+        results = iter(pipeline.execute())
+
+        pipeline = redis_client.pipeline(transaction=False)
+        for prefix, parse in zip(batch, parse_functions):
+            serialized_values = {}
+            deleted_locations = []
+            for field_name, raw in zip(field_names, parse(results)):
+                if raw is None:
+                    continue
+                converted_raw = None
+                if converters[field_name] is not None:
+                    try:
+                        converted_raw = converters[field_name](raw)
+                    except Exception:
+                        # the value can't be converted
+                        pass
+                if converted_raw is None or layout is not previous_layout:
+                    deleted_locations.append(
+                        previous_layout.location(prefix, field_name)
+                    )
+                if converted_raw is not None:
+                    serialized_values[
+                        layout.location(prefix, field_name)
+                    ] = converted_raw
+            previous_layout.write(pipeline, {}, deleted_locations)
+            layout.write(pipeline, serialized_values, [])
+        pipeline.execute()
+
+
+def _convert_raw(previous_field, field, raw):
+    return field.serialize(previous_field.deserialize(raw))
+
+
+def _glob_escape(text):
+    for c in "\\*?[]":
+        text = text.replace(c, "\\" + c)
+    return text
+
+
+def _batches(items, batch_size=BATCH_SIZE):
+    items = list(items)
+    for i in range(0, len(items), batch_size):
+        yield items[i : i + batch_size]
+
+
+def _delete_keys(redis_client, keys):
+    for batch in _batches(keys):
+        redis_client.delete(*batch)
+
+
+def _convert_keys(redis_client, keys, previous_field, field):
+    # previous_field and field are CollectionFields of the same class
+    for batch in _batches(keys):
+        pipeline = redis_client.pipeline(transaction=False)
+        for key in batch:
+            previous_field.read_raw(pipeline, key)
+        raw_values = pipeline.execute()
+
+        pipeline = redis_client.pipeline(transaction=False)
+        for key, raw in zip(batch, raw_values):
+            if not raw:
+                continue
+            try:
+                field.write_all(pipeline, key, previous_field.value_from_raw(raw))
+            except Exception:
+                # the value can't be converted
+                pipeline.delete(key)
+        pipeline.execute()
+
+
+def _field_classes():
+    classes = {}
+    todo = [AbstractField]
+    while todo:
+        field_class = todo.pop()
+        classes[field_class.__name__] = field_class
+        todo.extend(field_class.__subclasses__())
+    return classes
+
+
+class _ReprParser:
+    """Parse the repr of the fields (see AbstractField.__repr__)
+
+    <IntField default_value=0, signed=True, size=4>
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+
+    def error(self):
+        return ValueError(f"Can't parse {self.text!r} at position {self.pos}")
+
+    def expect(self, token):
+        if not self.text.startswith(token, self.pos):
+            raise self.error()
+        self.pos += len(token)
+
+    def field(self) -> AbstractField:
+        self.expect("<")
+        end = self.pos
+        while end < len(self.text) and (
+            self.text[end].isalnum() or self.text[end] == "_"
+        ):
+            end += 1
+        field_class = _field_classes().get(self.text[self.pos : end])
+        if field_class is None:
+            raise self.error()
+        self.pos = end
+        self.expect(" ")
+        # do not call the constructor: set the attributes
+        field = field_class.__new__(field_class)
+        field.cached = False
+        while not self.text.startswith(">", self.pos):
+            if self.text.startswith(", ", self.pos):
+                self.pos += 2
+            end = self.text.find("=", self.pos)
+            if end == -1:
+                raise self.error()
+            name = self.text[self.pos : end]
+            self.pos = end + 1
+            setattr(field, name, self.value())
+        self.pos += 1
+        return field
+
+    def value(self):
+        if self.text.startswith("<", self.pos):
+            return self.field()
+        # a Python literal: find the end
+        start = self.pos
+        depth = 0
+        quote = None
+        while self.pos < len(self.text):
+            c = self.text[self.pos]
+            if quote:
+                if c == "\\":
+                    self.pos += 1
+                elif c == quote:
+                    quote = None
+            elif c in "'\"":
+                quote = c
+            elif c in "([{":
+                depth += 1
+            elif c in ")]}":
+                depth -= 1
+            elif depth == 0 and (c == ">" or self.text.startswith(", ", self.pos)):
+                break
+            self.pos += 1
+        try:
+            return ast.literal_eval(self.text[start : self.pos])
+        except (ValueError, SyntaxError):
+            raise self.error()
+
+    def schema(self) -> Dict[str, str]:
+        # {'total': <FloatField default_value=0>, ...}
+        fields = {}
+        self.expect("{")
+        while not self.text.startswith("}", self.pos):
+            if self.text.startswith(", ", self.pos):
+                self.pos += 2
+            end = self.text.find(": <", self.pos)
+            if end == -1:
+                raise self.error()
+            name = ast.literal_eval(self.text[self.pos : end])
+            self.pos = end + 2
+            start = self.pos
+            self.field()
+            fields[name] = self.text[start : self.pos]
+        return fields
+
+
+def parse_field_repr(text: str) -> AbstractField:
+    """Return a field from its repr, raise ValueError if the repr can't be parsed."""
+    parser = _ReprParser(text)
+    field = parser.field()
+    if parser.pos != len(text):
+        raise parser.error()
+    return field
+
+
+def parse_legacy_schema(text: str) -> Dict[str, str]:
+    """Return the repr of each field from the repr of __fields__
+    stored by the previous versions, an empty dict if it can't be parsed."""
+    try:
+        return _ReprParser(text).schema()
+    except (ValueError, SyntaxError):
+        return {}
@@ -0,0 +1,145 @@
+from typing import Dict, List, Sequence, Tuple
+
+from .client import get_read_client
+from .fields.collection_field import CollectionField
+from .write_behind import flush_writes
+
+
+class Snapshot:
+    """Read the fields of one or more @onredis objects in one round trip.
+
+    All the scalar fields are read with one MGET (one HMGET per object with the hash layout),
+    each collection with one HGETALL, LRANGE, SMEMBERS or ZRANGE,
+    in a single MULTI / EXEC block: the values are consistent.
+    The fields of an object inside a transaction are read from the local copy.
+
+    With @onredis(cluster=True), the scalar fields are read with one command per object
+    (each object is in its own slot) and the values of different objects
+    are read without MULTI / EXEC (see atomic).
+    """
+
+    __slots__ = ("requests", "scalar_fields", "dict_fields", "parse_scalars")
+
+    def __init__(self, requests: Sequence[Tuple[object, Sequence[str]]]):
+        # requests: list of (obj, field names), all fields if field names is empty
+        self.requests = [
+            (obj, list(field_names or obj.__fields__.keys()))
+            for obj, field_names in requests
+        ]
+        # lists of (field, location) by (layout, object in a cluster),
+        # list of (collection field, Redis key)
+        self.scalar_fields = {}
+        self.dict_fields = []
+        for obj, field_names in self.requests:
+            if obj._local_copy:
+                continue
+            for field_name in field_names:
+                field = obj.__fields__[field_name]
+                if isinstance(field, CollectionField):
+                    self.dict_fields.append((field, field.redis_key(obj)))
+                else:
+                    group = (obj._layout, id(obj) if obj._cluster else None)
+                    self.scalar_fields.setdefault(group, []).append(
+                        (field, field.redis_key(obj))
+                    )
+
+    def queue(self, pipeline):
+        """Queue the commands in pipeline, return False if there is nothing to read"""
+        self.parse_scalars = [
+            layout.queue_read(pipeline, [key for _, key in scalar_fields])
+            for (layout, _), scalar_fields in self.scalar_fields.items()
+        ]
+        for field, key in self.dict_fields:
+            field.read_raw(pipeline, key)
+        return bool(self.scalar_fields or self.dict_fields)
+
+    def atomic(self) -> bool:
+        """False if the objects can be in different Redis Cluster slots:
+        the pipeline must not use MULTI / EXEC."""
+        return len(self.requests) == 1 or not any(
+            obj._cluster for obj, _ in self.requests
+        )
+
+    def parse(self, results) -> List[Dict[str, object]]:
+        """Return the values (one dict per object) from the replies of the pipeline"""
+        values = {}
+        results = iter(results)
+        scalar_fields_by_layout = self.scalar_fields.values()
+        for parse, scalar_fields in zip(self.parse_scalars, scalar_fields_by_layout):
+            for (field, key), raw in zip(scalar_fields, parse(results)):
+                values[key] = (
+                    field.default_value if raw is None else field.deserialize(raw)
+                )
+        for (field, key), raw in zip(self.dict_fields, results):
+            values[key] = field.value_from_raw(raw)
+
+        snapshots = []
+        for obj, field_names in self.requests:
+            if obj._local_copy:
+                snapshots.append(
+                    {
+                        field_name: _plain_value(getattr(obj, field_name))
+                        for field_name in field_names
+                    }
+                )
+            else:
+                snapshots.append(
+                    {
+                        field_name: values[obj.__fields__[field_name].redis_key(obj)]
+                        for field_name in field_names
+                    }
+                )
+        return snapshots
+
+
+def queue_write(pipeline, obj, values):
+    """Queue the commands writing values (field name -> value) of obj in pipeline.
+
+    A collection (DictionaryField, ListField, ...) is replaced,
+    a None value deletes the field.
+    Return the written Redis keys.
+    """
+    serialized_values = {}
+    deleted_keys = []
+    written_keys = []
+    for field_name, value in values.items():
+        field = obj.__fields__[field_name]
+        key = field.redis_key(obj)
+        written_keys.append(field.storage_key(obj))
+        if isinstance(field, CollectionField):
+            field.write_all(pipeline, key, value)
+        elif value is None:
+            deleted_keys.append(key)
+        else:
+            serialized_values[key] = field.serialize(value)
+    obj._layout.write(pipeline, serialized_values, deleted_keys)
+    return written_keys
+
+
+def _plain_value(value):
+    # a LocalDictionary is returned as a dict, a LocalList as a list, ...
+    if isinstance(value, dict) and type(value) is not dict:
+        return dict(value.items())
+    for plain_type in (list, set):
+        if isinstance(value, plain_type) and type(value) is not plain_type:
+            return plain_type(value)
+    return value
+
+
+def fetch_many(*objs, redis_client=None) -> List[Dict[str, object]]:
+    """Read all the fields of the objects in one round trip.
+
+    Return one dict per object: field name -> value.
+    """
+    return fetch_requests([(obj, ()) for obj in objs], redis_client)
+
+
+def fetch_requests(requests, redis_client=None) -> List[Dict[str, object]]:
+    # read the buffered writes (see onredis.write_behind)
+    flush_writes()
+    snapshot = Snapshot(requests)
+    pipeline = (redis_client or get_read_client()).pipeline(
+        transaction=snapshot.atomic()
+    )
+    results = pipeline.execute() if snapshot.queue(pipeline) else []
+    return snapshot.parse(results)
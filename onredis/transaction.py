@@ -1,98 +1,925 @@
 import copy
+import functools
+import random
+import threading
+import time
+from typing import Tuple
 
-from .fields.dictionary_field import DictionaryField
-from .client import get_redis_client, set_redis_client_for_thread
+import redis.exceptions
+import redis.lock
+
+from . import client
+from .cache import get_client_cache
+from .fields.collection_field import CollectionField
+from .client import (
+    get_redis_client,
+    record_write,
+    reset_local_redis_client,
+    set_local_redis_client,
+)
+from .instrumentation import get_instrumentation, start_measure
+from .write_behind import flush_writes
+
+
+MISSING = object()
+
+
+class TransactionStats:
+    """Per class transaction counters.
+
+    * attempts: transactions which have tried to commit
+    * conflicts: transactions aborted by a WatchError
+    * retries: transactions run again by run_transaction
+    * exhausted: run_transaction calls which have given up
+    * retry_time: seconds spent waiting before a retry
+    * locked: transactions which have committed holding the lock (see TransactionMode)
+    * lock_waits: locked transactions which have waited for the lock
+    * recent_conflict_rate: moving average of the conflicts over about the last
+      20 transactions, a locked transaction waiting for the lock counts as a conflict
+    """
+
+    __slots__ = (
+        "attempts",
+        "conflicts",
+        "retries",
+        "exhausted",
+        "retry_time",
+        "locked",
+        "lock_waits",
+        "recent_conflict_rate",
+        "lock",
+    )
+
+    # weight of the last transaction in recent_conflict_rate
+    _recent_weight = 0.05
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.attempts = 0
+            self.conflicts = 0
+            self.retries = 0
+            self.exhausted = 0
+            self.retry_time = 0.0
+            self.locked = 0
+            self.lock_waits = 0
+            self.recent_conflict_rate = 0.0
+
+    def add(
+        self,
+        attempts=0,
+        conflicts=0,
+        retries=0,
+        exhausted=0,
+        retry_time=0.0,
+        locked=0,
+        lock_waits=0,
+    ):
+        with self.lock:
+            self.attempts += attempts
+            self.conflicts += conflicts
+            self.retries += retries
+            self.exhausted += exhausted
+            self.retry_time += retry_time
+            self.locked += locked
+            self.lock_waits += lock_waits
+            if attempts:
+                contended = 1.0 if conflicts or lock_waits else 0.0
+                self.recent_conflict_rate += self._recent_weight * (
+                    contended - self.recent_conflict_rate
+                )
+
+    @property
+    def conflict_rate(self) -> float:
+        return self.conflicts / self.attempts if self.attempts else 0.0
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__} attempts={self.attempts}, conflicts={self.conflicts}, "
+            f"retries={self.retries}, exhausted={self.exhausted}, retry_time={self.retry_time:.3f}, "
+            f"locked={self.locked}, lock_waits={self.lock_waits}, "
+            f"recent_conflict_rate={self.recent_conflict_rate:.3f}>"
+        )
+
+
+class TransactionMode:
+    """How the transactions of an @onredis class are isolated (see onredis()).
+
+    * "optimistic": the fields are WATCHed, the transaction raises WatchError
+      if another client changes them before it commits (see run_transaction)
+    * "locked": the transaction holds the lock of the object and does not WATCH:
+      the transactions of an object run one after the other, without conflict.
+      The lock expires after lock_timeout seconds, it is extended as long as the
+      transaction runs. A transaction waits blocking_timeout seconds at most
+      (None: no limit) for the lock, then raises redis.exceptions.LockError.
+      Before committing, it checks that it still holds the lock: if the lock
+      has been lost, it raises redis.exceptions.LockNotOwnedError, nothing is written.
+    * "adaptive": optimistic transactions, locked ones while the recent conflict rate
+      of the class (see TransactionStats) is above lock_above, until it drops below
+      unlock_below. The optimistic transactions WATCH the lock: the processes
+      can switch mode at different times.
+
+    The writes outside a transaction do not take the lock.
+    """
+
+    __slots__ = (
+        "mode",
+        "lock_timeout",
+        "blocking_timeout",
+        "poll_interval",
+        "lock_above",
+        "unlock_below",
+        "locked",
+    )
+
+    MODES = ("optimistic", "locked", "adaptive")
+
+    def __init__(
+        self,
+        mode="optimistic",
+        lock_timeout=10,
+        blocking_timeout=None,
+        poll_interval=0.002,
+        lock_above=0.5,
+        unlock_below=0.2,
+    ):
+        if mode not in self.MODES:
+            raise ValueError(
+                f"mode must be one of {', '.join(self.MODES)}, not {mode!r}"
+            )
+        if unlock_below > lock_above:
+            raise ValueError("unlock_below must not be greater than lock_above")
+        self.mode = mode
+        self.lock_timeout = lock_timeout
+        self.blocking_timeout = blocking_timeout
+        # seconds between two attempts to take the lock
+        self.poll_interval = poll_interval
+        self.lock_above = lock_above
+        self.unlock_below = unlock_below
+        # adaptive mode: the transactions are locked
+        self.locked = False
+
+    def use_lock(self, stats: TransactionStats) -> bool:
+        if self.mode != "adaptive":
+            return self.mode == "locked"
+        rate = stats.recent_conflict_rate
+        if self.locked and rate < self.unlock_below:
+            self.locked = False
+        elif not self.locked and rate > self.lock_above:
+            self.locked = True
+        return self.locked
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__} mode={self.mode!r}, lock_timeout={self.lock_timeout}, "
+            f"blocking_timeout={self.blocking_timeout}, lock_above={self.lock_above}, "
+            f"unlock_below={self.unlock_below}, locked={self.locked}>"
+        )
+
+
+def get_transaction_mode(transaction_mode) -> TransactionMode:
+    # transaction_mode: the name of a mode or a TransactionMode (one per class)
+    if isinstance(transaction_mode, TransactionMode):
+        return copy.copy(transaction_mode)
+    return TransactionMode(transaction_mode)
+
+
+class LockExtender:
+    """Thread extending the locks of the running locked transactions
+    every third of their timeout."""
+
+    def __init__(self):
+        # lock -> time.monotonic() of the next extension
+        self.locks = {}
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def add(self, lock: redis.lock.Lock):
+        with self.condition:
+            self.locks[lock] = time.monotonic() + lock.timeout / 3
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._run, name="onredis-lock-extender", daemon=True
+                )
+                self.thread.start()
+            self.condition.notify()
+
+    def remove(self, lock: redis.lock.Lock):
+        with self.condition:
+            self.locks.pop(lock, None)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                now = time.monotonic()
+                due = [lock for lock, at in self.locks.items() if at <= now]
+                for lock in due:
+                    self.locks[lock] = now + lock.timeout / 3
+                if not due:
+                    next_time = min(self.locks.values(), default=now + 1.0)
+                    self.condition.wait(next_time - now)
+                    continue
+            for lock in due:
+                try:
+                    lock.reacquire()
+                except redis.exceptions.RedisError:
+                    # released in the meantime, or Redis is not available: retry later
+                    pass
+
+
+LOCK_EXTENDER = LockExtender()
+
+
+def acquire_lock(obj, mode: TransactionMode) -> Tuple[redis.lock.Lock, int]:
+    """Take the lock of obj for a locked transaction,
+    return the lock and 1 if the transaction has waited for it, 0 otherwise."""
+    lock = redis.lock.Lock(
+        client.REDIS_CLIENT,
+        obj._lock_name(),
+        timeout=mode.lock_timeout,
+        sleep=mode.poll_interval,
+        # the lock is extended by another thread (see LockExtender)
+        thread_local=False,
+    )
+    waited = 0
+    if not lock.acquire(blocking=False):
+        waited = 1
+        if not lock.acquire(blocking_timeout=mode.blocking_timeout):
+            raise redis.exceptions.LockError(f"Unable to acquire the lock of {obj!r}")
+    LOCK_EXTENDER.add(lock)
+    return lock, waited
+
+
+def check_locks(pipeline, locks):
+    """Check that a locked transaction still holds its locks, before MULTI.
+
+    The locks are not extended anymore and are WATCHed: the EXEC fails
+    if one of them expires before. Raise redis.exceptions.LockNotOwnedError
+    if a lock has expired (it could not be extended in time) or has been taken.
+    """
+    for lock in locks:
+        LOCK_EXTENDER.remove(lock)
+    names = [lock.name for lock in locks]
+    pipeline.watch(*names)
+    for lock, token in zip(locks, pipeline.mget(names)):
+        if isinstance(token, str):
+            token = token.encode()
+        if token != lock.local.token:
+            raise redis.exceptions.LockNotOwnedError(
+                f"the lock {lock.name!r} has been lost, the transaction is aborted"
+            )
+
+
+def release_lock(lock: redis.lock.Lock):
+    LOCK_EXTENDER.remove(lock)
+    try:
+        lock.release()
+    except redis.exceptions.LockError:
+        # the lock has expired
+        pass
+
+
+class RetryPolicy:
+    """How run_transaction retries a transaction aborted by a WatchError.
+
+    The delay before the retry n is a random value between 0 and
+    min(max_delay, base_delay * 2 ** n) ("full jitter" exponential backoff).
+    The transaction runs at most max_attempts times (the first run included: it is
+    retried max_attempts - 1 times), and if budget is set, as long as the total
+    time spent does not exceed budget seconds.
+    """
+
+    __slots__ = ("max_attempts", "base_delay", "max_delay", "budget")
+
+    def __init__(self, max_attempts=10, base_delay=0.001, max_delay=0.1, budget=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__} max_attempts={self.max_attempts}, base_delay={self.base_delay}, "
+            f"max_delay={self.max_delay}, budget={self.budget}>"
+        )
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+def run_transaction(
+    instance, func, *args, policy=None, lazy=False, locked=None, **kwargs
+):
+    """Call func(*args, **kwargs) inside instance.transaction(), retry on WatchError.
+
+    Return the value returned by func.
+    Raise redis.exceptions.WatchError when the retry policy is exhausted.
+    """
+    policy = policy or DEFAULT_RETRY_POLICY
+    stats = instance.transaction_stats
+    start_time = time.monotonic()
+    attempt = 0
+    while True:
+        try:
+            with instance.transaction(lazy=lazy, locked=locked):
+                result = func(*args, **kwargs)
+            return result
+        except redis.exceptions.WatchError:
+            attempt += 1
+            delay = policy.delay(attempt)
+            elapsed = time.monotonic() - start_time
+            if attempt >= policy.max_attempts or (
+                policy.budget is not None and elapsed + delay > policy.budget
+            ):
+                stats.add(exhausted=1)
+                raise
+            time.sleep(delay)
+            stats.add(retries=1, retry_time=delay)
+
+
+def transactional(func=None, *, policy=None, lazy=False, locked=None):
+    """Decorator for the methods of an @onredis class:
+    the method runs inside a transaction, retried on conflict (see run_transaction).
+    """
+
+    def wrap(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            return run_transaction(
+                self,
+                func,
+                self,
+                *args,
+                policy=policy,
+                lazy=lazy,
+                locked=locked,
+                **kwargs,
+            )
+
+        return wrapper
+
+    if func is None:
+        return wrap
+    return wrap(func)
+
+
+def write_changes(redis_client, obj, local_copy, raw_values):
+    """Queue the commands writing the changes of local_copy in redis_client (a pipeline).
+
+    local_copy contains the values of the fields of obj (all of them if the transaction is not lazy),
+    raw_values the raw values of the scalar fields read when the transaction has started.
+    """
+    fields = [
+        (field, field.redis_key(obj))
+        for field in obj.__fields__.values()
+        if dict.__contains__(local_copy, field.redis_key(obj))
+    ]
+
+    # let the CollectionFields write their changes
+    for field, key in fields:
+        if isinstance(field, CollectionField):
+            field.write_local_copy(redis_client, key, dict.__getitem__(local_copy, key))
+
+    # use one MSET (one HSET with the hash layout) for the other changed fields
+    serialized_values = {}
+    deleted_keys = []
+    for field, key in fields:
+        if isinstance(field, CollectionField):
+            continue
+        value = dict.__getitem__(local_copy, key)
+        # the field may have been set without being read
+        raw = raw_values.get(key, MISSING)
+        if value is None:
+            if raw is not None:
+                deleted_keys.append(key)
+            continue
+        serialized_value = field.serialize(value)
+        if (
+            raw is None
+            and field.default_value is not None
+            and serialized_value == field.serialize(field.default_value)
+        ):
+            # never written and not changed: the reads return the default value
+            continue
+        if not field.unchanged(serialized_value, raw):
+            serialized_values[key] = serialized_value
+    obj._layout.write(redis_client, serialized_values, deleted_keys)
+
+
+class ThreadLocalCopy:
+    """Descriptor of the _local_copy attribute: the local copy of the transaction
+    running in the current thread, False if there is none.
+
+    Another thread accessing the same object reads and writes Redis directly.
+    """
+
+    __slots__ = ("local",)
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        copies = getattr(self.local, "copies", None)
+        return copies.get(id(obj), False) if copies else False
+
+    def __set__(self, obj, value):
+        copies = self.local.__dict__.setdefault("copies", {})
+        if value is False:
+            copies.pop(id(obj), None)
+        else:
+            copies[id(obj)] = value
+
+
+class LazyLocalCopy(dict):
+    """Local copy of a lazy transaction: a field is read and WATCHed on first access."""
+
+    __slots__ = ("transaction",)
+
+    def __init__(self, transaction):
+        super().__init__()
+        self.transaction = transaction
+
+    def __bool__(self):
+        # there is a transaction even if no field has been read yet
+        return True
+
+    def __missing__(self, key):
+        value = self.transaction.load_field(key)
+        self[key] = value
+        return value
+
+    def get(self, key, default=None):
+        return self[key]
 
 
 class OnRedisTransaction:
 
-    __slots__ = ("instance", "cls", "pipeline", "execute")
+    __slots__ = (
+        "instance",
+        "cls",
+        "pipeline",
+        "execute",
+        "raw_values",
+        "lazy",
+        "fields_by_key",
+        "watched_keys",
+        "measure",
+        "client_token",
+        "locked",
+        "lock",
+        "lock_waits",
+    )
 
-    def __init__(self, instance, cls):
+    def __init__(self, instance, cls, lazy=False, locked=None):
         """
         Manage the Redis lock.
 
         If local_copy is True, a copy of the fields is done localy.
-        As long the lock is acquired all changes becomes local (whatever the thread).
+        As long the lock is acquired all changes becomes local (in the current thread).
         All the changes are written when the lock is released.
 
         If local_copy is False, the change are written to Redis directly.
+
+        If lazy is True, a field (or an entry of a DictionaryField) is read and WATCHed
+        only the first time the transaction reads it.
+
+        If locked is True, the transaction holds the lock of the object instead of
+        WATCHing the fields, if it is None the mode of the class decides
+        (see TransactionMode).
         """
         self.instance = instance
         self.cls = cls
         self.execute = True
+        self.lazy = lazy
+        self.locked = locked
+        self.lock = None
+        self.lock_waits = 0
+        self.measure = None
+        self.client_token = None
+        self.raw_values = {}
+
+    def reader(self):
+        # the client reading the fields: the pipeline once a key is WATCHed (immediate
+        # mode), the client of set_redis_client with the lock (nothing is WATCHed)
+        return client.REDIS_CLIENT if self.lock is not None else get_redis_client()
+
+    def acquire_lock(self, mode):
+        self.lock, self.lock_waits = acquire_lock(self.instance, mode)
+
+    def release_lock(self):
+        release_lock(self.lock)
+        self.lock = None
+
+    def watch_lock(self):
+        # adaptive mode: the transactions of the other processes may hold the lock
+        redis_client = get_redis_client()
+        lock_name = self.instance._lock_name()
+        redis_client.watch(lock_name)
+        if redis_client.exists(lock_name):
+            self.instance.transaction_stats.add(attempts=1, conflicts=1)
+            raise redis.exceptions.WatchError(f"{self.instance!r} is locked")
+
+    def create_lazy_local_copy(self):
+        self.fields_by_key = {
+            field.redis_key(self.instance): field
+            for field in self.cls.__fields__.values()
+        }
+        self.watched_keys = set()
+        # after the following line, the fields returns the value of local_copy
+        # the Redis transaction starts when the local copy is written
+        self.instance._local_copy = LazyLocalCopy(self)
+
+    def watch(self, key):
+        if self.lock is None and key not in self.watched_keys:
+            get_redis_client().watch(key)
+            self.watched_keys.add(key)
+
+    def load_field(self, key):
+        field = self.fields_by_key[key]
+        redis_client = self.reader()
+        if isinstance(field, CollectionField):
+            return field.create_lazy_local_copy(redis_client, key, self.watch)
+        layout = self.instance._layout
+        self.watch(layout.redis_key(key))
+        raw = layout.get(redis_client, key)
+        self.raw_values[key] = raw
+        return field.local_value(raw)
 
     def create_local_copy(self):
         local_copy = {}
         redis_client = get_redis_client()
-        redis_keys = [v.key for v in self.cls.__fields__.values()]
+        layout = self.instance._layout
+        fields = [
+            (field, field.redis_key(self.instance))
+            for field in self.cls.__fields__.values()
+        ]
+        scalar_fields = [
+            (field, key)
+            for field, key in fields
+            if not isinstance(field, CollectionField)
+        ]
 
-        # abort the incoming transaction if any of the keys are changed
-        redis_client.watch(*redis_keys)
+        if self.lock is None:
+            # abort the incoming transaction if any of the keys are changed
+            # (with the hash layout, the scalar fields share one key)
+            redis_keys = {field.storage_key(self.instance): None for field, _ in fields}
+            redis_client.watch(*redis_keys)
+        pipeline, redis_client = redis_client, self.reader()
 
-        # DictionaryField: use a Python dict (do not use the DictionnaryProxy)
-        for field_name, field in self.cls.__fields__.items():
-            if isinstance(field, DictionaryField):
-                value = getattr(self.instance, field_name)
-                local_copy[field.key] = copy.deepcopy(value)
+        # CollectionField: use a Python dict, list, ... (do not use the proxy)
+        for field, key in fields:
+            if isinstance(field, CollectionField):
+                local_copy[key] = field.create_local_copy(redis_client, key)
 
         # other field types
-        values = get_redis_client().mget(redis_keys)
-        local_copy.update(
-            {
-                field.key: field.default_value
-                if raw is None
-                else field.deserialize(raw)
-                for raw, field in zip(values, self.cls.__fields__.values())
-                if not isinstance(field, DictionaryField)
-            }
-        )
+        # keep the raw values: only the changed fields are written on commit
+        if scalar_fields:
+            values = layout.read(redis_client, [key for _, key in scalar_fields])
+            for raw, (field, key) in zip(values, scalar_fields):
+                self.raw_values[key] = raw
+                local_copy[key] = field.local_value(raw)
 
         # after the following line, the fields returns the value of local_copy
         self.instance._local_copy = local_copy
 
-        # start a Redis transaction
-        redis_client.multi()
+        if self.lock is None:
+            # start a Redis transaction (locked: see __exit__)
+            pipeline.multi()
 
         del local_copy
 
     def write_local_copy(self):
         local_copy = self.instance._local_copy
         self.instance._local_copy = False
-
-        # let DictionaryField write the data
-        for field_name, field in self.cls.__fields__.items():
-            if isinstance(field, DictionaryField):
-                setattr(self.instance, field_name, local_copy[field.key])
-
-        # use one MSET for the other fields
-        serialized_values = {
-            field.key: field.serialize(local_copy[field.key])
-            for field in self.cls.__fields__.values()
-            if not isinstance(field, DictionaryField)
-        }
-        get_redis_client().mset(serialized_values)
-
+        write_changes(get_redis_client(), self.instance, local_copy, self.raw_values)
         del local_copy
 
+    def invalidate_cache(self):
+        cache = get_client_cache()
+        if cache is not None:
+            for field in self.cls.__fields__.values():
+                if field.cached:
+                    cache.invalidate(field.storage_key(self.instance))
+
     def __enter__(self):
-        set_redis_client_for_thread(get_redis_client().pipeline())
-        self.create_local_copy()
+        # see enable_instrumentation
+        self.measure = start_measure(self.instance, None, "transaction")
+        try:
+            # the transaction reads the buffered writes (see onredis.write_behind)
+            flush_writes()
+            mode = self.cls._transaction_mode
+            locked = self.locked
+            if locked is None:
+                locked = mode.use_lock(self.instance.transaction_stats)
+            if locked:
+                self.acquire_lock(mode)
+            # the fields of this thread (or task) use the pipeline until __exit__
+            self.client_token = set_local_redis_client(
+                get_redis_client().pipeline(transaction=True)
+            )
+            if self.lock is None and mode.mode == "adaptive":
+                self.watch_lock()
+            if self.lazy:
+                self.create_lazy_local_copy()
+            else:
+                self.create_local_copy()
+        except BaseException:
+            if self.client_token is not None:
+                pipeline = get_redis_client()
+                reset_local_redis_client(self.client_token)
+                pipeline.reset()
+            if self.lock is not None:
+                self.release_lock()
+            if self.measure is not None:
+                self.measure.stop(error=True)
+            raise
+        return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         pipeline = get_redis_client()
+        error = exc_type is not None
         try:
             if self.execute and exc_type is None:
                 # the transaction was aborted and there is no exception
+                if self.lock is not None:
+                    try:
+                        check_locks(pipeline, [self.lock])
+                    except redis.exceptions.LockError:
+                        self.instance._local_copy = False
+                        raise
+                if self.lazy or self.lock is not None:
+                    # start the Redis transaction
+                    pipeline.multi()
                 self.write_local_copy()
-                pipeline.execute()
+                try:
+                    pipeline.execute()
+                except redis.exceptions.WatchError:
+                    self.instance.transaction_stats.add(attempts=1, conflicts=1)
+                    instrumentation = get_instrumentation()
+                    if instrumentation is not None:
+                        instrumentation.conflict(self.cls._redis_prefix)
+                    raise
+                if self.lock is None:
+                    self.instance.transaction_stats.add(attempts=1)
+                else:
+                    self.instance.transaction_stats.add(
+                        attempts=1, locked=1, lock_waits=self.lock_waits
+                    )
+                record_write()
+                self.invalidate_cache()
             else:
                 # the transaction was aborted OR there is an exception
                 self.instance._local_copy = False
-                pipeline.discard()
+                if not self.lazy and self.lock is None:
+                    # with a lazy or a locked transaction, MULTI has not been sent
+                    pipeline.discard()
+        except BaseException:
+            error = True
+            raise
         finally:
-            set_redis_client_for_thread(None)
+            reset_local_redis_client(self.client_token)
             pipeline.reset()
+            if self.lock is not None:
+                self.release_lock()
+            if self.measure is not None:
+                self.measure.stop(error)
 
     def discard(self):
         self.execute = False
+
+
+class OnRedisMultiTransaction:
+    """Transaction on several @onredis objects, of one or more classes
+    (see onredis.transaction).
+
+    The fields of all the objects are WATCHed with one WATCH, then read with one
+    pipeline: two round trips whatever the number of objects (redis-py sends the
+    WATCH of a pipeline alone). The changes of all the objects are written
+    in one MULTI / EXEC block.
+    The objects of a class in locked mode (see TransactionMode) are locked instead
+    of WATCHed, in the order of their lock names.
+    """
+
+    __slots__ = (
+        "objects",
+        "execute",
+        "raw_values",
+        "locks",
+        "measure",
+        "client_token",
+    )
+
+    def __init__(self, *objects):
+        # an object given twice is in the transaction once
+        self.objects = list({id(obj): obj for obj in objects}.values())
+        if not self.objects:
+            raise ValueError("a transaction requires at least one object")
+        if len(self.objects) > 1 and any(obj._cluster for obj in self.objects):
+            raise ValueError(
+                "the objects of a class with cluster=True are in different slots: "
+                "they can't be in the same transaction"
+            )
+        self.execute = True
+        self.raw_values = {}
+        # id(obj) -> (lock, 1 if the transaction has waited for the lock)
+        self.locks = {}
+        self.measure = None
+        self.client_token = None
+
+    def acquire_locks(self):
+        locked = [
+            obj
+            for obj in self.objects
+            if type(obj)._transaction_mode.use_lock(obj.transaction_stats)
+        ]
+        # the same order in all the transactions: no deadlock
+        for obj in sorted(locked, key=lambda obj: obj._lock_name()):
+            self.locks[id(obj)] = acquire_lock(obj, type(obj)._transaction_mode)
+
+    def create_local_copies(self):
+        watched_keys = {}
+        # the reads are sent after the WATCH (a second round trip), in one pipeline
+        reader = client.REDIS_CLIENT.pipeline(transaction=False)
+        requests = []
+        for obj in self.objects:
+            fields = [
+                (field, field.redis_key(obj)) for field in obj.__fields__.values()
+            ]
+            check_lock = False
+            if id(obj) not in self.locks:
+                # with the hash layout, the scalar fields share one key
+                for field, _ in fields:
+                    watched_keys[field.storage_key(obj)] = None
+                if type(obj)._transaction_mode.mode == "adaptive":
+                    # the transactions of the other processes may hold the lock
+                    check_lock = True
+                    watched_keys[obj._lock_name()] = None
+                    reader.exists(obj._lock_name())
+            scalar_fields = [
+                (field, key)
+                for field, key in fields
+                if not isinstance(field, CollectionField)
+            ]
+            collection_fields = [
+                (field, key)
+                for field, key in fields
+                if isinstance(field, CollectionField)
+            ]
+            parse = (
+                obj._layout.queue_read(reader, [key for _, key in scalar_fields])
+                if scalar_fields
+                else None
+            )
+            for field, key in collection_fields:
+                field.read_raw(reader, key)
+            requests.append((obj, check_lock, scalar_fields, parse, collection_fields))
+
+        pipeline = get_redis_client()
+        if watched_keys:
+            pipeline.watch(*watched_keys)
+        results = iter(reader.execute())
+
+        local_copies = []
+        for obj, check_lock, scalar_fields, parse, collection_fields in requests:
+            if check_lock and next(results):
+                obj.transaction_stats.add(attempts=1, conflicts=1)
+                raise redis.exceptions.WatchError(f"{obj!r} is locked")
+            local_copy = {}
+            if scalar_fields:
+                # keep the raw values: only the changed fields are written on commit
+                for raw, (field, key) in zip(parse(results), scalar_fields):
+                    self.raw_values[key] = raw
+                    local_copy[key] = field.local_value(raw)
+            for field, key in collection_fields:
+                local_copy[key] = field.local_copy_from_raw(next(results))
+            local_copies.append((obj, local_copy))
+
+        # after the following lines, the fields returns the value of local_copy
+        for obj, local_copy in local_copies:
+            obj._local_copy = local_copy
+
+        if not self.locks:
+            # start a Redis transaction (locked: see __exit__)
+            pipeline.multi()
+
+    def write_local_copies(self):
+        local_copies = [(obj, obj._local_copy) for obj in self.objects]
+        for obj in self.objects:
+            obj._local_copy = False
+        for obj, local_copy in local_copies:
+            write_changes(get_redis_client(), obj, local_copy, self.raw_values)
+
+    def invalidate_cache(self):
+        cache = get_client_cache()
+        if cache is not None:
+            for obj in self.objects:
+                for field in obj.__fields__.values():
+                    if field.cached:
+                        cache.invalidate(field.storage_key(obj))
+
+    def release_locks(self):
+        for lock, _ in self.locks.values():
+            release_lock(lock)
+        self.locks.clear()
+
+    def __enter__(self):
+        # see enable_instrumentation
+        self.measure = start_measure(self.objects[0], None, "transaction")
+        try:
+            for obj in self.objects:
+                if obj._local_copy:
+                    raise ValueError(f"{obj!r} is already in a transaction")
+            # the transaction reads the buffered writes (see onredis.write_behind)
+            flush_writes()
+            self.acquire_locks()
+            # the fields of this thread (or task) use the pipeline until __exit__
+            self.client_token = set_local_redis_client(
+                get_redis_client().pipeline(transaction=True)
+            )
+            self.create_local_copies()
+        except BaseException:
+            for obj in self.objects:
+                obj._local_copy = False
+            if self.client_token is not None:
+                pipeline = get_redis_client()
+                reset_local_redis_client(self.client_token)
+                pipeline.reset()
+            self.release_locks()
+            if self.measure is not None:
+                self.measure.stop(error=True)
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pipeline = get_redis_client()
+        error = exc_type is not None
+        try:
+            if self.execute and exc_type is None:
+                if self.locks:
+                    try:
+                        check_locks(
+                            pipeline, [lock for lock, _ in self.locks.values()]
+                        )
+                    except redis.exceptions.LockError:
+                        for obj in self.objects:
+                            obj._local_copy = False
+                        raise
+                    # start the Redis transaction
+                    pipeline.multi()
+                self.write_local_copies()
+                try:
+                    pipeline.execute()
+                except redis.exceptions.WatchError:
+                    instrumentation = get_instrumentation()
+                    for obj in self.objects:
+                        if id(obj) in self.locks:
+                            continue
+                        obj.transaction_stats.add(attempts=1, conflicts=1)
+                        if instrumentation is not None:
+                            instrumentation.conflict(type(obj)._redis_prefix)
+                    raise
+                for obj in self.objects:
+                    if id(obj) in self.locks:
+                        obj.transaction_stats.add(
+                            attempts=1, locked=1, lock_waits=self.locks[id(obj)][1]
+                        )
+                    else:
+                        obj.transaction_stats.add(attempts=1)
+                record_write()
+                self.invalidate_cache()
+            else:
+                # the transaction was aborted OR there is an exception
+                for obj in self.objects:
+                    obj._local_copy = False
+                if not self.locks:
+                    # with a locked object, MULTI has not been sent
+                    pipeline.discard()
+        except BaseException:
+            error = True
+            raise
+        finally:
+            reset_local_redis_client(self.client_token)
+            pipeline.reset()
+            self.release_locks()
+            if self.measure is not None:
+                self.measure.stop(error)
+
+    def discard(self):
+        self.execute = False
+
+
+def transaction(*objects) -> OnRedisMultiTransaction:
+    """Transaction on several objects: with onredis.transaction(a, b): ...
+
+    The changes of all the objects are written atomically, redis.exceptions.WatchError
+    is raised if another client has changed one of them (see OnRedisMultiTransaction).
+    """
+    return OnRedisMultiTransaction(*objects)
@@ -0,0 +1,264 @@
+import atexit
+import logging
+import threading
+from typing import Dict, Optional
+
+from .cache import get_client_cache
+from . import client
+
+logger = logging.getLogger(__name__)
+
+# kinds of pending writes
+SET = 0
+INCR = 1
+
+
+class PendingWrite:
+    """The merged writes of one field of one object since the last flush."""
+
+    __slots__ = ("kind", "field", "layout", "group", "value")
+
+    def __init__(self, kind, field, layout, group, value):
+        self.kind = kind
+        self.field = field
+        self.layout = layout
+        # the writes of a group are sent with one command (see layout.write)
+        self.group = group
+        # SET: the raw value, None to delete the field; INCR: the amount
+        self.value = value
+
+
+class WriteBuffer:
+    """Write-behind buffer of the fields declared with @onredis(write_behind=...).
+
+    Outside a transaction, a write is kept in the buffer instead of being sent to Redis:
+    repeated writes of a field are merged (the last value wins, the increments are
+    summed). A background thread sends the buffer in one pipeline every interval
+    seconds, or as soon as it contains max_size fields, and at exit.
+
+    The reads of a buffered field return the buffered value. A transaction,
+    fetch() and load_many() flush the buffer first. The buffered writes are lost
+    if the process is killed.
+
+    When Redis is not available, the writes are kept for the next flush. The writes
+    rejected by Redis (a command error, for example a key of another type) are dropped
+    and logged: the other writes of the flush are not sent again.
+    """
+
+    def __init__(self, interval=0.1, max_size=10000):
+        self.interval = interval
+        self.max_size = max_size
+        self._pending: Dict = {}
+        # the writes being sent (see read)
+        self._flushing: Dict = {}
+        # incremented each time a flush starts
+        self._generation = 0
+        # the number of writes rejected by Redis
+        self.dropped = 0
+        self._lock = threading.Lock()
+        # serialize the flushes: the writes are sent in order
+        self._flush_lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        atexit.register(self.close)
+
+    def _start(self):
+        # called with self._lock
+        if self._thread is None and not self._stop.is_set():
+            self._thread = threading.Thread(
+                target=self._run, name="onredis-write-behind", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake_up.wait(self.interval)
+            self._wake_up.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Redis is not available: the writes are kept and sent on the next try
+                pass
+
+    def _add(self, obj, field, kind, value):
+        location = field.redis_key(obj)
+        with self._lock:
+            pending = self._pending.get(location)
+            if pending is None or kind == SET:
+                group = id(obj) if obj._cluster else None
+                self._pending[location] = PendingWrite(
+                    kind, field, obj._layout, group, value
+                )
+            elif pending.kind == INCR:
+                pending.value += value
+            else:
+                # increment a buffered value
+                pending.value = field.serialize(_value(field, pending.value) + value)
+            self._start()
+            size = len(self._pending)
+        if size >= self.max_size:
+            self._wake_up.set()
+
+    def set(self, obj, field, value):
+        self._add(obj, field, SET, None if value is None else field.serialize(value))
+
+    def incr(self, obj, field, amount):
+        self._add(obj, field, INCR, amount)
+
+    def read(self, field, location, read_raw):
+        """Return the raw value of location: read_raw() (the value stored in Redis)
+        with the buffered write applied."""
+        while True:
+            with self._lock:
+                generation = self._generation
+                flushing = location in self._flushing
+            if flushing:
+                # Redis may or may not have applied the write: wait for the flush
+                with self._flush_lock:
+                    continue
+            raw = read_raw()
+            with self._lock:
+                if self._generation != generation:
+                    # a flush has started meanwhile: raw may miss its writes
+                    continue
+                pending = self._pending.get(location)
+            if pending is None:
+                return raw
+            if pending.kind == SET:
+                return pending.value
+            return field.serialize(_value(field, raw) + pending.value)
+
+    def flush(self):
+        """Send the buffered writes in one pipeline."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                self._flushing, self._pending = self._pending, {}
+                self._generation += 1
+            try:
+                self._write(self._flushing)
+            except BaseException:
+                # Redis is not available: keep the writes,
+                # except the ones written again in the meantime
+                with self._lock:
+                    for location, write in self._flushing.items():
+                        if location in self._pending:
+                            _merge(self._pending, location, write)
+                        else:
+                            self._pending[location] = write
+                    self._flushing = {}
+                raise
+            with self._lock:
+                self._flushing = {}
+
+    def _write(self, pending):
+        # not the pipeline of a transaction running in this thread (see get_redis_client)
+        pipeline = client.REDIS_CLIENT.pipeline(transaction=False)
+        # (index of the first command, index after the last one, locations)
+        commands = []
+        groups = {}
+        for location, write in pending.items():
+            if write.kind == SET:
+                serialized, deleted = groups.setdefault(
+                    (write.layout, write.group), ({}, [])
+                )
+                if write.value is None:
+                    deleted.append(location)
+                else:
+                    serialized[location] = write.value
+            else:
+                start = len(pipeline)
+                field = write.field
+                if field.default_value:
+                    # Redis starts from 0: initialize the field with the default value
+                    write.layout.set_default(
+                        pipeline, location, field.serialize(field.default_value)
+                    )
+                write.layout.incr(pipeline, location, field, write.value)
+                commands.append((start, len(pipeline), [location]))
+        for (layout, _), (serialized, deleted) in groups.items():
+            start = len(pipeline)
+            layout.write(pipeline, serialized, deleted)
+            commands.append((start, len(pipeline), list(serialized) + deleted))
+        # an error reply does not stop the other commands, which are applied
+        results = pipeline.execute(raise_on_error=False)
+        client.record_write()
+        for start, stop, locations in commands:
+            errors = [r for r in results[start:stop] if isinstance(r, Exception)]
+            if errors:
+                self.dropped += len(locations)
+                logger.error(
+                    "write-behind: the writes of %r are dropped: %s",
+                    locations,
+                    errors[0],
+                )
+        cache = get_client_cache()
+        if cache is not None:
+            for location, write in pending.items():
+                if write.field.cached:
+                    cache.invalidate(write.layout.redis_key(location))
+
+    def __len__(self):
+        return len(self._pending)
+
+    def close(self):
+        """Stop the background thread and flush the buffer."""
+        self._stop.set()
+        self._wake_up.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__} pending={len(self)}, "
+            f"interval={self.interval}, max_size={self.max_size}>"
+        )
+
+
+def _value(field, raw):
+    return field.default_value or 0 if raw is None else field.deserialize(raw)
+
+
+def _merge(pending, location, older):
+    # older was written before pending[location]
+    newer = pending[location]
+    if newer.kind == INCR:
+        if older.kind == INCR:
+            newer.value += older.value
+        else:
+            newer.kind = SET
+            newer.value = newer.field.serialize(
+                _value(newer.field, older.value) + newer.value
+            )
+
+
+WRITE_BUFFER: Optional[WriteBuffer] = None
+
+
+def configure_write_behind(interval=0.1, max_size=10000) -> WriteBuffer:
+    """Set the flush interval (seconds) and the maximum size of the write-behind buffer.
+
+    The buffered writes are flushed first.
+    """
+    global WRITE_BUFFER
+    if WRITE_BUFFER is not None:
+        WRITE_BUFFER.close()
+        atexit.unregister(WRITE_BUFFER.close)
+    WRITE_BUFFER = WriteBuffer(interval, max_size)
+    return WRITE_BUFFER
+
+
+def get_write_buffer() -> WriteBuffer:
+    if WRITE_BUFFER is None:
+        return configure_write_behind()
+    return WRITE_BUFFER
+
+
+def flush_writes():
+    """Send the buffered writes (see @onredis(write_behind=...))."""
+    if WRITE_BUFFER is not None:
+        WRITE_BUFFER.flush()
@@ -34,7 +34,7 @@ def get_packages(package):
 
 setup(
     name="onredis",
-    python_requires=">=3.7",
+    python_requires=">=3.8",
     version=get_version("onredis"),
     url="https://github.com/dalf/onredis",
     project_urls={
@@ -50,18 +50,21 @@ setup(
     include_package_data=True,
     zip_safe=False,
     install_requires=[
-        "redis>=4",
+        "redis>=6.1",
     ],
+    extras_require={
+        "numpy": ["numpy"],
+    },
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Intended Audience :: Developers",
         "License :: OSI Approved :: BSD License",
         "Operating System :: OS Independent",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: 3.8",
         "Programming Language :: Python :: 3.9",
         "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
         "Programming Language :: Python :: 3 :: Only",
     ],
 )
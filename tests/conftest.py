@@ -0,0 +1,92 @@
+import queue
+import threading
+
+import fakeredis
+import pytest
+
+import onredis
+import onredis.cache
+import onredis.write_behind
+
+
+@pytest.fixture
+def redis_client():
+    # a new empty server for each test
+    client = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+    onredis.set_redis_client(client)
+    yield client
+    onredis.set_redis_client(None)
+
+
+@pytest.fixture
+def write_buffer(redis_client):
+    # flushed explicitly by the tests
+    buffer = onredis.configure_write_behind(interval=3600, max_size=1000000)
+    yield buffer
+    buffer.close()
+    onredis.write_behind.WRITE_BUFFER = None
+
+
+class InvalidationConnection:
+    """The connection of a FieldCache receiving the invalidation messages
+    (CLIENT TRACKING is not supported by fakeredis): the tests put the messages."""
+
+    def __init__(self):
+        self.messages = queue.Queue()
+        self.message = None
+
+    def can_read(self, timeout):
+        self._handled()
+        try:
+            # a short timeout: the cache is closed quickly
+            self.message = self.messages.get(timeout=min(timeout, 0.05))
+        except queue.Empty:
+            return False
+        return True
+
+    def read_response(self):
+        if isinstance(self.message, Exception):
+            raise self.message
+        return self.message
+
+    def disconnect(self):
+        pass
+
+    def _handled(self):
+        if self.message is not None:
+            self.message = None
+            self.messages.task_done()
+
+
+class LocalFieldCache(onredis.cache.FieldCache):
+    def __init__(self, *args, **kwargs):
+        self.connections = 0
+        # cleared by the tests to delay the reconnection
+        self.can_connect = threading.Event()
+        self.can_connect.set()
+        super().__init__(*args, **kwargs)
+
+    def _connect(self):
+        self.can_connect.wait()
+        previous = self._connection
+        self._connection = InvalidationConnection()
+        self.connections += 1
+        if previous is not None:
+            # the lost connection has been replaced (see receive)
+            previous._handled()
+
+    def receive(self, message):
+        # wait until the message is handled
+        connection = self._connection
+        connection.messages.put(message)
+        connection.messages.join()
+
+    def invalidation_message(self, keys):
+        return [b"message", onredis.cache.INVALIDATE_CHANNEL, keys]
+
+
+@pytest.fixture
+def field_cache(redis_client):
+    onredis.cache.FIELD_CACHE = LocalFieldCache(redis_client, max_size=100)
+    yield onredis.cache.FIELD_CACHE
+    onredis.cache.disable_client_cache()
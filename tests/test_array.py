@@ -0,0 +1,105 @@
+from typing import Annotated
+
+import pytest
+
+from onredis import onredis
+
+numpy = pytest.importorskip("numpy")
+from numpy.typing import NDArray  # noqa: E402
+
+
+@pytest.fixture
+def Vectors(redis_client):
+    @onredis
+    class Vectors:
+        embedding: NDArray[numpy.float32]
+        histogram: Annotated[NDArray[numpy.int64], (2, 3)]
+
+    return Vectors
+
+
+def test_round_trip(redis_client, Vectors):
+    vectors = Vectors()
+    vectors.embedding = numpy.arange(10, dtype=numpy.float32)
+    vectors.histogram = numpy.arange(6).reshape(2, 3)
+    embedding = vectors.embedding
+    assert embedding.dtype == numpy.float32
+    numpy.testing.assert_array_equal(embedding, numpy.arange(10))
+    # numpy.frombuffer: the value shares the memory of the reply
+    assert not embedding.flags.writeable
+    # the raw buffer, without header
+    key = Vectors.__fields__["embedding"].redis_key(vectors)
+    assert redis_client.strlen(key) == 10 * 4
+    histogram = vectors.histogram
+    assert histogram.shape == (2, 3)
+    numpy.testing.assert_array_equal(histogram, numpy.arange(6).reshape(2, 3))
+
+
+def test_wrong_shape(Vectors):
+    vectors = Vectors()
+    with pytest.raises(ValueError):
+        vectors.histogram = numpy.zeros(5)
+
+
+def test_ranges(redis_client, Vectors, monkeypatch):
+    vectors = Vectors()
+    vectors.embedding = numpy.arange(10, dtype=numpy.float32)
+    commands = []
+    for name in ("get", "set", "getrange", "setrange"):
+        method = getattr(redis_client, name)
+
+        def recorded(*args, name=name, method=method, **kwargs):
+            commands.append(name)
+            return method(*args, **kwargs)
+
+        monkeypatch.setattr(redis_client, name, recorded)
+    vectors.array_write("embedding", 2, [100, 101])
+    numpy.testing.assert_array_equal(
+        vectors.array_read("embedding", 1, 5), [1, 100, 101, 4]
+    )
+    assert vectors.array_read("embedding", 5, 5).size == 0
+    # only the range is transferred
+    assert commands == ["setrange", "getrange"]
+    monkeypatch.undo()
+    numpy.testing.assert_array_equal(
+        vectors.embedding, [0, 1, 100, 101, 4, 5, 6, 7, 8, 9]
+    )
+    # as SETRANGE, writing past the end pads with zeros
+    vectors.array_write("embedding", 11, [11])
+    numpy.testing.assert_array_equal(vectors.array_read("embedding", 9, 12), [9, 0, 11])
+
+
+def test_ranges_in_a_transaction(redis_client, Vectors):
+    vectors = Vectors()
+    vectors.histogram = numpy.arange(6).reshape(2, 3)
+    with vectors.transaction():
+        vectors.array_write("histogram", 4, [9, 9])
+        numpy.testing.assert_array_equal(
+            vectors.array_read("histogram", 3, 6), [3, 9, 9]
+        )
+        # the local copy is changed, Redis is written at the exit
+        key = Vectors.__fields__["histogram"].redis_key(vectors)
+        assert numpy.frombuffer(redis_client.get(key), "<i8")[4] == 4
+    numpy.testing.assert_array_equal(vectors.histogram, [[0, 1, 2], [3, 9, 9]])
+
+
+def test_ranges_require_the_keys_layout(redis_client):
+    @onredis(layout="hash")
+    class Packed:
+        embedding: NDArray[numpy.float32]
+
+    packed = Packed()
+    packed.embedding = numpy.zeros(4, dtype=numpy.float32)
+    with pytest.raises(TypeError):
+        packed.array_read("embedding", 0, 2)
+    with pytest.raises(TypeError):
+        packed.array_write("embedding", 0, [1])
+
+
+def test_not_an_array_field(redis_client):
+    @onredis
+    class Named:
+        name: str = ""
+
+    with pytest.raises(TypeError):
+        Named().array_read("name", 0, 1)
@@ -0,0 +1,34 @@
+import asyncio
+from typing import Dict
+
+import fakeredis
+import pytest
+import redis.exceptions
+
+import onredis.asyncio
+
+
+@pytest.fixture
+def async_redis_client():
+    client = fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer())
+    onredis.asyncio.set_redis_client(client)
+    yield client
+    onredis.asyncio.set_redis_client(None)
+
+
+def test_failed_transaction_start_releases_the_connection(async_redis_client):
+    @onredis.asyncio.onredis
+    class Scores:
+        per_user: Dict[str, int] = {}
+
+    async def main():
+        scores = Scores()
+        # HGETALL on a string: the read fails after the WATCH
+        await async_redis_client.set("tests.test_asyncio.Scores.per_user", "x")
+        with pytest.raises(redis.exceptions.ResponseError):
+            async with scores.transaction():
+                pass
+        assert not scores._local_copy
+        assert not async_redis_client.connection_pool._in_use_connections
+
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+from typing import Dict, List
+
+import pytest
+
+import onredis
+from onredis import onredis as onredis_class
+
+
+@pytest.fixture
+def Player(redis_client):
+    @onredis_class(native_numbers=True)
+    class Player:
+        score: int = 3
+        name: str = ""
+        inventory: Dict[str, int] = {}
+        history: List[str] = []
+
+    return Player
+
+
+@pytest.fixture
+def pipelines(redis_client, monkeypatch):
+    # the pipelines created by onredis
+    pipelines = []
+    pipeline = redis_client.pipeline
+
+    def recorded_pipeline(*args, **kwargs):
+        pipelines.append(pipeline(*args, **kwargs))
+        return pipelines[-1]
+
+    monkeypatch.setattr(redis_client, "pipeline", recorded_pipeline)
+    return pipelines
+
+
+def test_writes_are_deferred_until_exit(redis_client, Player):
+    player = Player(id=1)
+    with player.batch():
+        player.score = 5
+        player.name = "bob"
+        player.inventory["sword"] = 1
+        player.inventory.update({"shield": 2})
+        player.history.append("joined")
+        # the writes are queued: nothing is sent yet
+        assert player.score == 3
+        assert player.name == ""
+        assert dict(player.inventory.items()) == {}
+        assert redis_client.keys("*Player:1*") == []
+        # the commands returning a value can't be queued
+        assert player.incr("score", 2) is None
+        with pytest.raises(ValueError):
+            player.history.pop()
+    assert player.fetch() == {
+        "score": 7,
+        "name": "bob",
+        "inventory": {"sword": 1, "shield": 2},
+        "history": ["joined"],
+    }
+
+
+def test_writes_are_discarded_on_exception(Player):
+    player = Player(id=1)
+    player.name = "bob"
+    with pytest.raises(KeyError):
+        with player.batch():
+            player.name = "lost"
+            raise KeyError
+    assert player.name == "bob"
+
+
+def test_nested_batch(Player):
+    alice, bob = Player(id=1), Player(id=2)
+    with onredis.batch(alice, bob):
+        alice.name = "alice"
+        with bob.batch():
+            bob.name = "bob"
+        # the nested batch is part of the outer batch
+        assert bob.name == ""
+    assert (alice.name, bob.name) == ("alice", "bob")
+
+
+def test_one_round_trip(Player, pipelines):
+    players = [Player(id=i) for i in range(10)]
+    # the pipelines of the schema checks
+    pipelines.clear()
+    with onredis.batch(*players):
+        for i, player in enumerate(players):
+            player.score = i
+            player.inventory["sword"] = 1
+    (batch_pipeline,) = pipelines
+    assert not batch_pipeline.transaction
+    assert [player.score for player in players] == list(range(10))
+
+
+def test_transaction_inside_a_batch(Player, pipelines):
+    alice, bob = Player(id=1), Player(id=2)
+    # the pipelines of the schema checks
+    pipelines.clear()
+    with onredis.batch(alice, bob):
+        alice.name = "alice"
+        with bob.transaction():
+            bob.score += 1
+            bob.name = "bob"
+        # the transaction uses its own pipeline: it is committed at its exit
+        assert bob.score == 4
+        assert bob.name == "bob"
+        assert alice.name == ""
+        batch_pipeline = pipelines[0]
+        assert not batch_pipeline.transaction
+        assert all(pipeline.transaction for pipeline in pipelines[1:])
+        # the batch only queued the write of alice
+        assert len(batch_pipeline) == 1
+    assert alice.name == "alice"
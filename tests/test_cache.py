@@ -0,0 +1,132 @@
+import time
+from typing import Dict
+
+import pytest
+import redis.exceptions
+
+from onredis import batch, onredis
+
+
+@pytest.fixture
+def Profile(field_cache):
+    @onredis(cache=True)
+    class Profile:
+        name: str = ""
+        tags: Dict[str, str] = {}
+
+    return Profile
+
+
+def name_key(profile):
+    return profile.__fields__["name"].storage_key(profile)
+
+
+def test_hits(redis_client, field_cache, Profile):
+    profile = Profile()
+    profile.name = "a"
+    profile.tags["x"] = "1"
+    assert profile.name == "a" and profile.tags["x"] == "1"
+    assert profile.name == "a" and profile.tags["x"] == "1"
+    assert field_cache.misses == 2 and field_cache.hits == 2
+    # the value of another client is not seen before the invalidation message
+    redis_client.set(name_key(profile), b"b")
+    assert profile.name == "a"
+
+
+def test_invalidation_message(redis_client, field_cache, Profile):
+    profile = Profile()
+    profile.name = "a"
+    assert profile.name == "a"
+    redis_client.set(name_key(profile), b"b")
+    field_cache.receive(field_cache.invalidation_message([name_key(profile)]))
+    assert profile.name == "b"
+    # FLUSHALL / FLUSHDB
+    redis_client.set(name_key(profile), b"c")
+    field_cache.receive(field_cache.invalidation_message(None))
+    assert len(field_cache) == 0
+    assert profile.name == "c"
+
+
+def test_local_writes_invalidate(redis_client, field_cache, Profile):
+    profile = Profile()
+    assert profile.name == "" and profile.tags.get("x") is None
+    profile.name = "a"
+    profile.tags["x"] = "1"
+    assert profile.name == "a" and profile.tags["x"] == "1"
+    with profile.transaction():
+        profile.name = "b"
+        profile.tags["x"] = "2"
+    assert profile.name == "b" and profile.tags["x"] == "2"
+    with batch(profile):
+        profile.name = "c"
+        profile.tags["x"] = "3"
+    assert profile.name == "c" and profile.tags["x"] == "3"
+
+
+def test_value_read_before_an_invalidation_is_not_stored(field_cache):
+    def loader():
+        # the key changes while the value is read
+        field_cache.invalidate(b"key")
+        return b"old"
+
+    assert field_cache.fetch(b"key", None, loader) == b"old"
+    assert len(field_cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted(field_cache):
+    for i in range(field_cache.max_size):
+        field_cache.fetch(b"key%d" % i, None, lambda: b"value")
+    field_cache.fetch(b"key0", None, lambda: b"value")
+    field_cache.fetch(b"hash", b"field", lambda: b"value")
+    assert len(field_cache) == field_cache.max_size
+    assert field_cache.evictions == 1
+    assert field_cache.fetch(b"key1", None, lambda: b"new") == b"new"
+    assert field_cache.fetch(b"key0", None, lambda: b"new") == b"value"
+
+
+def test_lost_connection_clears_the_cache(field_cache):
+    field_cache.fetch(b"key", None, lambda: b"value")
+    # the invalidation messages may have been lost
+    field_cache.receive(redis.exceptions.ConnectionError())
+    assert len(field_cache) == 0
+    assert field_cache.connections == 2
+
+
+def wait_until(predicate):
+    deadline = time.monotonic() + 5
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_values_read_while_disconnected_are_not_cached(field_cache):
+    field_cache.can_connect.clear()
+    try:
+        field_cache._connection.messages.put(redis.exceptions.ConnectionError())
+        wait_until(lambda: not field_cache._connected)
+        assert field_cache.fetch(b"key", None, lambda: b"stale") == b"stale"
+        assert len(field_cache) == 0
+    finally:
+        field_cache.can_connect.set()
+    wait_until(lambda: field_cache._connected)
+    assert field_cache.fetch(b"key", None, lambda: b"value") == b"value"
+    assert field_cache.fetch(b"key", None, lambda: b"new") == b"value"
+
+
+def test_invalidation_of_another_key_during_a_load(field_cache):
+    def loader():
+        field_cache.invalidate(b"other")
+        return b"value"
+
+    field_cache.fetch(b"key", None, loader)
+    assert field_cache.fetch(b"key", None, lambda: b"new") == b"value"
+    assert not field_cache._loads
+
+
+def test_failed_load(field_cache):
+    def loader():
+        raise redis.exceptions.ConnectionError()
+
+    with pytest.raises(redis.exceptions.ConnectionError):
+        field_cache.fetch(b"key", None, loader)
+    assert not field_cache._loads
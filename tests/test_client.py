@@ -0,0 +1,55 @@
+import asyncio
+
+import fakeredis
+import pytest
+import redis
+import redis.cluster
+
+import onredis
+import onredis.asyncio
+
+
+def test_replaced_pool_is_disconnected():
+    client = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+    pool = client.connection_pool
+    connection = pool.get_connection()
+    pool.release(connection)
+    closed = []
+    connection.disconnect = lambda *args: closed.append(connection)
+    try:
+        new_client = onredis.set_redis_client(client, max_connections=4, blocking=True)
+        assert new_client.connection_pool is not pool
+        assert new_client.connection_pool.max_connections == 4
+        assert closed == [connection]
+    finally:
+        onredis.set_redis_client(None)
+
+
+def test_replaced_asyncio_pool_is_disconnected():
+    async def main():
+        client = fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer())
+        pool = client.connection_pool
+        connection = await pool.get_connection()
+        await pool.release(connection)
+        closed = []
+
+        async def disconnect(*args, **kwargs):
+            closed.append(connection)
+
+        connection.disconnect = disconnect
+        new_client = onredis.asyncio.set_redis_client(client, max_connections=4)
+        assert new_client.connection_pool is not pool
+        # the event loop disconnects the pool
+        await asyncio.gather(*onredis.client._DISCONNECTING)
+        assert closed == [connection]
+
+    try:
+        asyncio.run(main())
+    finally:
+        onredis.asyncio.set_redis_client(None)
+
+
+def test_cluster_client_pool_options():
+    client = redis.cluster.RedisCluster.__new__(redis.cluster.RedisCluster)
+    with pytest.raises(ValueError):
+        onredis.set_redis_client(client, max_connections=4)
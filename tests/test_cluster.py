@@ -0,0 +1,59 @@
+from typing import Dict, List
+
+import pytest
+from redis.crc import key_slot
+
+from onredis import fetch_many, onredis, transaction
+
+
+@pytest.fixture
+def User(redis_client):
+    @onredis(cluster=True)
+    class User:
+        name: str = ""
+        score: int = 0
+        tags: Dict[str, int] = {}
+        items: List[int] = []
+
+    return User
+
+
+def test_key_names(redis_client, User):
+    user = User(id=1)
+    user.name = "a"
+    with user.transaction():
+        user.score += 3
+        user.tags["x"] = 1
+        user.items.append(2)
+    assert sorted(redis_client.keys()) == [
+        b"{tests.test_cluster.User:1}.items",
+        b"{tests.test_cluster.User:1}.name",
+        b"{tests.test_cluster.User:1}.score",
+        b"{tests.test_cluster.User:1}.tags",
+        b"{tests.test_cluster.User}!schema",
+    ]
+    assert user.fetch() == {"name": "a", "score": 3, "tags": {"x": 1}, "items": [2]}
+    # the objects are spread over the slots
+    assert key_slot(b"{tests.test_cluster.User:1}.name") != key_slot(
+        b"{tests.test_cluster.User:2}.name"
+    )
+
+
+def test_hash_layout_key_names(redis_client):
+    @onredis(cluster=True, layout="hash")
+    class Player:
+        name: str = ""
+        score: int = 0
+
+    player = Player(id=5)
+    player.name = "z"
+    assert redis_client.hkeys("{tests.test_cluster.Player:5}!fields") == [b"name"]
+    assert fetch_many(player, Player(id=6)) == [
+        {"name": "z", "score": 0},
+        {"name": "", "score": 0},
+    ]
+
+
+def test_several_objects_in_a_transaction(redis_client, User):
+    with pytest.raises(ValueError):
+        transaction(User(id=1), User(id=2))
@@ -0,0 +1,101 @@
+from typing import Counter, List, Set
+
+import pytest
+
+from onredis import onredis
+
+
+@pytest.fixture
+def Feed(redis_client):
+    @onredis
+    class Feed:
+        log: List[str] = []
+        tags: Set[int] = set()
+        hits: Counter[str] = {}
+
+    return Feed
+
+
+def test_list_proxy(Feed):
+    feed = Feed()
+    feed.log.append("a")
+    feed.log.extend(["b", "c", "d"])
+    feed.log.appendleft("z")
+    assert list(feed.log) == ["z", "a", "b", "c", "d"]
+    assert len(feed.log) == 5
+    assert (feed.log[0], feed.log[-1]) == ("z", "d")
+    assert feed.log[1:3] == ["a", "b"]
+    assert feed.log[:-1] == ["z", "a", "b", "c"]
+    assert feed.log[2:0] == []
+    assert "b" in feed.log and "q" not in feed.log
+    assert feed.log.pop() == "d"
+    assert feed.log.pop(0) == "z"
+    feed.log.remove("b")
+    feed.log[0] = "A"
+    assert list(feed.log) == ["A", "c"]
+    feed.log = ["x", "y"]
+    assert list(feed.log) == ["x", "y"]
+
+
+def test_set_proxy(Feed):
+    feed = Feed()
+    feed.tags.add(1)
+    feed.tags.update([2, 3], {4})
+    feed.tags.discard(4)
+    feed.tags.discard(5)
+    assert set(feed.tags) == {1, 2, 3}
+    assert len(feed.tags) == 3
+    assert 2 in feed.tags and 4 not in feed.tags
+    with pytest.raises(KeyError):
+        feed.tags.remove(4)
+    feed.tags = {7, 8}
+    assert set(feed.tags) == {7, 8}
+
+
+def test_sorted_set_proxy(Feed):
+    feed = Feed()
+    feed.hits.incr("x")
+    feed.hits.incr("y", 5)
+    feed.hits["z"] = 2
+    assert feed.hits["x"] == 1
+    assert feed.hits["unknown"] == 0
+    assert feed.hits.most_common(2) == [("y", 5), ("z", 2)]
+    assert feed.hits.rank("y") == 2
+    assert feed.hits.range_by_score(2, 5) == [("z", 2), ("y", 5)]
+    assert dict(feed.hits.items()) == {"x": 1, "y": 5, "z": 2}
+    del feed.hits["z"]
+    assert "z" not in feed.hits and len(feed.hits) == 2
+    feed.hits = ["a", "a", "b"]
+    assert dict(feed.hits.items()) == {"a": 2, "b": 1}
+
+
+def test_local_copies_in_a_transaction(redis_client, Feed):
+    feed = Feed()
+    feed.log.extend(["a", "b"])
+    feed.tags.update([1, 2])
+    feed.hits.update({"x": 1, "z": 2})
+    with feed.transaction():
+        feed.log.append("c")
+        feed.tags.add(9)
+        feed.tags.discard(1)
+        feed.hits["x"] += 10
+        del feed.hits["z"]
+        # the local copies are Python objects, Redis is unchanged until the exit
+        assert isinstance(feed.log, list) and isinstance(feed.tags, set)
+        assert redis_client.llen(Feed.__fields__["log"].redis_key(feed)) == 2
+    assert feed.fetch() == {
+        "log": ["a", "b", "c"],
+        "tags": {2, 9},
+        "hits": {"x": 11},
+    }
+
+
+def test_discarded_transaction_does_not_change_the_collections(Feed):
+    feed = Feed()
+    feed.log.append("a")
+    with feed.transaction() as transaction:
+        feed.log.append("b")
+        feed.tags.add(1)
+        transaction.discard()
+    assert list(feed.log) == ["a"]
+    assert set(feed.tags) == set()
@@ -0,0 +1,69 @@
+from typing import Any, Dict, List
+
+import pytest
+
+from onredis import onredis
+from onredis.fields import BytesField, CompressedField, StrField, register_codec
+from onredis.fields.compressed_field import MAGIC
+
+
+@pytest.fixture
+def Document(redis_client):
+    @onredis(compression=True)
+    class Document:
+        text: str = ""
+        data: Any = None
+        pages: List[str] = []
+        meta: Dict[str, Any] = {}
+
+    return Document
+
+
+def test_round_trip(redis_client, Document):
+    document = Document()
+    text = "x" * 10000
+    document.text = text
+    document.data = {"values": list(range(1000))}
+    document.pages.append(text)
+    document.meta["big"] = [text]
+    document.meta["small"] = 1
+    assert document.text == text
+    assert document.data == {"values": list(range(1000))}
+    assert document.pages[0] == text
+    assert document.meta["big"] == [text] and document.meta["small"] == 1
+    raw = redis_client.get("tests.test_compression.Document.text")
+    assert raw.startswith(MAGIC) and len(raw) < 1000
+    # small values are not compressed
+    assert (
+        redis_client.hget("tests.test_compression.Document.meta", "small")[:4] != MAGIC
+    )
+
+
+def test_uncompressed_values_are_read(redis_client):
+    field = CompressedField(StrField(""), threshold=10)
+    assert field.deserialize(StrField("").serialize("a" * 100)) == "a" * 100
+    # a value starting with the marker is escaped
+    escaped = CompressedField(BytesField(b""), threshold=10)
+    assert escaped.serialize(MAGIC + b"a") != MAGIC + b"a"
+    assert escaped.deserialize(escaped.serialize(MAGIC + b"a")) == MAGIC + b"a"
+    assert field.deserialize(field.serialize("é" * 100)) == "é" * 100
+
+
+def test_registered_codec(redis_client):
+    register_codec("reverse", 200, lambda raw: raw[::-1][:-10], lambda raw: raw)
+    field = CompressedField(StrField(""), codec="reverse", threshold=10)
+    raw = field.serialize("a" * 100)
+    assert raw.startswith(MAGIC + bytes((200,)))
+    with pytest.raises(ValueError):
+        CompressedField(StrField(""), codec="unknown")
+
+
+def test_transaction_changes_in_place(redis_client, Document):
+    document = Document()
+    document.meta["items"] = [1]
+    with document.transaction():
+        document.meta["items"].append(2)
+    assert document.meta["items"] == [1, 2]
+    with document.transaction(lazy=True):
+        document.meta["items"].append(3)
+    assert document.meta["items"] == [1, 2, 3]
@@ -0,0 +1,94 @@
+from typing import Dict
+
+import pytest
+import redis.exceptions
+
+from onredis import onredis
+
+
+@pytest.fixture
+def Scores(redis_client):
+    @onredis
+    class Scores:
+        per_user: Dict[str, int] = {}
+
+    return Scores
+
+
+def test_keys_without_values(redis_client, Scores, monkeypatch):
+    scores = Scores()
+    scores.per_user.update({f"u{i}": i for i in range(50)})
+    hscan = redis_client.hscan
+    calls = []
+
+    def recorded_hscan(*args, **kwargs):
+        calls.append(kwargs.get("no_values"))
+        return hscan(*args, **kwargs)
+
+    monkeypatch.setattr(redis_client, "hscan", recorded_hscan)
+    assert sorted(scores.per_user.keys(batch_size=10)) == sorted(
+        f"u{i}" for i in range(50)
+    )
+    assert set(calls) == {True}
+
+
+def test_keys_without_novalues_support(redis_client, Scores, monkeypatch):
+    scores = Scores()
+    scores.per_user.update({f"u{i}": i for i in range(50)})
+    hscan = redis_client.hscan
+
+    def old_hscan(*args, no_values=None, **kwargs):
+        if no_values:
+            raise redis.exceptions.ResponseError("syntax error")
+        return hscan(*args, **kwargs)
+
+    monkeypatch.setattr(redis_client, "hscan", old_hscan)
+    assert len(set(scores.per_user)) == 50
+
+
+def test_bulk_methods(redis_client, Scores):
+    scores = Scores()
+    scores.per_user.update({"a": 1, "b": 2}, c=3)
+    scores.per_user.update({})
+    assert scores.per_user.get_many(["a", "c", "z"], default=-1) == [1, 3, -1]
+    assert scores.per_user.get_many([]) == []
+    assert scores.per_user.delete_many(["a", "z"]) == 1
+    assert scores.per_user.delete_many([]) == 0
+    assert dict(scores.per_user.items()) == {"b": 2, "c": 3}
+
+
+def test_setdefault_and_pop(redis_client, Scores):
+    scores = Scores()
+    assert scores.per_user.setdefault("a", 1) == 1
+    assert scores.per_user.setdefault("a", 2) == 1
+    assert scores.per_user.pop("a") == 1
+    assert scores.per_user.pop("a", None) is None
+    with pytest.raises(KeyError):
+        scores.per_user.pop("a")
+    assert len(scores.per_user) == 0
+
+
+def test_incr(redis_client):
+    @onredis(native_numbers=True)
+    class Counters:
+        hits: Dict[str, int] = {}
+
+    counters = Counters()
+    assert counters.hits.incr("a") == 1
+    assert counters.hits.incr("a", 4) == 5
+    assert counters.hits["a"] == 5
+
+
+def test_incr_of_packed_values(redis_client, Scores):
+    with pytest.raises(TypeError):
+        Scores().per_user.incr("a")
+
+
+def test_bulk_methods_in_a_transaction(redis_client, Scores):
+    scores = Scores()
+    scores.per_user["a"] = 1
+    with scores.transaction():
+        scores.per_user.update({"b": 2})
+        assert scores.per_user.setdefault("a", 5) == 1
+        assert scores.per_user.pop("a") == 1
+    assert dict(scores.per_user.items()) == {"b": 2}
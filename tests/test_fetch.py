@@ -0,0 +1,82 @@
+from typing import Dict, List, Set
+
+import pytest
+
+from onredis import fetch_many, onredis
+
+
+@pytest.fixture
+def round_trips(redis_client, monkeypatch):
+    """Count the commands and the pipelines sent by redis_client."""
+    counts = {"commands": 0, "pipelines": 0}
+    execute_command = redis_client.execute_command
+    pipeline = redis_client.pipeline
+
+    def counted_execute_command(*args, **kwargs):
+        counts["commands"] += 1
+        return execute_command(*args, **kwargs)
+
+    def counted_pipeline(*args, **kwargs):
+        counted = pipeline(*args, **kwargs)
+        execute = counted.execute
+
+        def counted_execute(*args, **kwargs):
+            counts["pipelines"] += 1
+            return execute(*args, **kwargs)
+
+        counted.execute = counted_execute
+        return counted
+
+    monkeypatch.setattr(redis_client, "execute_command", counted_execute_command)
+    monkeypatch.setattr(redis_client, "pipeline", counted_pipeline)
+    return counts
+
+
+def test_fetch(redis_client, round_trips):
+    @onredis
+    class User:
+        name: str = ""
+        age: int = 0
+        scores: Dict[str, int] = {}
+        tags: Set[str] = set()
+        history: List[int] = []
+
+    user = User(id=1)
+    user.name = "alice"
+    user.scores["a"] = 1
+    user.tags.add("x")
+    user.history.append(3)
+    round_trips.update(commands=0, pipelines=0)
+    assert user.fetch() == {
+        "name": "alice",
+        "age": 0,
+        "scores": {"a": 1},
+        "tags": {"x"},
+        "history": [3],
+    }
+    assert user.fetch("name", "scores") == {"name": "alice", "scores": {"a": 1}}
+    assert round_trips == {"commands": 0, "pipelines": 2}
+
+
+def test_fetch_many(redis_client, round_trips):
+    @onredis
+    class Player:
+        name: str = ""
+        scores: Dict[str, int] = {}
+
+    @onredis(layout="hash")
+    class Team:
+        name: str = ""
+        size: int = 0
+
+    a, b, team = Player(id="a"), Player(id="b"), Team()
+    a.name = "alice"
+    b.scores["x"] = 2
+    team.size = 2
+    round_trips.update(commands=0, pipelines=0)
+    assert fetch_many(a, b, team) == [
+        {"name": "alice", "scores": {}},
+        {"name": "", "scores": {"x": 2}},
+        {"name": "", "size": 2},
+    ]
+    assert round_trips == {"commands": 0, "pipelines": 1}
@@ -0,0 +1,133 @@
+import math
+from typing import Dict
+
+import pytest
+import redis.exceptions
+
+from onredis import (
+    MetricsAggregator,
+    disable_instrumentation,
+    enable_instrumentation,
+    onredis,
+)
+from onredis.instrumentation import InstrumentedConnection, instrument_client
+
+
+@pytest.fixture
+def metrics(redis_client):
+    metrics = enable_instrumentation()
+    yield metrics
+    disable_instrumentation()
+
+
+@pytest.fixture
+def Player(redis_client):
+    @onredis(native_numbers=True)
+    class Player:
+        score: int = 0
+        name: str = ""
+        inventory: Dict[str, int] = {}
+
+    return Player
+
+
+def operations(metrics):
+    return {
+        (operation["field"], operation["operation"]): operation
+        for operation in metrics.snapshot()["operations"]
+    }
+
+
+def test_aggregator():
+    metrics = MetricsAggregator(buckets=(0.01, 0.1, math.inf))
+    metrics.record("Player", "score", "get", 0.005, 1, 10, 4, False)
+    metrics.record("Player", "score", "get", 0.05, 1, 10, 4, True)
+    metrics.record("Player", "score", "get", 5.0, 2, 20, 8, False)
+    metrics.conflict("Player")
+    snapshot = metrics.snapshot()
+    (operation,) = snapshot["operations"]
+    assert operation["class"] == "Player"
+    assert operation["count"] == 3
+    assert operation["errors"] == 1
+    assert operation["round_trips"] == 4
+    assert operation["bytes_sent"] == 40
+    assert operation["bytes_received"] == 16
+    assert list(operation["latency_buckets"].values()) == [1, 1, 1]
+    assert snapshot["conflicts"] == {"Player": 1}
+
+    text = metrics.prometheus()
+    labels = 'class="Player",field="score",operation="get"'
+    assert f"onredis_operations_total{{{labels}}} 3" in text
+    assert f"onredis_operation_errors_total{{{labels}}} 1" in text
+    # the histogram buckets are cumulative
+    assert f'onredis_operation_duration_seconds_bucket{{{labels},le="0.1"}} 2' in text
+    assert f'onredis_operation_duration_seconds_bucket{{{labels},le="+Inf"}} 3' in text
+    assert 'onredis_transaction_conflicts_total{class="Player"} 1' in text
+
+    metrics.reset()
+    assert metrics.snapshot() == {"operations": [], "conflicts": {}}
+
+
+def test_field_operations(metrics, Player):
+    player = Player()
+    player.score = 5
+    assert player.score == 5
+    player.inventory["sword"] = 1
+    player.inventory.update({"shield": 1})
+    ops = operations(metrics)
+    assert ops[("score", "set")]["count"] == 1
+    assert ops[("score", "get")]["count"] == 1
+    assert ops[("inventory", "setitem")]["count"] == 1
+    assert ops[("inventory", "update")]["count"] == 1
+    # the connections of the client count the round trips and the bytes
+    assert ops[("score", "get")]["round_trips"] == 1
+    assert ops[("score", "set")]["bytes_sent"] > 0
+    assert ops[("score", "get")]["bytes_received"] > 0
+
+
+def test_nested_operations_are_not_counted_twice(metrics, Player):
+    player = Player()
+    player.score = 1
+    metrics.reset()
+    with player.transaction():
+        # incr() is measured outside a transaction
+        assert player.incr("score") == 2
+        player.name = "bob"
+    ops = operations(metrics)
+    # the field operations inside the transaction are part of the transaction
+    assert list(ops) == [(None, "transaction")]
+    transaction = ops[(None, "transaction")]
+    assert transaction["count"] == 1
+    # WATCH, the reads, MULTI / EXEC... are counted once, by the transaction
+    assert transaction["round_trips"] > 1
+    assert player.score == 2
+
+
+def test_conflict(redis_client, metrics, Player):
+    player = Player()
+    with pytest.raises(redis.exceptions.WatchError):
+        with player.transaction():
+            player.score += 1
+            redis_client.set(Player.__fields__["score"].redis_key(player), b"9")
+    snapshot = metrics.snapshot()
+    assert snapshot["conflicts"] == {Player._redis_prefix: 1}
+    assert operations(metrics)[(None, "transaction")]["errors"] == 1
+
+
+def test_disabled(metrics, Player):
+    disable_instrumentation()
+    player = Player()
+    player.score = 1
+    assert metrics.snapshot()["operations"] == []
+
+
+def test_instrument_client(redis_client):
+    instrument_client(redis_client)
+    connection_class = redis_client.connection_pool.connection_class
+    assert issubclass(connection_class, InstrumentedConnection)
+    # idempotent
+    instrument_client(redis_client)
+    assert redis_client.connection_pool.connection_class is connection_class
+    # no measure: the commands are not counted
+    redis_client.set("key", "value")
+    assert redis_client.get("key") == b"value"
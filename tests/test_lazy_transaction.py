@@ -0,0 +1,79 @@
+from typing import Dict
+
+import pytest
+import redis.exceptions
+
+from onredis import onredis
+
+
+@pytest.fixture
+def Scores(redis_client):
+    @onredis
+    class Scores:
+        total: float = 0
+        count: int = 0
+        per_user: Dict[str, float] = {}
+
+    return Scores
+
+
+def key(obj, name):
+    return obj.__fields__[name].storage_key(obj)
+
+
+def test_only_the_accessed_fields_are_watched(redis_client, Scores):
+    scores = Scores()
+    with scores.transaction(lazy=True) as transaction:
+        scores.count += 1
+        assert transaction.watched_keys == {key(scores, "count")}
+        # another client changes a field not accessed: no conflict
+        redis_client.set(key(scores, "total"), Scores.__fields__["total"].serialize(2.5))
+    assert scores.count == 1 and scores.total == 2.5
+
+
+def test_conflict_on_an_accessed_field(redis_client, Scores):
+    scores = Scores()
+    with pytest.raises(redis.exceptions.WatchError):
+        with scores.transaction(lazy=True):
+            count = scores.count
+            redis_client.set(key(scores, "count"), (9).to_bytes(4, "big"))
+            scores.count = count + 1
+    assert scores.count == 9
+    assert Scores.transaction_stats.conflicts == 1
+
+
+def test_set_without_read_is_not_watched(redis_client, Scores):
+    scores = Scores()
+    scores.total = 1.0
+    with scores.transaction(lazy=True) as transaction:
+        scores.count = 5
+        assert not transaction.watched_keys
+    assert scores.count == 5 and scores.total == 1.0
+
+
+def test_lazy_dictionary(redis_client, Scores):
+    scores = Scores()
+    scores.per_user.update({"a": 2.0, "c": 1.0})
+    with scores.transaction(lazy=True):
+        scores.per_user["b"] = scores.per_user["a"] + 1
+        del scores.per_user["c"]
+        assert "c" not in scores.per_user and "z" not in scores.per_user
+    assert dict(scores.per_user.items()) == {"a": 2.0, "b": 3.0}
+
+
+def test_conflict_on_an_accessed_dictionary(redis_client, Scores):
+    scores = Scores()
+    scores.per_user["a"] = 1.0
+    with pytest.raises(redis.exceptions.WatchError):
+        with scores.transaction(lazy=True):
+            scores.per_user["a"] += 1
+            redis_client.hset(key(scores, "per_user"), "z", b"x")
+    assert scores.per_user["a"] == 1.0
+
+
+def test_discard(redis_client, Scores):
+    scores = Scores()
+    with scores.transaction(lazy=True) as transaction:
+        scores.count = 3
+        transaction.discard()
+    assert scores.count == 0
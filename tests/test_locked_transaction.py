@@ -0,0 +1,142 @@
+import threading
+import time
+
+import pytest
+import redis.exceptions
+
+from onredis import TransactionMode, onredis, transaction
+
+
+def test_locked_transactions_do_not_conflict(redis_client):
+    @onredis(transaction_mode="locked")
+    class Counter:
+        n: int = 0
+
+    counter = Counter()
+
+    def work():
+        for _ in range(20):
+            with counter.transaction():
+                counter.n += 1
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counter.n == 80
+    assert Counter.transaction_stats.conflicts == 0
+    assert Counter.transaction_stats.locked == 80
+    assert not redis_client.exists(counter._lock_name())
+
+
+def test_lock_is_extended(redis_client):
+    @onredis(transaction_mode=TransactionMode("locked", lock_timeout=0.3))
+    class Slow:
+        n: int = 0
+
+    slow = Slow()
+    with slow.transaction():
+        time.sleep(0.5)
+        assert redis_client.exists(slow._lock_name())
+        slow.n = 5
+    assert slow.n == 5
+    assert not redis_client.exists(slow._lock_name())
+
+
+def test_lock_blocking_timeout(redis_client):
+    @onredis(transaction_mode=TransactionMode("locked", blocking_timeout=0.05))
+    class Busy:
+        n: int = 0
+
+    busy = Busy()
+    redis_client.set(busy._lock_name(), b"other")
+    with pytest.raises(redis.exceptions.LockError):
+        with busy.transaction():
+            pass
+    assert not busy._local_copy
+
+
+def test_adaptive_mode(redis_client):
+    @onredis(
+        transaction_mode=TransactionMode("adaptive", lock_above=0.3, unlock_below=0.1)
+    )
+    class Hot:
+        n: int = 0
+
+    hot = Hot()
+    key = Hot.__fields__["n"].storage_key(hot)
+    for _ in range(7):
+        with pytest.raises(redis.exceptions.WatchError):
+            with hot.transaction():
+                hot.n += 1
+                # another client changes the field
+                redis_client.set(key, (99).to_bytes(4, "big"))
+    assert Hot.transaction_stats.recent_conflict_rate > 0.3
+    with hot.transaction():
+        hot.n = 1
+    assert Hot._transaction_mode.locked
+    assert Hot.transaction_stats.locked == 1
+    # without conflict, the transactions are optimistic again
+    for _ in range(60):
+        with hot.transaction():
+            hot.n += 1
+    assert not Hot._transaction_mode.locked
+    assert hot.n == 61
+
+
+def test_optimistic_transaction_watches_the_lock(redis_client):
+    @onredis(transaction_mode="adaptive")
+    class Hot:
+        n: int = 0
+
+    hot = Hot()
+    with pytest.raises(redis.exceptions.WatchError):
+        with hot.transaction():
+            hot.n = 1
+            # a locked transaction of another process
+            redis_client.set(hot._lock_name(), b"other")
+    assert hot.n == 0
+
+
+def test_lost_lock(redis_client):
+    @onredis(transaction_mode="locked")
+    class Counter:
+        n: int = 0
+
+    counter = Counter()
+    for lazy in (False, True):
+        with pytest.raises(redis.exceptions.LockNotOwnedError):
+            with counter.transaction(lazy=lazy):
+                counter.n = 1
+                # the lock has expired and another process has taken it
+                redis_client.set(counter._lock_name(), b"other")
+        assert not counter._local_copy
+        assert counter.n == 0
+        # the lock of the other process is not released
+        assert redis_client.get(counter._lock_name()) == b"other"
+        redis_client.delete(counter._lock_name())
+
+
+def test_lost_lock_in_a_multi_object_transaction(redis_client):
+    @onredis(transaction_mode="locked")
+    class Counter:
+        n: int = 0
+
+    @onredis
+    class Total:
+        n: int = 0
+
+    counter, total = Counter(), Total()
+    with pytest.raises(redis.exceptions.LockNotOwnedError):
+        with transaction(counter, total):
+            counter.n = 1
+            total.n = 1
+            redis_client.delete(counter._lock_name())
+    assert not counter._local_copy and not total._local_copy
+    assert counter.n == 0 and total.n == 0
+    # the objects are not locked anymore
+    with transaction(counter, total):
+        counter.n = 2
+        total.n = 2
+    assert counter.n == 2 and total.n == 2
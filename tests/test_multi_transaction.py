@@ -0,0 +1,108 @@
+import threading
+from typing import Dict, List
+
+import pytest
+import redis.exceptions
+
+from onredis import onredis, transaction
+
+
+@pytest.fixture
+def classes(redis_client):
+    @onredis
+    class Account:
+        balance: int = 0
+        log: List[str] = []
+
+    @onredis(layout="hash", native_numbers=True)
+    class Bank:
+        total: int = 0
+        per_account: Dict[str, int] = {}
+
+    @onredis(transaction_mode="locked")
+    class Hot:
+        n: int = 0
+
+    return Account, Bank, Hot
+
+
+def test_commit(redis_client, classes):
+    Account, Bank, Hot = classes
+    a, b, bank, hot = Account(id="a"), Account(id="b"), Bank(), Hot()
+    a.balance = 100
+    # a repeated object is in the transaction once
+    with transaction(a, b, bank, a, hot):
+        assert a.balance == 100 and bank.total == 0
+        a.balance -= 30
+        b.balance += 30
+        a.log.append("out")
+        bank.total += 1
+        bank.per_account["a"] = 1
+        hot.n += 1
+        assert redis_client.exists(hot._lock_name())
+    assert a.balance == 70 and b.balance == 30 and list(a.log) == ["out"]
+    assert bank.total == 1 and bank.per_account["a"] == 1 and hot.n == 1
+    assert not redis_client.exists(hot._lock_name())
+    assert Account.transaction_stats.attempts == 2
+    assert Hot.transaction_stats.locked == 1
+
+
+def test_conflict(redis_client, classes):
+    Account, _, _ = classes
+    a, b = Account(id="a"), Account(id="b")
+    a.balance = 70
+    with pytest.raises(redis.exceptions.WatchError):
+        with transaction(a, b):
+            a.balance = 0
+            b_key = Account.__fields__["balance"].storage_key(b)
+            redis_client.set(b_key, (5).to_bytes(4, "big"))
+    assert a.balance == 70 and b.balance == 5
+    assert not a._local_copy and not b._local_copy
+
+
+def test_exception_and_discard(redis_client, classes):
+    Account, _, _ = classes
+    a, b = Account(id="a"), Account(id="b")
+    a.balance = 70
+    with pytest.raises(KeyError):
+        with transaction(a, b):
+            a.balance = 1
+            raise KeyError
+    assert a.balance == 70
+    with transaction(a, b) as multi_transaction:
+        a.balance = 2
+        multi_transaction.discard()
+    assert a.balance == 70
+
+
+def test_concurrent_transfers(redis_client, classes):
+    Account, _, _ = classes
+    a, b = Account(id="a"), Account(id="b")
+    a.balance = 100
+
+    def transfer():
+        for _ in range(20):
+            while True:
+                try:
+                    with transaction(a, b):
+                        a.balance -= 1
+                        b.balance += 1
+                    break
+                except redis.exceptions.WatchError:
+                    pass
+
+    threads = [threading.Thread(target=transfer) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert a.balance == 20 and b.balance == 80
+
+
+def test_object_already_in_a_transaction(redis_client, classes):
+    Account, _, _ = classes
+    a, b = Account(id="a"), Account(id="b")
+    with pytest.raises(ValueError):
+        with a.transaction():
+            with transaction(a, b):
+                pass
@@ -0,0 +1,87 @@
+import threading
+from typing import Dict
+
+import pytest
+
+from onredis import onredis
+
+
+@pytest.fixture
+def Scores(redis_client):
+    @onredis(native_numbers=True)
+    class Scores:
+        total: float = 0
+        count: int = 10
+        per_user: Dict[str, float] = {}
+        hits: Dict[str, int] = {}
+
+    return Scores
+
+
+def test_encoding(redis_client, Scores):
+    scores = Scores()
+    scores.count = 42
+    scores.total = 1.5
+    scores.hits["a"] = 3
+    assert redis_client.get("tests.test_native_numbers.Scores.count") == b"42"
+    assert redis_client.get("tests.test_native_numbers.Scores.total") == b"1.5"
+    assert redis_client.hget("tests.test_native_numbers.Scores.hits", "a") == b"3"
+    assert scores.count == 42 and scores.total == 1.5 and scores.hits["a"] == 3
+
+
+def test_incr(redis_client, Scores):
+    scores = Scores()
+    # the default value is the starting value
+    assert scores.incr("count") == 11
+    assert scores.incr("count", -5) == 6
+    assert scores.incr("total", 2.5) == 2.5
+    assert scores.count == 6 and scores.total == 2.5
+
+
+def test_concurrent_incr(redis_client, Scores):
+    scores = Scores()
+
+    def work():
+        for _ in range(100):
+            scores.incr("count")
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert scores.count == 410
+
+
+def test_dict_incr(redis_client, Scores):
+    scores = Scores()
+    assert scores.dict_incr("per_user", "a", 1.5) == 1.5
+    assert scores.dict_incr("hits", "a") == 1
+    assert scores.per_user.incr("a", 1) == 2.5
+    assert scores.per_user["a"] == 2.5 and scores.hits["a"] == 1
+
+
+def test_incr_in_a_transaction(redis_client, Scores):
+    scores = Scores()
+    scores.hits["a"] = 1
+    with scores.transaction():
+        assert scores.incr("count", 5) == 15
+        assert scores.dict_incr("hits", "a", 2) == 3
+        assert scores.dict_incr("hits", "b", 3) == 3
+        # not written yet
+        assert redis_client.hget("tests.test_native_numbers.Scores.hits", "b") is None
+    assert scores.count == 15
+    assert dict(scores.hits.items()) == {"a": 3, "b": 3}
+
+
+def test_incr_errors(redis_client):
+    @onredis
+    class Packed:
+        count: int = 0
+        per_user: Dict[str, int] = {}
+
+    packed = Packed()
+    with pytest.raises(TypeError):
+        packed.incr("count")
+    with pytest.raises(TypeError):
+        packed.dict_incr("count", "a")
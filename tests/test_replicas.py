@@ -0,0 +1,64 @@
+from typing import Dict, List
+
+import fakeredis
+import pytest
+
+from onredis import onredis, set_read_replicas
+
+
+@pytest.fixture
+def replicas(redis_client):
+    # two replicas with different contents: a read shows which one was used
+    replicas = [fakeredis.FakeRedis(server=fakeredis.FakeServer()) for _ in range(2)]
+    yield replicas
+    set_read_replicas()
+
+
+def test_list_iteration_uses_one_replica(redis_client, replicas):
+    @onredis
+    class Items:
+        values: List[str] = []
+
+    key = "tests.test_replicas.Items.values"
+    for i, replica in enumerate(replicas):
+        replica.rpush(key, *[f"{i}-{j}".encode() for j in range(10)])
+    set_read_replicas(replicas)
+    items = Items()
+    for _ in range(2):
+        values = list(items.values.__iter__(batch_size=3))
+        assert len(values) == 10
+        assert len({v.split("-")[0] for v in values}) == 1
+
+
+def test_dict_iteration_uses_one_replica(redis_client, replicas):
+    @onredis
+    class Scores:
+        per_user: Dict[str, str] = {}
+
+    key = "tests.test_replicas.Scores.per_user"
+    for i, replica in enumerate(replicas):
+        replica.hset(key, mapping={f"k{j}": str(i) for j in range(50)})
+    set_read_replicas(replicas)
+    scores = Scores()
+    for _ in range(2):
+        values = list(scores.per_user.values(batch_size=5))
+        assert len(values) == 50
+        assert len(set(values)) == 1
+
+
+def test_cache_is_filled_from_the_primary(redis_client, replicas, field_cache):
+    @onredis(cache=True)
+    class Profile:
+        name: str = ""
+        tags: Dict[str, str] = {}
+
+    profile = Profile()
+    profile.name = "primary"
+    profile.tags["a"] = "primary"
+    # the replicas lag behind: they do not have the values yet
+    set_read_replicas(replicas)
+    assert profile.name == "primary"
+    assert profile.tags["a"] == "primary"
+    assert field_cache.misses == 2
+    assert profile.name == "primary"
+    assert field_cache.hits == 1
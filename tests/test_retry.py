@@ -0,0 +1,87 @@
+import pytest
+import redis.exceptions
+
+from onredis import RetryPolicy, onredis, run_transaction, transactional
+
+
+@pytest.fixture
+def Scores(redis_client):
+    @onredis
+    class Scores:
+        count: int = 0
+
+        @transactional
+        def incr(self):
+            self.count += 1
+            return self.count
+
+    return Scores
+
+
+def conflict(redis_client, conflicts):
+    """Return a function changing count from another client during the first
+    conflicts transactions."""
+    runs = []
+
+    def func(scores):
+        runs.append(scores.count)
+        scores.count += 1
+        if len(runs) <= conflicts:
+            key = scores.__fields__["count"].storage_key(scores)
+            redis_client.set(key, (100 + len(runs)).to_bytes(4, "big"))
+        return len(runs)
+
+    return func, runs
+
+
+def test_transactional(redis_client, Scores):
+    scores = Scores()
+    assert scores.incr() == 1 and scores.incr() == 2
+    stats = Scores.transaction_stats
+    assert stats.attempts == 2 and stats.conflicts == 0 and stats.retries == 0
+
+
+def test_retry_on_conflict(redis_client, Scores):
+    scores = Scores()
+    func, runs = conflict(redis_client, 2)
+    assert scores.run_transaction(func, scores) == 3
+    # the last run reads the value written by the other client
+    assert runs == [0, 101, 102] and scores.count == 103
+    stats = Scores.transaction_stats
+    assert stats.attempts == 3 and stats.conflicts == 2 and stats.retries == 2
+    assert stats.exhausted == 0 and stats.conflict_rate == pytest.approx(2 / 3)
+
+
+def test_max_attempts(redis_client, Scores):
+    scores = Scores()
+    func, runs = conflict(redis_client, 10)
+    policy = RetryPolicy(max_attempts=3, base_delay=0)
+    with pytest.raises(redis.exceptions.WatchError):
+        run_transaction(scores, func, scores, policy=policy)
+    # max_attempts runs, the first one included
+    assert len(runs) == 3
+    stats = Scores.transaction_stats
+    assert stats.retries == 2 and stats.exhausted == 1
+
+
+def test_budget(redis_client, Scores):
+    scores = Scores()
+    func, runs = conflict(redis_client, 10)
+    policy = RetryPolicy(max_attempts=100, base_delay=1, max_delay=1, budget=0)
+    with pytest.raises(redis.exceptions.WatchError):
+        run_transaction(scores, func, scores, policy=policy)
+    assert len(runs) == 1
+    assert Scores.transaction_stats.exhausted == 1
+
+
+def test_delay():
+    policy = RetryPolicy(base_delay=0.01, max_delay=0.05)
+    assert all(0 <= policy.delay(1) <= 0.02 for _ in range(100))
+    assert all(0 <= policy.delay(10) <= 0.05 for _ in range(100))
+
+
+def test_stats_reset(redis_client, Scores):
+    Scores().incr()
+    Scores.transaction_stats.reset()
+    assert Scores.transaction_stats.attempts == 0
+    assert Scores.transaction_stats.conflict_rate == 0.0
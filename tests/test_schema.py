@@ -0,0 +1,110 @@
+import datetime
+from typing import Any, Dict
+
+from onredis import LazyLoadField, onredis
+from onredis.fields import StrField
+
+
+def test_unchanged_field_with_a_default_value_not_literal(redis_client):
+    @onredis
+    class Item:
+        day: Any = datetime.date(2020, 1, 1)
+
+    Item(id=1).day = datetime.date(2021, 5, 6)
+
+    @onredis
+    class Item:
+        day: Any = datetime.date(2020, 1, 1)
+        count: int = 0
+
+    item = Item(id=1)
+    assert item.day == datetime.date(2021, 5, 6)
+    assert item.count == 0
+
+
+def test_changed_default_value_not_literal(redis_client):
+    @onredis
+    class Item:
+        day: Any = datetime.date(2020, 1, 1)
+
+    Item(id=1).day = datetime.date(2021, 5, 6)
+
+    @onredis
+    class Item:
+        day: Any = datetime.date(2022, 1, 1)
+
+    assert Item(id=1).day == datetime.date(2021, 5, 6)
+
+
+def test_converted_field(redis_client):
+    @onredis
+    class Item:
+        count: int = 0
+        name: str = ""
+
+    Item(id=1).count = 42
+    Item(id=1).name = "a"
+
+    @onredis(native_numbers=True)
+    class Item:
+        count: int = 0
+        name: str = ""
+
+    item = Item(id=1)
+    assert item.count == 42 and item.name == "a"
+    assert redis_client.get("tests.test_schema.Item:1.count") == b"42"
+
+
+def test_removed_field(redis_client):
+    @onredis
+    class Item:
+        count: int = 0
+        tags: Dict[str, int] = {}
+
+    Item(id=1).count = 1
+    Item(id=1).tags["a"] = 1
+
+    @onredis
+    class Item:
+        name: str = ""
+
+    Item(id=1)
+    assert redis_client.keys("tests.test_schema.Item:1.*") == []
+
+
+def test_layout_change(redis_client):
+    @onredis
+    class Item:
+        count: int = 0
+        day: Any = datetime.date(2020, 1, 1)
+
+    Item(id=1).count = 7
+    Item(id=1).day = datetime.date(2021, 5, 6)
+
+    @onredis(layout="hash")
+    class Item:
+        count: int = 0
+        day: Any = datetime.date(2020, 1, 1)
+
+    item = Item(id=1)
+    assert item.count == 7 and item.day == datetime.date(2021, 5, 6)
+    assert redis_client.exists("tests.test_schema.Item:1!fields")
+    assert not redis_client.exists("tests.test_schema.Item:1.count")
+
+
+def test_lazy_load_field(redis_client):
+    def load(obj):
+        return str(obj._id)
+
+    @onredis
+    class Report:
+        data: str = LazyLoadField(load, ttl=60)
+
+    assert Report(id=1).data == "1"
+
+    # the field read from the stored schema has no loader
+    @onredis
+    class Report:
+        data: str = LazyLoadField(load, ttl=60, value_field=StrField(""))
+
+    assert Report(id=1).data == "1"
@@ -0,0 +1,38 @@
+from typing import Dict
+
+from onredis import onredis
+
+
+def test_untouched_fields_are_not_written(redis_client):
+    @onredis
+    class Account:
+        balance: int = 100
+        name: str = "anonymous"
+        tags: Dict[str, int] = {}
+
+    account = Account(id=1)
+    with account.transaction():
+        account.balance -= 10
+        assert account.name == "anonymous"
+    assert redis_client.keys("tests.test_transaction.Account:1.*") == [
+        b"tests.test_transaction.Account:1.balance"
+    ]
+    assert account.balance == 90 and account.name == "anonymous"
+    with account.transaction():
+        account.name = "alice"
+    assert account.name == "alice"
+
+
+def test_mutable_default_value(redis_client):
+    @onredis
+    class Basket:
+        items: list = []
+
+    a, b = Basket(id="a"), Basket(id="b")
+    with a.transaction():
+        a.items.append(1)
+    with b.transaction(lazy=True):
+        b.items.append(2)
+    assert a.items == [1] and b.items == [2]
+    assert Basket(id="c").items == []
+    assert Basket.__fields__["items"].default_value == []
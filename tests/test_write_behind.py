@@ -0,0 +1,116 @@
+import threading
+
+import pytest
+
+from onredis import flush_writes, onredis
+
+
+@pytest.fixture
+def Counters(write_buffer):
+    @onredis(native_numbers=True, write_behind=True)
+    class Counters:
+        hits: int = 0
+        views: int = 10
+        name: str = ""
+
+    return Counters
+
+
+def test_merge(redis_client, write_buffer, Counters):
+    counters = Counters(id=1)
+    counters.incr("hits")
+    counters.incr("hits", 2)
+    counters.incr("views")
+    counters.name = "a"
+    counters.name = "b"
+    assert len(write_buffer) == 3
+    assert counters.hits == 3 and counters.views == 11 and counters.name == "b"
+    assert redis_client.get("tests.test_write_behind.Counters:1.hits") is None
+    flush_writes()
+    assert len(write_buffer) == 0
+    assert redis_client.get("tests.test_write_behind.Counters:1.hits") == b"3"
+    assert counters.hits == 3 and counters.views == 11 and counters.name == "b"
+
+
+def test_set_then_incr(redis_client, write_buffer, Counters):
+    counters = Counters(id=1)
+    counters.hits = 10
+    counters.incr("hits", 5)
+    assert counters.hits == 15
+    flush_writes()
+    assert counters.hits == 15
+
+
+def test_transaction_flushes(redis_client, write_buffer, Counters):
+    counters = Counters(id=1)
+    counters.incr("hits")
+    with counters.transaction():
+        assert counters.hits == 1
+        counters.hits += 1
+    assert len(write_buffer) == 0
+    assert counters.hits == 2
+
+
+def test_rejected_write_is_dropped(redis_client, write_buffer, Counters):
+    good, bad = Counters(id=1), Counters(id=2)
+    # a key of another type: INCRBY fails
+    redis_client.rpush("tests.test_write_behind.Counters:2.hits", b"x")
+    good.incr("hits")
+    bad.incr("hits")
+    flush_writes()
+    assert write_buffer.dropped == 1
+    assert len(write_buffer) == 0
+    # the increment applied by Redis is not sent again
+    flush_writes()
+    flush_writes()
+    assert good.hits == 1
+    good.incr("hits")
+    flush_writes()
+    assert good.hits == 2
+
+
+def test_connection_error_keeps_the_writes(
+    redis_client, write_buffer, Counters, monkeypatch
+):
+    counters = Counters(id=1)
+    counters.incr("hits", 2)
+
+    class Broken(Exception):
+        pass
+
+    def pipeline(*args, **kwargs):
+        raise Broken()
+
+    monkeypatch.setattr(redis_client, "pipeline", pipeline)
+    with pytest.raises(Broken):
+        flush_writes()
+    counters.incr("hits")
+    monkeypatch.undo()
+    assert counters.hits == 3
+    flush_writes()
+    assert counters.hits == 3
+    assert redis_client.get("tests.test_write_behind.Counters:1.hits") == b"3"
+
+
+def test_read_during_flush(redis_client, write_buffer, Counters, monkeypatch):
+    counters = Counters(id=1)
+    counters.incr("hits", 4)
+    started, resume = threading.Event(), threading.Event()
+    original_pipeline = redis_client.pipeline
+
+    def pipeline(*args, **kwargs):
+        started.set()
+        resume.wait(5)
+        return original_pipeline(*args, **kwargs)
+
+    monkeypatch.setattr(redis_client, "pipeline", pipeline)
+    flusher = threading.Thread(target=flush_writes)
+    flusher.start()
+    started.wait(5)
+    values = []
+    reader = threading.Thread(target=lambda: values.append(counters.hits))
+    reader.start()
+    resume.set()
+    flusher.join()
+    reader.join()
+    assert values == [4]